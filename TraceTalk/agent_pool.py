@@ -0,0 +1,156 @@
+# Import basic libraries.
+import os
+import threading
+from typing import List, Optional
+
+# Import OpenAI API and Qdrant client.
+from openai import AsyncOpenAI, OpenAI
+from qdrant_client import AsyncQdrantClient, QdrantClient
+
+from answer_cache import AnswerCache
+from chatbot_agent import ChatbotAgent
+from context_expansion import ContextExpander
+from hybrid_search import BM25Index, HybridRetriever
+from local_index import AsyncLocalVectorIndex, LocalVectorIndex
+from src import EmbeddingService, get_embedding_service
+
+
+class AgentPool:
+    """
+    A class used to share the clients of the chatbot agents across requests.
+
+    The OpenAI and Qdrant clients are thread-safe and keep their connections
+    alive, so they are created once and every request only builds a
+    lightweight ChatbotAgent holding its own conversation state.
+    """
+
+    def __init__(
+        self,
+        openai_api_key: Optional[str] = None,
+        qdrant_url: Optional[str] = None,
+        qdrant_api_key: Optional[str] = None,
+        client: Optional[OpenAI] = None,
+        qdrant_client: Optional[QdrantClient] = None,
+        async_client: Optional[AsyncOpenAI] = None,
+        async_qdrant_client: Optional[AsyncQdrantClient] = None,
+        embedding_service: Optional[EmbeddingService] = None,
+        answer_cache: Optional[AnswerCache] = None,
+        bm25_index: Optional[BM25Index] = None,
+    ):
+        """
+        Initializes an instance of the AgentPool class.
+
+        Args:
+            openai_api_key (str): The API key provided by OpenAI to authenticate requests.
+            qdrant_url (str): The URL for the Qdrant service to connect with.
+            qdrant_api_key (str): The API key for the Qdrant service to authenticate requests.
+            client (OpenAI): An existing OpenAI client, used instead of creating one.
+            qdrant_client (QdrantClient): An existing Qdrant client, used instead of creating one.
+            async_client (AsyncOpenAI): An existing asynchronous OpenAI client, used instead of creating one.
+            async_qdrant_client (AsyncQdrantClient): An existing asynchronous Qdrant client, used instead of creating one.
+            embedding_service (EmbeddingService): An existing embedding service, used instead of the process one.
+            answer_cache (AnswerCache): An existing answer cache, used instead of creating one.
+            bm25_index (BM25Index): The BM25 index of the collection, or None to search the vectors only.
+        """
+        self.client = client or OpenAI(api_key=openai_api_key)
+        self.async_client = async_client or AsyncOpenAI(api_key=openai_api_key)
+        if qdrant_client is None:
+            qdrant_client = QdrantClient(
+                url=qdrant_url,
+                prefer_grpc=False,
+                api_key=qdrant_api_key,
+            )
+            qdrant_client.get_collections()  # Check the connection once, at startup.
+        self.qdrant_client = qdrant_client
+        self.async_qdrant_client = async_qdrant_client or AsyncQdrantClient(
+            url=qdrant_url,
+            prefer_grpc=False,
+            api_key=qdrant_api_key,
+        )
+        self.embedding_service = embedding_service or get_embedding_service()
+        # Shared, so the size of the collection is only counted once per version of the collection.
+        self.context_expander = ContextExpander(self.async_qdrant_client, "Articles")
+        self.answer_cache = answer_cache or AnswerCache()
+        self.retriever = HybridRetriever(
+            self.async_qdrant_client, self.embedding_service, bm25_index, "Articles"
+        )
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create an agent pool from the OPENAI_API_KEY, QDRANT_URL and QDRANT_API_KEY environment variables.
+
+        If LOCAL_INDEX_DIRECTORY is set, the book is searched in process with the
+        local index stored there, and no Qdrant server is needed. The BM25 index
+        is loaded from BM25_INDEX_DIRECTORY, or else from the local index. Without
+        it, the retrieval only fuses the title and content vector searches.
+
+        Returns:
+            agent_pool (AgentPool): The agent pool.
+        """
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        if not openai_api_key:
+            raise ValueError("OPENAI_API_KEY environment variable not set.")
+        local_index_directory = os.getenv("LOCAL_INDEX_DIRECTORY")
+        bm25_index_directory = os.getenv("BM25_INDEX_DIRECTORY") or local_index_directory
+        bm25_index = None
+        if bm25_index_directory and BM25Index.exists(bm25_index_directory):
+            bm25_index = BM25Index(bm25_index_directory)
+        else:
+            print(
+                "Warning: no BM25 index found, set BM25_INDEX_DIRECTORY to search the exact terms "
+                "of the questions too. Searching the title and content vectors only."
+            )
+        if local_index_directory:
+            local_index = LocalVectorIndex(local_index_directory)
+            return cls(
+                openai_api_key,
+                qdrant_client=local_index,
+                async_qdrant_client=AsyncLocalVectorIndex(local_index),
+                bm25_index=bm25_index,
+            )
+        qdrant_url = os.getenv("QDRANT_URL")
+        if not qdrant_url:
+            raise ValueError("QDRANT_URL environment variable not set.")
+        qdrant_api_key = os.getenv("QDRANT_API_KEY")
+        if not qdrant_api_key:
+            raise ValueError("QDRANT_API_KEY environment variable not set.")
+        return cls(openai_api_key, qdrant_url, qdrant_api_key, bm25_index=bm25_index)
+
+    def acquire(self, messages: Optional[List[str]] = None) -> ChatbotAgent:
+        """
+        Get a chatbot agent for one conversation, backed by the shared clients.
+
+        Args:
+            messages (List[str]): The messages of the conversation.
+
+        Returns:
+            chatbot_agent (ChatbotAgent): The chatbot agent of the conversation.
+        """
+        return ChatbotAgent(
+            messages=messages,
+            client=self.client,
+            qdrant_client=self.qdrant_client,
+            embedding_service=self.embedding_service,
+            async_client=self.async_client,
+            async_qdrant_client=self.async_qdrant_client,
+        )
+
+
+_agent_pool = None
+_agent_pool_lock = threading.Lock()
+
+
+def get_agent_pool():
+    """
+    Get the agent pool shared by the whole process, created from the environment variables.
+
+    Returns:
+        agent_pool (AgentPool): The shared agent pool.
+    """
+    global _agent_pool
+    if _agent_pool is None:
+        with _agent_pool_lock:
+            if _agent_pool is None:
+                _agent_pool = AgentPool.from_env()
+    return _agent_pool
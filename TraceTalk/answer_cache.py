@@ -0,0 +1,270 @@
+# Import basic libraries.
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Import Qdrant libraries.
+from qdrant_client import models
+
+# Distinct questions on the same topic often have a similarity of 0.93 to 0.97 with ada-002,
+# so only near paraphrases are answered from the cache.
+DEFAULT_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.97"))
+
+# The collection holding the version of every collection, as the payload of one point each.
+VERSIONS_COLLECTION = "collection_versions"
+
+CachedAnswer = namedtuple(
+    "CachedAnswer", ["answer", "link_list_list", "similarity", "latency"]
+)
+
+
+def _version_point_id(collection_name):
+    """
+    Get the ID of the point holding the version of a collection.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"collection-version:{collection_name}"))
+
+
+def set_collection_version(client, collection_name):
+    """
+    Give a new version to a collection, so that the answers cached for its previous content are dropped.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection that was changed.
+
+    Returns:
+        version (str): The new version of the collection.
+    """
+    if not client.collection_exists(VERSIONS_COLLECTION):
+        client.create_collection(
+            collection_name=VERSIONS_COLLECTION,
+            vectors_config=models.VectorParams(size=1, distance=models.Distance.DOT),
+        )
+    version = uuid.uuid4().hex
+    client.upsert(
+        collection_name=VERSIONS_COLLECTION,
+        points=[
+            models.PointStruct(
+                id=_version_point_id(collection_name),
+                vector=[1.0],
+                payload={"collection_name": collection_name, "version": version},
+            )
+        ],
+        wait=True,
+    )
+    return version
+
+
+async def aget_collection_version(async_client, collection_name):
+    """
+    Get the current version of a collection.
+
+    Args:
+        async_client (AsyncQdrantClient): The asynchronous Qdrant client.
+        collection_name (str): The name of the collection.
+
+    Returns:
+        version (str): The version of the collection, or "" if it was never versioned.
+    """
+    try:
+        records = await async_client.retrieve(
+            collection_name=VERSIONS_COLLECTION,
+            ids=[_version_point_id(collection_name)],
+            with_payload=True,
+            with_vectors=False,
+        )
+    except Exception:
+        # The versions collection does not exist until the first update.
+        return ""
+    return records[0].payload["version"] if records else ""
+
+
+class AnswerCache:
+    """
+    A class used to cache the combined answers, keyed by the embedding of the query.
+
+    A query is served from the cache when a stored query is similar enough and
+    was answered from the same version of the collection. Entries expire after
+    a time to live, and the least recently used one is evicted when the cache is full.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+        ttl=24 * 60 * 60,
+        max_entries=1024,
+        version_refresh_interval=30,
+    ):
+        """
+        Initializes an instance of the AnswerCache class.
+
+        Args:
+            similarity_threshold (float): The minimum cosine similarity between two queries to reuse an answer.
+            ttl (float): The time to live of an entry, in seconds.
+            max_entries (int): The maximum number of entries.
+            version_refresh_interval (float): The time between two reads of the collection version, in seconds.
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_refresh_interval = version_refresh_interval
+
+        # The normalized query embeddings are rows of one matrix, so a lookup is one matrix-vector product.
+        self._vectors = None
+        self._active = np.zeros(max_entries, dtype=bool)
+        self._entries = OrderedDict()  # Map the row to its entry, in least recently used order.
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        self._collection_versions = {}  # Map the collection name to (version, read time).
+
+        # Counters used to report the efficiency of the cache.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saved_seconds = 0.0
+
+    async def acollection_version(self, async_client, collection_name):
+        """
+        Get the version of a collection, read again once the refresh interval has passed.
+
+        Args:
+            async_client (AsyncQdrantClient): The asynchronous Qdrant client.
+            collection_name (str): The name of the collection.
+
+        Returns:
+            version (str): The version of the collection.
+        """
+        version, read_time = self._collection_versions.get(collection_name, (None, 0.0))
+        if time.monotonic() - read_time >= self.version_refresh_interval:
+            new_version = await aget_collection_version(async_client, collection_name)
+            self._collection_versions[collection_name] = (new_version, time.monotonic())
+            if version is not None and new_version != version:
+                self.invalidate()
+            version = new_version
+        return version
+
+    def lookup(self, embedding, collection_version):
+        """
+        Get the answer of the most similar cached query.
+
+        Args:
+            embedding (list): The embedding of the query.
+            collection_version (str): The version of the collection the answer must come from.
+
+        Returns:
+            cached_answer (CachedAnswer): The cached answer, or None on a miss.
+        """
+        query_vector = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None or not self._entries:
+                self.misses += 1
+                return None
+
+            similarities = self._vectors @ query_vector
+            similarities[~self._active] = -np.inf
+            # Check the candidates by decreasing similarity, skipping the stale ones.
+            now = time.monotonic()
+            for row in np.argsort(-similarities):
+                similarity = float(similarities[row])
+                if similarity < self.similarity_threshold:
+                    break
+                entry = self._entries[int(row)]
+                if now - entry["created_at"] > self.ttl:
+                    self._remove(int(row))
+                    self.expirations += 1
+                    continue
+                if entry["collection_version"] != collection_version:
+                    continue
+                self._entries.move_to_end(int(row))
+                self.hits += 1
+                self.saved_seconds += entry["latency"]
+                return CachedAnswer(
+                    entry["answer"], entry["link_list_list"], similarity, entry["latency"]
+                )
+
+            self.misses += 1
+            return None
+
+    def store(self, embedding, collection_version, answer, link_list_list, latency):
+        """
+        Store the answer of a query.
+
+        Args:
+            embedding (list): The embedding of the query.
+            collection_version (str): The version of the collection the answer comes from.
+            answer (str): The combined answer.
+            link_list_list (list): The links of every partial answer.
+            latency (float): The time it took to answer, in seconds.
+        """
+        query_vector = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros(
+                    (self.max_entries, len(query_vector)), dtype=np.float32
+                )
+            if not self._free_rows:
+                # Evict the least recently used entry.
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+            row = self._free_rows.pop()
+            self._vectors[row] = query_vector
+            self._active[row] = True
+            self._entries[row] = {
+                "answer": answer,
+                "link_list_list": link_list_list,
+                "collection_version": collection_version,
+                "created_at": time.monotonic(),
+                "latency": latency,
+            }
+
+    def invalidate(self):
+        """
+        Drop every entry.
+        """
+        with self._lock:
+            for row in list(self._entries):
+                self._remove(row)
+
+    def stats(self):
+        """
+        Get the counters of the cache.
+
+        Returns:
+            stats (dict): The hits, misses, hit rate, saved latency and size of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+            }
+
+    def _remove(self, row):
+        """
+        Remove the entry of a row, the lock being held.
+        """
+        del self._entries[row]
+        self._active[row] = False
+        self._free_rows.append(row)
+
+    @staticmethod
+    def _normalize(embedding):
+        """
+        Normalize an embedding, so that the dot product of two embeddings is their cosine similarity.
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
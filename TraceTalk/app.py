@@ -1,14 +1,13 @@
-import asyncio
 import codecs
 import os
-import re
 import sys
 from typing import List
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from main import main as agent
+from agent_pool import get_agent_pool
+from main import amain_stream as agent_stream
 
 core_directory = os.path.dirname(os.path.abspath(__file__))
 if core_directory not in sys.path:
@@ -29,26 +28,28 @@ app.add_middleware(
 sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
 
 
+@app.on_event("startup")
+def create_agent_pool():
+    # Create the OpenAI and Qdrant clients once, they are shared by all the requests.
+    app.state.agent_pool = get_agent_pool()
+
+
+def format_sse_event(event: str, data: str) -> str:
+    # Every line of the data gets its own "data:" field, as required by the SSE format.
+    data_lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{data_lines}\n"
+
+
 async def process_messages(messages: List[str]):
-    result = agent(messages=messages)
-    chunks = re.split(r"(\n+)", result)
-    for chunk in chunks:
-        if chunk.strip():
-            # Split the chunk into sentences
-            if len(chunk) > 100:
-                sentences = re.split(r"([.!?。！？]+)", chunk)
-                for i in range(0, len(sentences), 2):
-                    sentence = sentences[i] + (
-                        sentences[i + 1] if i + 1 < len(sentences) else ""
-                    )
-                    yield f"{sentence}"
-                    await asyncio.sleep(0.05)  # pause between sentences
-            else:
-                yield f"{chunk}"
-
-            await asyncio.sleep(0.1)  # pause between chunks
-        else:
-            yield chunk
+    try:
+        async for event in agent_stream(
+            messages=messages, agent_pool=app.state.agent_pool
+        ):
+            yield format_sse_event(event["event"], event["data"])
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        yield format_sse_event("error", str(e))
+    yield format_sse_event("done", "")
 
 
 @app.post("/process")
@@ -62,13 +63,21 @@ async def handler(request: Request):
         print(f"Received messages:\n{messages_str_list}")
 
         return StreamingResponse(
-            process_messages(messages_str_list), media_type="text/event-stream"
+            process_messages(messages_str_list),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
     except Exception as e:
         print(f"Error occurred: {e}")
         return {"error": str(e)}
 
 
+@app.get("/cache")
+async def cache_stats():
+    # Report the hit rate and the latency saved by the answer cache.
+    return app.state.agent_pool.answer_cache.stats()
+
+
 if __name__ == "__main__":
     print("Starting the server...")
     import uvicorn
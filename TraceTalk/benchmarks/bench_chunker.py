@@ -0,0 +1,80 @@
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prep_data import split_text_into_chunks
+from src import get_tokens_number
+
+
+def legacy_split_text_into_chunks(text, delimiter="\n# ", chunk_max_tokens=600):
+    """
+    The previous chunker, which re-tokenizes the whole accumulated chunk after every sentence.
+    """
+    text = "\n" + re.sub(r"---.*?---", "", text, flags=re.DOTALL)
+    text = re.sub(r"(```{code-cell}.*?```)", "TEMPLATE_CODE_CELL\n", text, flags=re.DOTALL)
+    chunks = re.split("((?:^|\n)(?={}(?!#)))".format(delimiter), text, flags=re.MULTILINE)
+    final_chunks = []
+    for chunk in [chunk for chunk in chunks if chunk.strip()]:
+        current_n_sentences = []
+        for sentence in re.split(r"([.?!])", chunk):
+            current_n_sentences.append(sentence)
+            if get_tokens_number("".join(current_n_sentences)) >= chunk_max_tokens:
+                final_chunks.append("".join(current_n_sentences))
+                current_n_sentences = []
+        if current_n_sentences:
+            final_chunks.append("".join(current_n_sentences))
+    return final_chunks
+
+
+def load_markdown_pages(book_directory=None):
+    """
+    Load the Markdown pages of a checked-out copy of the book, of the fetch cache, or synthetic pages.
+    """
+    patterns = (
+        [os.path.join(book_directory, "**", "*.md")]
+        if book_directory
+        else [os.path.join("vector-db-persist-directory", "fetch cache", "*.md")]
+    )
+    pages = []
+    for pattern in patterns:
+        for path in glob.glob(pattern, recursive=True):
+            with open(path, "r", encoding="utf-8") as f:
+                pages.append(f.read())
+    if not pages:
+        code_cell = "```{code-cell}\n" + "\n".join(f"x{i} = {i} ** 2" for i in range(40)) + "\n```\n"
+        prose = "A model is trained on data. Does it generalize? It should! " * 150
+        pages = [f"# Page {i}\n\n{prose}\n\n{code_cell}\n## Section\n\n{prose}" for i in range(50)]
+    return pages
+
+
+def benchmark(split_function, pages, **kwargs):
+    start_time = time.perf_counter()
+    chunks_number = sum(len(split_function(page, **kwargs)) for page in pages)
+    elapsed_time = time.perf_counter() - start_time
+    return chunks_number, elapsed_time
+
+
+def main(book_directory=None):
+    pages = load_markdown_pages(book_directory)
+    megabytes = sum(len(page.encode("utf-8")) for page in pages) / 1024 / 1024
+    print(f"{len(pages)} pages, {megabytes:.2f} MB of Markdown.")
+
+    for name, split_function in (
+        ("Legacy", legacy_split_text_into_chunks),
+        ("Linear", split_text_into_chunks),
+    ):
+        for chunk_max_tokens in (300, 600):
+            chunks_number, elapsed_time = benchmark(
+                split_function, pages, chunk_max_tokens=chunk_max_tokens
+            )
+            print(
+                f"{name}, chunk_max_tokens={chunk_max_tokens}: {chunks_number} chunks, "
+                f"{elapsed_time / megabytes:.2f} s/MB"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fetcher import MarkdownFetcher
+
+
+class BookPageHandler(BaseHTTPRequestHandler):
+    """
+    A local stand-in for the book server, with a fixed latency and ETag support.
+    """
+
+    latency = 0.05
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        content = f"# {self.path}\n\n" + "Some Markdown content. " * 200
+        etag = '"{}"'.format(hashlib.md5(content.encode("utf-8")).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        body = content.encode("utf-8")
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/markdown; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(pages_number=200, max_workers=16):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BookPageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    links = [
+        f"http://127.0.0.1:{server.server_port}/_sources/page-{i}.md"
+        for i in range(pages_number)
+    ]
+
+    with tempfile.TemporaryDirectory() as cache_directory:
+        serial_fetcher = MarkdownFetcher(max_workers=1, cache_directory=None)
+        serial_fetcher.fetch_many(links)
+        print(f"Serial: {serial_fetcher.stats}")
+
+        fetcher = MarkdownFetcher(max_workers=max_workers, cache_directory=cache_directory)
+        contents = fetcher.fetch_many(links)
+        assert all(content for content in contents)
+        print(f"Concurrent, first run: {fetcher.stats}")
+
+        fetcher = MarkdownFetcher(max_workers=max_workers, cache_directory=cache_directory)
+        revalidated_contents = fetcher.fetch_many(links)
+        assert revalidated_contents == contents
+        assert fetcher.stats["not_modified"] == pages_number
+        print(f"Concurrent, revalidated: {fetcher.stats}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
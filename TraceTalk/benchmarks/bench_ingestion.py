@@ -0,0 +1,156 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bulk_upsert import upsert_book_dataset
+from ingestion_pipeline import IngestionPipeline, IngestionSource, list_source_pages
+from prep_data import chunk_page
+from src import EmbeddingService
+
+# Latencies of the stubbed backends, in seconds.
+EMBEDDING_LATENCY = 0.2
+UPSERT_LATENCY = 0.05
+VECTOR_SIZE = 64
+EMBED_BATCH_SIZE = 128
+
+
+class StubEmbeddings:
+    def create(self, input, model):
+        time.sleep(EMBEDDING_LATENCY)
+        return types.SimpleNamespace(
+            data=[
+                types.SimpleNamespace(index=i, embedding=[float(len(text))] * VECTOR_SIZE)
+                for i, text in enumerate(input)
+            ]
+        )
+
+
+class StubQdrantClient:
+    """
+    A stand-in for a Qdrant server, with a fixed upsert latency, keeping the payloads of each collection.
+    """
+
+    def __init__(self):
+        self.points = {}
+        self._lock = threading.Lock()
+
+    def collection_exists(self, collection_name):
+        return collection_name in self.points
+
+    def create_collection(self, collection_name, vectors_config):
+        self.points[collection_name] = {}
+
+    recreate_collection = create_collection
+
+    def upsert(self, collection_name, points, wait=True):
+        time.sleep(UPSERT_LATENCY)
+        if hasattr(points, "ids"):
+            payloads = dict(zip(points.ids, points.payloads))
+        else:
+            payloads = {point.id: point.payload for point in points}
+        with self._lock:
+            self.points[collection_name].update(payloads)
+
+    def scroll(self, collection_name, with_payload, with_vectors=False, limit=10, offset=None):
+        records = [
+            types.SimpleNamespace(id=id, payload={key: payload.get(key) for key in with_payload})
+            for id, payload in self.points[collection_name].items()
+        ]
+        return records, None
+
+    def delete(self, collection_name, points_selector):
+        with self._lock:
+            for id in points_selector.points:
+                self.points[collection_name].pop(id, None)
+
+
+def make_books(root_directory, books_number=3, pages_number=40):
+    """
+    Write a few books as trees of Markdown files.
+    """
+    sources = []
+    for book in range(books_number):
+        book_directory = os.path.join(root_directory, f"book-{book}")
+        os.makedirs(book_directory)
+        for page in range(pages_number):
+            # Every sentence is different, so that no chunk is deduplicated by the embedding service.
+            prose = "".join(
+                f"Model {i} of page {page} in book {book} is trained on data. Does it generalize? It should! "
+                for i in range(120)
+            )
+            with open(os.path.join(book_directory, f"page-{page}.md"), "w") as f:
+                f.write(f"# Page {page} of book {book}\n\n{prose}\n## Section\n\n{prose}")
+        sources.append(
+            IngestionSource(
+                name=f"book-{book}",
+                collection_name=f"Book{book}",
+                markdown_directory=book_directory,
+                base_url=f"https://example.com/book-{book}",
+            )
+        )
+    return sources
+
+
+def make_embedding_service():
+    stub = types.SimpleNamespace(embeddings=StubEmbeddings())
+    return EmbeddingService(client=stub, async_client=stub, max_batch_size=EMBED_BATCH_SIZE)
+
+
+def ingest_serially(client, embedding_service, sources):
+    """
+    The previous ingestion: every stage runs over the whole source before the next one starts.
+    """
+    for source in sources:
+        client.create_collection(source.collection_name, vectors_config=None)
+        chunks = []
+        for md_title, link, path in list_source_pages(source):
+            with open(path, "r", encoding="utf-8") as f:
+                chunks.extend(chunk_page(md_title, link, f.read()))
+        title_vectors = embedding_service.embed_many([chunk["title"] for chunk in chunks])
+        content_vectors = embedding_service.embed_many([chunk["content"] for chunk in chunks])
+        upsert_book_dataset(
+            client,
+            source.collection_name,
+            pd.DataFrame(chunks),
+            {
+                "title": np.array(title_vectors, dtype=np.float32),
+                "content": np.array(content_vectors, dtype=np.float32),
+            },
+            max_workers=1,
+        )
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root_directory:
+        sources = make_books(root_directory)
+
+        client = StubQdrantClient()
+        start_time = time.perf_counter()
+        ingest_serially(client, make_embedding_service(), sources)
+        elapsed_time = time.perf_counter() - start_time
+        serial_points = sum(len(ids) for ids in client.points.values())
+        print(f"Serial: {serial_points} points in {elapsed_time:.2f} s")
+
+        client = StubQdrantClient()
+        pipeline = IngestionPipeline(
+            client=client,
+            embedding_service=make_embedding_service(),
+            embed_batch_size=EMBED_BATCH_SIZE,
+            vector_size=VECTOR_SIZE,
+            bm25_directory=os.path.join(root_directory, "bm25"),
+        )
+        stats = pipeline.run(sources)
+        points = sum(len(ids) for name, ids in client.points.items() if name.startswith("Book"))
+        assert points == serial_points
+        print(f"Pipeline: {points} points in {stats['seconds']:.2f} s, stats: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.json_tokenizer import JSONTokenizer
+
+SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string"},
+            "age": {"type": "integer"},
+            "score": {"type": "number"},
+            "active": {"type": "boolean"},
+            "skills": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["name", "age", "skills"],
+        "additionalProperties": False,
+    },
+}
+
+
+def make_document(objects_number=5000, seed=0):
+    """
+    Make a JSON document matching the schema, as a model would generate it.
+    """
+    rng = random.Random(seed)
+    words = ["python", "statistics", "machine learning", "linear algebra", "deep learning"]
+    return json.dumps(
+        [
+            {
+                "name": f"Person {i} " + " ".join(rng.choices(words, k=3)),
+                "age": rng.randint(18, 90),
+                "score": round(rng.uniform(-100, 100), 3),
+                "active": rng.random() < 0.5,
+                "skills": rng.sample(words, k=rng.randint(0, 4)),
+            }
+            for i in range(objects_number)
+        ],
+        indent=2,
+    )
+
+
+def split_into_fragments(text, seed=0):
+    # Fragments of 1 to 6 characters, as the tokens of a streamed answer.
+    rng = random.Random(seed)
+    fragments, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, 6)
+        fragments.append(text[i : i + size])
+        i += size
+    return fragments
+
+
+def benchmark(name, document, run):
+    start_time = time.perf_counter()
+    tokenizer = run()
+    elapsed_time = time.perf_counter() - start_time
+    assert tokenizer.is_complete()
+    print(f"{name:>28}: {len(document) / elapsed_time / 1e6:6.2f} M chars/s")
+
+
+def main():
+    document = make_document()
+    fragments = split_into_fragments(document)
+    print(f"{len(document)} characters, {len(fragments)} fragments")
+
+    def feed_whole(schema=None):
+        tokenizer = JSONTokenizer(schema)
+        assert tokenizer.feed(document) == len(document)
+        return tokenizer
+
+    def feed_fragments(schema=None):
+        tokenizer = JSONTokenizer(schema)
+        for fragment in fragments:
+            assert tokenizer.feed(fragment) == len(fragment)
+        return tokenizer
+
+    def check_fragments(schema=None):
+        # Every fragment is checked with a snapshot, to be rejected without changing the state.
+        tokenizer = JSONTokenizer(schema)
+        for fragment in fragments:
+            assert tokenizer.is_valid(fragment)
+        return tokenizer
+
+    def feed_characters(schema=None):
+        tokenizer = JSONTokenizer(schema)
+        for char in document:
+            tokenizer.feed(char)
+        return tokenizer
+
+    benchmark("whole text", document, feed_whole)
+    benchmark("fragments", document, feed_fragments)
+    benchmark("fragments, is_valid", document, check_fragments)
+    benchmark("characters", document, feed_characters)
+    benchmark("whole text, schema", document, lambda: feed_whole(SCHEMA))
+    benchmark("fragments, schema", document, lambda: feed_fragments(SCHEMA))
+    benchmark("fragments, is_valid, schema", document, lambda: check_fragments(SCHEMA))
+
+    start_time = time.perf_counter()
+    json.loads(document)
+    elapsed_time = time.perf_counter() - start_time
+    print(f"{'json.loads (reference)':>28}: {len(document) / elapsed_time / 1e6:6.2f} M chars/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset_store import load_book_dataset, save_book_dataset
+from local_index import LocalVectorIndex, build_local_index, normalize_rows
+from qdrant_client import models
+
+# The book data, when it was prepared. A synthetic corpus of the same shape is used otherwise.
+BOOK_DATASET_DIRECTORY = r"vector-db-persist-directory/book data"
+VECTOR_SIZE = 1536
+CHUNKS_NUMBER = 6000
+TOPICS_NUMBER = 150
+QUERIES_NUMBER = 200
+TOP_K = 10
+
+
+def make_corpus(dataset_directory, seed=0):
+    """
+    Write a synthetic corpus shaped like text embeddings: chunks around topics, sharing a common direction.
+    """
+    rng = np.random.default_rng(seed)
+    common_direction = rng.standard_normal(VECTOR_SIZE)
+    topics = rng.standard_normal((TOPICS_NUMBER, VECTOR_SIZE))
+    chunk_topics = rng.integers(TOPICS_NUMBER, size=CHUNKS_NUMBER)
+    content_vectors = (
+        common_direction + topics[chunk_topics] + 0.8 * rng.standard_normal((CHUNKS_NUMBER, VECTOR_SIZE))
+    ).astype(np.float32)
+    title_vectors = (common_direction + topics[chunk_topics]).astype(np.float32)
+    metadata = pd.DataFrame(
+        {
+            "id": [f"00000000-0000-0000-0000-{i:012d}" for i in range(CHUNKS_NUMBER)],
+            "title": [f"Topic {topic}" for topic in chunk_topics],
+            "content": [f"Chunk {i} about topic {topic}." for i, topic in enumerate(chunk_topics)],
+            "link": [f"https://example.com/topic-{topic}" for topic in chunk_topics],
+        }
+    )
+    save_book_dataset(dataset_directory, metadata, title_vectors, content_vectors)
+
+
+def make_queries(content_vectors, seed=1):
+    """
+    Make queries close to random chunks of the corpus.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = normalize_rows(content_vectors[rng.integers(len(content_vectors), size=QUERIES_NUMBER)])
+    return vectors + 0.02 * rng.standard_normal(vectors.shape).astype(np.float32)
+
+
+def run(index, queries, exact_results, search_params=None):
+    recalls = []
+    start_time = time.perf_counter()
+    for query, exact_ids in zip(queries, exact_results):
+        ids = {
+            point.id
+            for point in index.search(
+                "Articles", ("content", query), limit=TOP_K, with_payload=False, search_params=search_params
+            )
+        }
+        recalls.append(len(ids & exact_ids) / len(exact_ids))
+    elapsed_time = time.perf_counter() - start_time
+    return float(np.mean(recalls)), elapsed_time / len(queries) * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root_directory:
+        dataset_directory = BOOK_DATASET_DIRECTORY
+        if not os.path.exists(os.path.join(dataset_directory, "dataset.json")):
+            dataset_directory = os.path.join(root_directory, "book data")
+            make_corpus(dataset_directory)
+        queries = make_queries(np.asarray(load_book_dataset(dataset_directory).content_vectors))
+
+        indexes = {}
+        for quantization in (None, "int8", "binary"):
+            index_directory = os.path.join(root_directory, f"index-{quantization}")
+            build_local_index(dataset_directory, index_directory, quantization=quantization)
+            indexes[quantization] = LocalVectorIndex(index_directory)
+
+        exact_index = indexes[None]
+        exact_results = [
+            {point.id for point in exact_index.search("Articles", ("content", query), limit=TOP_K)}
+            for query in queries
+        ]
+        full_bytes = exact_index.vectors["content"].nbytes
+        print(f"{len(exact_index.ids)} chunks, {len(queries)} queries, recall@{TOP_K} against the exact search")
+
+        modes = [("float32", None, None)]
+        for quantization in ("int8", "binary"):
+            modes.append((f"{quantization}, no rescoring", quantization, models.QuantizationSearchParams(rescore=False)))
+            for oversampling in (1.0, 2.0, 4.0):
+                modes.append(
+                    (
+                        f"{quantization}, rescoring x{oversampling:g}",
+                        quantization,
+                        models.QuantizationSearchParams(rescore=True, oversampling=oversampling),
+                    )
+                )
+        for name, quantization, quantization_params in modes:
+            index = indexes[quantization]
+            scanned_bytes = index._quantized["content"]["codes"].nbytes if quantization else full_bytes
+            recall, latency = run(
+                index, queries, exact_results, models.SearchParams(quantization=quantization_params)
+            )
+            print(
+                f"{name:<24} recall@{TOP_K} {recall:.3f}, "
+                f"scanned vectors {scanned_bytes / 2**20:6.2f} MiB ({full_bytes / scanned_bytes:4.1f}x less), "
+                f"{latency:.2f} ms/query"
+            )
+
+
+if __name__ == "__main__":
+    main()
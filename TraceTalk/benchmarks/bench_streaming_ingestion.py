@@ -0,0 +1,91 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prep_data
+from dataset_store import load_manifest
+from src import EmbeddingService
+
+VECTOR_SIZE = 1536
+
+
+class StubEmbeddings:
+    def create(self, input, model):
+        return types.SimpleNamespace(
+            data=[
+                types.SimpleNamespace(
+                    index=i,
+                    embedding=np.random.default_rng(len(text)).random(VECTOR_SIZE).tolist(),
+                )
+                for i, text in enumerate(input)
+            ]
+        )
+
+
+def make_book(root_directory, pages_number):
+    """
+    Write a book of Markdown pages and the resource file listing them.
+    """
+    resources_directory = os.path.join(root_directory, "resources")
+    book_directory = os.path.join(root_directory, "book")
+    os.makedirs(resources_directory)
+    os.makedirs(os.path.join(book_directory, "ml"))
+    links = []
+    for page in range(pages_number):
+        links.append(
+            "'https://github.com/open-academy/machine-learning/tree/main/"
+            f"open-machine-learning-jupyter-book/ml/page-{page}.md',"
+        )
+        with open(os.path.join(book_directory, "ml", f"page-{page}.md"), "w") as f:
+            f.write(f"# Page {page}\n\n" + "".join(f"Sentence {i} of page {page}. " for i in range(400)))
+    with open(os.path.join(resources_directory, "resources.txt"), "w") as f:
+        f.write("\n".join(links))
+    return resources_directory, book_directory
+
+
+def run(pages_number):
+    with tempfile.TemporaryDirectory() as root_directory:
+        resources_directory, book_directory = make_book(root_directory, pages_number)
+        dataset_directory = os.path.join(root_directory, "book data")
+
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            prep_data.prep_book_data(
+                dataset_directory,
+                local_directory=book_directory,
+                input_directory=resources_directory,
+            )
+        elapsed_time = time.perf_counter() - start_time
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        chunks_number = load_manifest(dataset_directory)["count"]
+        print(
+            f"{pages_number:>4} pages, {chunks_number:>5} chunks: "
+            f"peak memory {peak_bytes / 2**20:6.1f} MiB, {elapsed_time:.2f} s"
+        )
+
+
+def main():
+    stub = types.SimpleNamespace(embeddings=StubEmbeddings())
+    embedding_service = EmbeddingService(client=stub, async_client=stub)
+    prep_data.get_embedding_service = lambda: embedding_service
+
+    # The fetcher keeps its cache under the working directory.
+    with tempfile.TemporaryDirectory() as working_directory:
+        os.chdir(working_directory)
+        for pages_number in (25, 100, 400):
+            run(pages_number)
+
+
+if __name__ == "__main__":
+    main()
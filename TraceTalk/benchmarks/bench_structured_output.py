@@ -0,0 +1,128 @@
+import json
+import os
+import sys
+import types
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import get_encoding, get_tokens_number
+from utils.json_tokenizer import JSONTokenizer
+from utils.structured_output import generate_json
+
+SCHEMA = {"name": "string", "age": "number", "skills": ["string"]}
+PROMPT = (
+    "Task: Generate a JSON object describing a person with name and age. The answer schema is as follows:\n"
+    + json.dumps(SCHEMA, indent=2)
+)
+PEOPLE = [
+    {"name": f"Person {i}", "age": 20 + i, "skills": ["python", "statistics", "machine learning"][: i % 3 + 1]}
+    for i in range(10)
+]
+
+
+class StubChatCompletions:
+    """
+    A stubbed model generating a known JSON object, counting its calls and prompt tokens.
+
+    When faulty, the first answer of every object breaks its JSON halfway, to force a continuation.
+    """
+
+    def __init__(self, answer, faulty=False):
+        self.answer = answer
+        self.faulty = faulty
+        self.calls_number = 0
+        self.prompt_tokens = 0
+
+    def create(self, model, messages, max_tokens=None, stream=False, **kwargs):
+        self.calls_number += 1
+        self.prompt_tokens += sum(get_tokens_number(m["content"]) for m in messages)
+
+        if kwargs.get("logprobs"):
+            # The per-token generation: the top candidates of the next token, the right one first.
+            next_token = self._tokens(self.answer)[self.calls_number - 1]
+            top_logprobs = [
+                types.SimpleNamespace(token=token, logprob=-0.1 * rank)
+                for rank, token in enumerate([next_token, "\n", " ", "```", "}"])
+            ]
+            content = [types.SimpleNamespace(top_logprobs=top_logprobs)]
+            return types.SimpleNamespace(
+                choices=[types.SimpleNamespace(logprobs=types.SimpleNamespace(content=content))]
+            )
+
+        prefix = next((m["content"] for m in messages if m["role"] == "assistant"), "")
+        if prefix:
+            tokens = self._tokens(self.answer[len(prefix) :])
+        elif self.faulty:
+            # Comment the first value, which is not valid JSON.
+            cut = self.answer.index(", ") + 1
+            tokens = (
+                ["```json\n"]
+                + self._tokens(self.answer[:cut])
+                + [" // the name of the person\n"]
+                + self._tokens(self.answer[cut:])
+            )
+        else:
+            tokens = ["```json\n"] + self._tokens(self.answer) + ["\n```"]
+        return iter(
+            types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=token))])
+            for token in tokens
+        )
+
+    @staticmethod
+    def _tokens(text):
+        encoding = get_encoding()
+        return [encoding.decode([token]) for token in encoding.encode_ordinary(text)]
+
+
+def legacy_generate_json_with_llm(client, prompt, max_tokens=100):
+    """
+    The previous generation, which asks for one token per call with the ever-growing prompt.
+    """
+    json_tokenizer = JSONTokenizer()
+    result = ""
+    while len(result) < max_tokens and not json_tokenizer.is_complete():
+        response = client.chat.completions.create(
+            model="gpt-4-turbo",
+            messages=[
+                {"role": "system", "content": "You are a JSON generator. Generate valid JSON only."},
+                {"role": "user", "content": prompt + result},
+            ],
+            max_tokens=1,
+            logprobs=True,
+            top_logprobs=5,
+        )
+        raw_tokens = [
+            {"token": logprob.token, "logprob": logprob.logprob}
+            for logprob in response.choices[0].logprobs.content[0].top_logprobs
+        ]
+        # The most likely token that continues the JSON value is fed to the tokenizer.
+        next_token = next((t["token"] for t in raw_tokens if json_tokenizer.is_valid(t["token"])), None)
+        if next_token is None:
+            break
+        result += next_token
+    return json.loads(result)
+
+
+def run(name, generate, faulty=False):
+    calls_number, prompt_tokens = 0, 0
+    for person in PEOPLE:
+        answer = json.dumps(person)
+        completions = StubChatCompletions(answer, faulty=faulty)
+        client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+        value = generate(client, PROMPT)
+        assert value == person, value
+        calls_number += completions.calls_number
+        prompt_tokens += completions.prompt_tokens
+    print(
+        f"{name:>22}: {calls_number / len(PEOPLE):5.1f} calls, "
+        f"{prompt_tokens / len(PEOPLE):7.0f} prompt tokens per object"
+    )
+
+
+def main():
+    run("per-token loop", legacy_generate_json_with_llm)
+    run("streamed", lambda client, prompt: generate_json(client, prompt, schema=SCHEMA)[0])
+    run("streamed, broken once", lambda client, prompt: generate_json(client, prompt, schema=SCHEMA)[0], faulty=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agent_pool import AgentPool
+from chatbot_agent import ChatbotAgent
+from dataset_store import save_book_dataset
+from load_test_process import VECTOR_SIZE, StubAsyncOpenAI, StubChatCompletions, StubEmbeddings
+from local_index import AsyncLocalVectorIndex, LocalVectorIndex, build_local_index
+from main import SYNTHESIS_MODES, amain
+from src import EmbeddingService, get_tokens_number, make_point_id
+
+PAGES_NUMBER = 20
+CHUNKS_PER_PAGE = 6
+RELEVANT_PAGES_PER_QUESTION = 2
+QUESTIONS = [
+    "What is linear regression?",
+    "How does gradient descent work?",
+    "What is overfitting?",
+    "How do decision trees split?",
+    "What is a convolutional layer?",
+]
+LINK_PATTERN = re.compile(r"https?://[^\s)\]]+")
+
+
+class CitingChatCompletions(StubChatCompletions):
+    """
+    A stubbed model counting the prompt tokens, whose final answer cites every link of its prompt.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.prompt_tokens = 0
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        prompt = messages[0]["content"]
+        self.prompt_tokens += get_tokens_number(prompt)
+        if not stream:
+            return await super().create(model, messages, stream=stream, **kwargs)
+        self.calls_number += 1
+        # Only the links of the chains or sources are cited, not the ones of the rules or the chat history.
+        sources_start = min(
+            index
+            for index in (prompt.find("===== CHAIN 1 ="), prompt.find("===== SOURCE [1] ="))
+            if index >= 0
+        )
+        links = list(dict.fromkeys(LINK_PATTERN.findall(prompt[sources_start:])))
+        answer = " ".join(f"Fact [{i+1}]." for i in range(len(links)))
+        answer += "\nREFERENCE:\n" + "\n".join(
+            f"[{i+1}] [page]({link})" for i, link in enumerate(links)
+        )
+        return self._stream(answer)
+
+
+def page_link(page):
+    return f"https://ocademy-ai.github.io/machine-learning/_sources/page-{page}.md"
+
+
+def search_text(question):
+    """
+    Get the text embedded to search the chunks of a question asked first.
+    """
+    stub = types.SimpleNamespace()
+    chatbot_agent = ChatbotAgent(
+        messages=[question],
+        client=stub,
+        qdrant_client=stub,
+        embedding_service=stub,
+        async_client=stub,
+        async_qdrant_client=stub,
+    )
+    return chatbot_agent.convert_chat_history_to_string(new_query=question, user_only=True)
+
+
+def build_index(index_directory):
+    """
+    Build a local index where the chunks of a few pages are close to each question.
+    """
+    rng = np.random.default_rng(0)
+    rows, title_vectors, content_vectors = [], [], []
+    relevant_links = {}
+    for page in range(PAGES_NUMBER):
+        question_index = page // RELEVANT_PAGES_PER_QUESTION
+        if question_index < len(QUESTIONS):
+            question_vector = np.array(
+                StubEmbeddings._embedding(search_text(QUESTIONS[question_index]))
+            )
+            relevant_links.setdefault(QUESTIONS[question_index], set()).add(
+                page_link(page).replace("_sources", "").replace(".md", ".html")
+            )
+        else:
+            question_vector = np.zeros(VECTOR_SIZE)
+        for chunk_index in range(CHUNKS_PER_PAGE):
+            rows.append(
+                {
+                    "id": make_point_id(page_link(page), chunk_index),
+                    "title": f"Page {page}",
+                    "content": f"Section {chunk_index} of page {page}. " * 40,
+                    "link": page_link(page),
+                    "chunk_index": chunk_index,
+                }
+            )
+            content_vectors.append(question_vector + 0.5 * rng.standard_normal(VECTOR_SIZE))
+            title_vectors.append(question_vector + rng.standard_normal(VECTOR_SIZE))
+    content_vectors = np.array(content_vectors, dtype=np.float32)
+    title_vectors = np.array(title_vectors, dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as dataset_directory:
+        save_book_dataset(dataset_directory, pd.DataFrame(rows), title_vectors, content_vectors)
+        build_local_index(dataset_directory, index_directory)
+    return relevant_links
+
+
+def make_agent_pool(index_directory):
+    async_client = StubAsyncOpenAI()
+    async_client.chat = types.SimpleNamespace(completions=CitingChatCompletions())
+    local_index = LocalVectorIndex(index_directory)
+    return AgentPool(
+        client=types.SimpleNamespace(),
+        qdrant_client=local_index,
+        async_client=async_client,
+        async_qdrant_client=AsyncLocalVectorIndex(local_index),
+        embedding_service=EmbeddingService(
+            client=types.SimpleNamespace(), async_client=async_client
+        ),
+    )
+
+
+async def run_mode(index_directory, synthesis_mode, relevant_links):
+    agent_pool = make_agent_pool(index_directory)
+    completions = agent_pool.async_client.chat.completions
+    latencies, precisions, recalls = [], [], []
+    for question in QUESTIONS:
+        start_time = time.perf_counter()
+        answer = await amain(
+            messages=[question], agent_pool=agent_pool, synthesis_mode=synthesis_mode
+        )
+        latencies.append(time.perf_counter() - start_time)
+
+        reference = answer.split("REFERENCE:")[-1]
+        cited_links = set(LINK_PATTERN.findall(reference))
+        correct_links = cited_links & relevant_links[question]
+        precisions.append(len(correct_links) / len(cited_links) if cited_links else 0.0)
+        recalls.append(len(correct_links) / len(relevant_links[question]))
+
+    print(
+        f"{synthesis_mode:>10}: {completions.calls_number / len(QUESTIONS):.1f} model calls, "
+        f"{completions.prompt_tokens / len(QUESTIONS):.0f} prompt tokens, "
+        f"{np.mean(latencies):.2f} s per question, "
+        f"citation precision {np.mean(precisions):.2f}, recall {np.mean(recalls):.2f}"
+    )
+
+
+async def run_benchmark():
+    with tempfile.TemporaryDirectory() as index_directory:
+        relevant_links = build_index(index_directory)
+        for synthesis_mode in SYNTHESIS_MODES:
+            await run_mode(index_directory, synthesis_mode, relevant_links)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
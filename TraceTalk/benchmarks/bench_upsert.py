@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from qdrant_client import QdrantClient, models
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bulk_upsert import upsert_book_dataset
+from src import make_point_id
+
+
+def make_book_dataset(points_number, vector_size=1536):
+    rng = np.random.default_rng(0)
+    metadata = pd.DataFrame(
+        {
+            "id": [make_point_id("https://example.com/page.md", i) for i in range(points_number)],
+            "title": "page",
+            "content": ["Some Markdown content. " * 60] * points_number,
+            "link": "https://example.com/page.md",
+            "chunk_index": np.arange(points_number),
+        }
+    )
+    title_vectors = rng.random((points_number, vector_size), dtype=np.float32)
+    content_vectors = rng.random((points_number, vector_size), dtype=np.float32)
+    return metadata, title_vectors, content_vectors
+
+
+def create_collection(client, vector_size=1536):
+    client.recreate_collection(
+        collection_name="Articles",
+        vectors_config={
+            name: models.VectorParams(size=vector_size, distance=models.Distance.COSINE)
+            for name in ("title", "content")
+        },
+    )
+
+
+def upsert_row_by_row(client, metadata, title_vectors, content_vectors, batch_size=50):
+    """
+    The previous upsert path: one PointStruct per DataFrame row, serial batches of 50.
+    """
+    book_data_df = metadata.copy()
+    book_data_df["title_vector"] = title_vectors.tolist()
+    book_data_df["content_vector"] = content_vectors.tolist()
+    for i in range(0, book_data_df.shape[0], batch_size):
+        points = [
+            models.PointStruct(
+                id=row["id"],
+                vector={"title": row["title_vector"], "content": row["content_vector"]},
+                payload=row.to_dict(),
+            )
+            for _, row in book_data_df[i : i + batch_size].iterrows()
+        ]
+        client.upsert(collection_name="Articles", points=points)
+
+
+def run(client, metadata, title_vectors, content_vectors, max_workers):
+    points_number = len(metadata)
+    create_collection(client)
+    start_time = time.perf_counter()
+    upsert_row_by_row(client, metadata, title_vectors, content_vectors)
+    elapsed_time = time.perf_counter() - start_time
+    print(f"Row by row: {points_number / elapsed_time:.0f} points/s")
+
+    create_collection(client)
+    stats = upsert_book_dataset(
+        client,
+        "Articles",
+        metadata,
+        {"title": title_vectors, "content": content_vectors},
+        max_workers=max_workers,
+    )
+    assert client.count("Articles").count == points_number
+    print(f"Bulk: {stats['points_per_second']:.0f} points/s, stats: {stats}")
+
+
+def main(points_number=5000):
+    metadata, title_vectors, content_vectors = make_book_dataset(points_number)
+
+    # Qdrant's local in-process mode is not thread-safe, so the batches are sent one at a time.
+    print("Local in-process mode:")
+    run(QdrantClient(":memory:"), metadata, title_vectors, content_vectors, max_workers=1)
+
+    qdrant_url = os.getenv("QDRANT_URL")
+    if qdrant_url:
+        print(f"Server at {qdrant_url}:")
+        client = QdrantClient(url=qdrant_url, api_key=os.getenv("QDRANT_API_KEY"))
+        run(client, metadata, title_vectors, content_vectors, max_workers=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import os
+import sys
+import time
+import types
+
+import numpy as np
+from qdrant_client import models
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agent_pool import AgentPool
+from main import amain
+from src import EmbeddingService, make_point_id
+
+# Latencies of the stubbed backends, in seconds.
+EMBEDDING_LATENCY = 0.05
+SEARCH_LATENCY = 0.02
+CHAT_LATENCY = 0.5
+VECTOR_SIZE = 1536
+LINK = "https://ocademy-ai.github.io/machine-learning/_sources/ml-fundamentals/regression.md"
+
+
+class StubEmbeddings:
+    @staticmethod
+    def _embedding(text):
+        # Different texts get unrelated vectors, so only a repeated question hits the answer cache.
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+        return np.random.default_rng(seed).standard_normal(VECTOR_SIZE).tolist()
+
+    async def create(self, input, model):
+        await asyncio.sleep(EMBEDDING_LATENCY)
+        return types.SimpleNamespace(
+            data=[
+                types.SimpleNamespace(index=i, embedding=self._embedding(text))
+                for i, text in enumerate(input)
+            ]
+        )
+
+
+class StubChatCompletions:
+    def __init__(self):
+        self.calls_number = 0
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        self.calls_number += 1
+        answer = "A stubbed answer about regression."
+        if stream:
+            return self._stream(answer)
+        await asyncio.sleep(CHAT_LATENCY)
+        message = types.SimpleNamespace(content=answer)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    async def _stream(self, answer):
+        # The latency is spread over the tokens, the first one arriving quickly.
+        words = answer.split(" ")
+        for word in words:
+            await asyncio.sleep(CHAT_LATENCY / len(words))
+            delta = types.SimpleNamespace(content=word + " ")
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+
+class StubAsyncOpenAI:
+    def __init__(self):
+        self.embeddings = StubEmbeddings()
+        self.chat = types.SimpleNamespace(completions=StubChatCompletions())
+
+
+class StubAsyncQdrantClient:
+    @staticmethod
+    def _payload(chunk_index):
+        return {
+            "title": "regression",
+            "content": f"Chunk {chunk_index} about linear regression.",
+            "link": LINK,
+            "chunk_index": chunk_index,
+        }
+
+    async def search(self, collection_name, query_vector, limit, **kwargs):
+        await asyncio.sleep(SEARCH_LATENCY)
+        return [
+            models.ScoredPoint(
+                id=make_point_id(LINK, i),
+                version=0,
+                score=0.9 - 0.01 * i,
+                payload=self._payload(i),
+            )
+            for i in range(1, limit + 1)
+        ]
+
+    async def search_batch(self, collection_name, requests, **kwargs):
+        await asyncio.sleep(SEARCH_LATENCY)
+        return [
+            await self.search(collection_name, request.vector, request.limit)
+            for request in requests
+        ]
+
+    async def retrieve(self, collection_name, ids, **kwargs):
+        await asyncio.sleep(SEARCH_LATENCY)
+        chunk_ids = {make_point_id(LINK, i): i for i in range(0, 10)}
+        return [
+            models.Record(id=id, payload=self._payload(chunk_ids[id]))
+            for id in ids
+            if id in chunk_ids
+        ]
+
+
+def make_stubbed_agent_pool():
+    async_client = StubAsyncOpenAI()
+    return AgentPool(
+        client=types.SimpleNamespace(),
+        qdrant_client=types.SimpleNamespace(),
+        async_client=async_client,
+        async_qdrant_client=StubAsyncQdrantClient(),
+        embedding_service=EmbeddingService(
+            client=types.SimpleNamespace(), async_client=async_client
+        ),
+    )
+
+
+async def run_conversation(agent_pool, i):
+    start_time = time.perf_counter()
+    await amain(messages=[f"Question {i}: what is linear regression?"], agent_pool=agent_pool)
+    return time.perf_counter() - start_time
+
+
+async def run_load_test(conversations_number):
+    agent_pool = make_stubbed_agent_pool()
+    single_latency = await run_conversation(agent_pool, -1)
+
+    start_time = time.perf_counter()
+    latencies = await asyncio.gather(
+        *(run_conversation(agent_pool, i) for i in range(conversations_number))
+    )
+    elapsed_time = time.perf_counter() - start_time
+
+    latencies = sorted(latencies)
+    print(f"Single conversation latency: {single_latency:.2f} s")
+    print(
+        f"{conversations_number} concurrent conversations on one event loop: {elapsed_time:.2f} s, "
+        f"p50 {latencies[len(latencies) // 2]:.2f} s, p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} s, "
+        f"{conversations_number / elapsed_time:.1f} conversations/s"
+    )
+    # Served one at a time, the conversations would take conversations_number * single_latency.
+    assert elapsed_time < 3 * single_latency, "The pipeline is blocking the event loop."
+
+    # Asked again, the same questions are answered from the answer cache.
+    start_time = time.perf_counter()
+    await asyncio.gather(
+        *(run_conversation(agent_pool, i) for i in range(conversations_number))
+    )
+    elapsed_time = time.perf_counter() - start_time
+    print(
+        f"{conversations_number} repeated conversations: {elapsed_time:.2f} s, "
+        f"answer cache stats: {agent_pool.answer_cache.stats()}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(run_load_test(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
@@ -0,0 +1,115 @@
+# Import basic libraries.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pandas.api.types import is_numeric_dtype
+
+# Import Qdrant libraries.
+from qdrant_client import models
+
+# Rough size of one float serialized in a JSON request body.
+FLOAT_JSON_BYTES = 12
+
+
+def split_into_byte_batches(point_bytes, max_batch_bytes, max_batch_size=1000):
+    """
+    Split consecutive points into batches whose estimated request size stays under the limit.
+
+    Args:
+        point_bytes (np.ndarray): The estimated size of each point, in bytes.
+        max_batch_bytes (int): The maximum estimated size of one batch, in bytes.
+        max_batch_size (int): The maximum number of points in one batch.
+
+    Returns:
+        batches (list): A list of (start, end) row ranges.
+    """
+    batches = []
+    start = 0
+    batch_bytes = 0
+    for i, size in enumerate(point_bytes.tolist()):
+        if i > start and (
+            batch_bytes + size > max_batch_bytes or i - start >= max_batch_size
+        ):
+            batches.append((start, i))
+            start = i
+            batch_bytes = 0
+        batch_bytes += size
+    if start < len(point_bytes):
+        batches.append((start, len(point_bytes)))
+    return batches
+
+
+def upsert_book_dataset(
+    client,
+    collection_name,
+    metadata,
+    vectors,
+    max_batch_bytes=4 * 1024 * 1024,
+    max_workers=4,
+    retries=3,
+    backoff_factor=0.5,
+):
+    """
+    Upsert the book data into a collection with column-wise batches sent in parallel.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        metadata (pd.DataFrame): One row per point, used as the payload. It must have an "id" column.
+        vectors (dict): A dictionary mapping the vector name to its matrix, one row per point.
+        max_batch_bytes (int): The maximum estimated size of one request, in bytes.
+        max_workers (int): The maximum number of requests in flight.
+        retries (int): The number of retries of a failed request.
+        backoff_factor (float): The backoff factor between two retries, in seconds.
+
+    Returns:
+        stats (dict): The number of points, batches, retries and the throughput of the upsert.
+    """
+    points_number = len(metadata)
+    ids = metadata["id"].tolist()
+    payloads = metadata.to_dict("records")
+
+    # Estimate the size of every point from its vectors and the length of its text fields.
+    point_bytes = np.full(
+        points_number,
+        sum(matrix.shape[1] for matrix in vectors.values()) * FLOAT_JSON_BYTES,
+        dtype=np.int64,
+    )
+    for column in metadata.columns:
+        if not is_numeric_dtype(metadata[column]):
+            point_bytes += metadata[column].astype(str).str.len().to_numpy(dtype=np.int64)
+    batches = split_into_byte_batches(point_bytes, max_batch_bytes)
+
+    stats = {"points": points_number, "batches": len(batches), "retries": 0}
+    lock = threading.Lock()
+
+    def upsert_batch(batch):
+        start, end = batch
+        # The batch is built inside the worker, so only max_workers batches are in memory at once.
+        points = models.Batch(
+            ids=ids[start:end],
+            vectors={name: matrix[start:end].tolist() for name, matrix in vectors.items()},
+            payloads=payloads[start:end],
+        )
+        for attempt in range(retries + 1):
+            try:
+                client.upsert(collection_name=collection_name, points=points, wait=True)
+                return
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                print(f"Upsert of points {start}-{end} failed: {e}. Retrying...")
+                with lock:
+                    stats["retries"] += 1
+                time.sleep(backoff_factor * 2**attempt)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(upsert_batch, batches))
+    elapsed_time = time.perf_counter() - start_time
+
+    stats["seconds"] = elapsed_time
+    stats["points_per_second"] = points_number / elapsed_time if elapsed_time else 0.0
+    return stats
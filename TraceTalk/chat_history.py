@@ -0,0 +1,193 @@
+# Import basic libraries.
+from collections import deque
+
+from src import get_encoding, get_tokens_number
+
+SUMMARY_PREFIX = "[summary]: Earlier in the conversation, the user asked: "
+
+
+def summarize_turns(turns, max_tokens=30):
+    """
+    Summarize compacted turns by the beginning of the user's queries, without calling a model.
+
+    Args:
+        turns (list): The compacted messages, as dictionaries with a "role" and a "content".
+        max_tokens (int): The maximum number of tokens kept of every query.
+
+    Returns:
+        snippets (list): The summary of every turn, empty for the chatbot's messages.
+    """
+    encoding = get_encoding()
+    snippets = []
+    for turn in turns:
+        if turn["role"] != "user" or not turn["content"].strip():
+            continue
+        tokens = encoding.encode_ordinary(turn["content"].strip())
+        snippet = encoding.decode(tokens[:max_tokens])
+        if not snippet:
+            continue
+        snippets.append(snippet + ("..." if len(tokens) > max_tokens else ""))
+    return snippets
+
+
+class ChatHistory:
+    """
+    A class used to keep the chat history of a conversation within a token budget.
+
+    The token count of every message is computed once, when it is added, and the
+    rendered strings are cached and extended in place. When the messages exceed
+    the budget, the oldest ones are compacted into a short summary, so the
+    rendered history never exceeds max_tokens.
+    """
+
+    def __init__(self, max_tokens=1000, max_turns=20, summarizer=summarize_turns):
+        """
+        Initializes an instance of the ChatHistory class.
+
+        Args:
+            max_tokens (int): The maximum number of tokens of the rendered history.
+            max_turns (int): The maximum number of messages kept before compacting.
+            summarizer (callable): Summarize compacted messages into a list of snippets.
+        """
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.summarizer = summarizer
+        # The summary may take a quarter of the budget, one message half of it.
+        self.max_summary_tokens = max_tokens // 4
+        self.max_turn_tokens = max_tokens // 2
+
+        self._turns = deque()  # The messages, with their rendered lines and token counts.
+        self._tokens_number = 0  # The tokens of the full rendering of the messages.
+        self._summary_snippets = deque()  # The (snippet, tokens number) of the summary.
+        self._summary_tokens_number = 0
+        self._rendered = {}  # Map the rendering options to the (string, tokens number).
+
+    def append(self, message):
+        """
+        Add a message, then compact the oldest messages if the history is over its budget.
+
+        Args:
+            message (dict): The message, with a "role" ("user" or "chatbot") and a "content".
+        """
+        content = self._truncate(message["content"])
+        turn = {"role": message["role"], "content": content}
+        turn["line"] = self._render_line(turn["role"], content)
+        turn["tokens_number"] = get_tokens_number(turn["line"])
+        if turn["role"] == "chatbot":
+            turn["short_line"] = self._render_line(
+                turn["role"],
+                content.split("RESOURCE:", 1)[0].split("REFERENCE", 1)[0],
+            )
+            turn["short_tokens_number"] = get_tokens_number(turn["short_line"])
+        else:
+            turn["short_line"], turn["short_tokens_number"] = turn["line"], turn["tokens_number"]
+
+        self._turns.append(turn)
+        self._tokens_number += turn["tokens_number"]
+        # Extend the cached renderings instead of rendering them again.
+        for options, (string, tokens_number) in list(self._rendered.items()):
+            line, line_tokens_number = self._select_line(turn, *options)
+            self._rendered[options] = (string + line, tokens_number + line_tokens_number)
+
+        if (
+            self._summary_tokens_number + self._tokens_number > self.max_tokens
+            or len(self._turns) > self.max_turns
+        ):
+            self._compact()
+
+    def render(self, user_only=False, chatbot_only=False, remove_resource=False):
+        """
+        Render the history as a string.
+
+        Args:
+            user_only (bool): If True, only render the user's messages.
+            chatbot_only (bool): If True, only render the chatbot's messages.
+            remove_resource (bool): If True, remove the resource from the chatbot's messages.
+
+        Returns:
+            chat_string (str): The history, at most max_tokens long.
+            tokens_number (int): The number of tokens of the history, as the sum of its lines.
+        """
+        options = (bool(user_only), bool(chatbot_only), bool(remove_resource))
+        rendered = self._rendered.get(options)
+        if rendered is None:
+            lines, tokens_number = [], 0
+            if self._summary_snippets:
+                lines.append(self._render_summary())
+                tokens_number += self._summary_tokens_number
+            for turn in self._turns:
+                line, line_tokens_number = self._select_line(turn, *options)
+                lines.append(line)
+                tokens_number += line_tokens_number
+            rendered = self._rendered[options] = ("".join(lines), tokens_number)
+        return rendered
+
+    def __iter__(self):
+        # Iterate the kept messages, as dictionaries with a "role" and a "content".
+        return iter({"role": turn["role"], "content": turn["content"]} for turn in self._turns)
+
+    def __len__(self):
+        return len(self._turns)
+
+    def _compact(self):
+        """
+        Move the oldest messages into the summary, until the messages and a full summary fit into the budget.
+        """
+        compacted_turns = []
+        while len(self._turns) > 1 and (
+            self._tokens_number + self.max_summary_tokens > self.max_tokens
+            or len(self._turns) > self.max_turns
+        ):
+            turn = self._turns.popleft()
+            self._tokens_number -= turn["tokens_number"]
+            compacted_turns.append(turn)
+        self._add_to_summary(compacted_turns)
+        self._rendered.clear()
+
+    def _add_to_summary(self, turns):
+        """
+        Add compacted messages to the summary, dropping its oldest snippets beyond its budget.
+        """
+        if not self._summary_snippets:
+            self._summary_tokens_number = get_tokens_number(SUMMARY_PREFIX + " \n")
+        for snippet in self.summarizer(turns):
+            snippet_tokens_number = get_tokens_number(f"{snippet}; ")
+            self._summary_snippets.append((snippet, snippet_tokens_number))
+            self._summary_tokens_number += snippet_tokens_number
+        while self._summary_snippets and self._summary_tokens_number > self.max_summary_tokens:
+            _, snippet_tokens_number = self._summary_snippets.popleft()
+            self._summary_tokens_number -= snippet_tokens_number
+        if not self._summary_snippets:
+            self._summary_tokens_number = 0
+
+    def _render_summary(self):
+        """
+        Render the summary of the compacted messages.
+        """
+        snippets = "; ".join(snippet for snippet, _ in self._summary_snippets)
+        return f"{SUMMARY_PREFIX}{snippets} \n"
+
+    def _truncate(self, content):
+        """
+        Truncate a message longer than the budget of one message.
+        """
+        if get_tokens_number(content) <= self.max_turn_tokens:
+            return content
+        encoding = get_encoding()
+        # Leave room for the role and the ellipsis of the rendered line.
+        return encoding.decode(encoding.encode_ordinary(content)[: self.max_turn_tokens - 16]) + "..."
+
+    @staticmethod
+    def _render_line(role, content):
+        return f"[{role}]: {content} \n"
+
+    @staticmethod
+    def _select_line(turn, user_only, chatbot_only, remove_resource):
+        """
+        Get the rendered line of a message and its tokens number, or an empty line if it is filtered out.
+        """
+        if (user_only and turn["role"] != "user") or (chatbot_only and turn["role"] != "chatbot"):
+            return "", 0
+        if remove_resource:
+            return turn["short_line"], turn["short_tokens_number"]
+        return turn["line"], turn["tokens_number"]
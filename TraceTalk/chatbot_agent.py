@@ -1,20 +1,23 @@
 # Import basic libraries.
 import os
 import re
-from collections import deque
-from typing import List
+from typing import List, Optional
+
+from chat_history import ChatHistory
 
 # Import OpenAI API and Langchain libraries.
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from langchain.prompts import PromptTemplate
 
 # Importing prompts.
 from prompts.basic_prompt import basic_prompt
 from prompts.combine_prompt import combine_prompt
+from prompts.synthesis_prompt import synthesis_prompt
 
 # Import Qdrant client (vector database).
-from qdrant_client import QdrantClient
-from src import get_emmbeddings, get_tokens_number
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+from hybrid_search import QUANTIZED_SEARCH_PARAMS
+from src import EmbeddingService, get_embedding_service
 
 
 class ChatbotAgent:
@@ -24,10 +27,16 @@ class ChatbotAgent:
 
     def __init__(
         self,
-        openai_api_key: str,
-        qdrant_url: str,
-        qdrant_api_key: str,
-        messages: List[str],
+        openai_api_key: Optional[str] = None,
+        qdrant_url: Optional[str] = None,
+        qdrant_api_key: Optional[str] = None,
+        messages: Optional[List[str]] = None,
+        client: Optional[OpenAI] = None,
+        qdrant_client: Optional[QdrantClient] = None,
+        embedding_service: Optional[EmbeddingService] = None,
+        async_client: Optional[AsyncOpenAI] = None,
+        async_qdrant_client: Optional[AsyncQdrantClient] = None,
+        max_chat_history_tokens: int = 1000,
     ):
         """
         Initializes an instance of the ChatbotAgent class.
@@ -37,27 +46,52 @@ class ChatbotAgent:
             qdrant_url (str): The URL for the Qdrant service to connect with.
             qdrant_api_key (str): The API key for the Qdrant service to authenticate requests.
             messages (List[str]): A list of messages that the chatbot agent will process.
+            client (OpenAI): A shared OpenAI client, used instead of creating one.
+            qdrant_client (QdrantClient): A shared Qdrant client, used instead of creating one.
+            embedding_service (EmbeddingService): A shared embedding service, used instead of the process one.
+            async_client (AsyncOpenAI): A shared asynchronous OpenAI client, used instead of creating one.
+            async_qdrant_client (AsyncQdrantClient): A shared asynchronous Qdrant client, used instead of creating one.
+            max_chat_history_tokens (int): The maximum number of tokens of the chat history in a prompt.
 
         """
-        # Set OpenAI API key and initialize client.
+        # Set OpenAI API key and initialize client, unless a shared one is given.
         self._openai_api_key = openai_api_key
-        os.environ["OPENAI_API_KEY"] = self._openai_api_key
-        self.client = OpenAI(api_key=self._openai_api_key)
+        if client is None:
+            os.environ["OPENAI_API_KEY"] = self._openai_api_key
+            client = OpenAI(api_key=self._openai_api_key)
+        self.client = client
+        self.async_client = async_client or AsyncOpenAI(
+            api_key=self._openai_api_key or os.getenv("OPENAI_API_KEY")
+        )
 
-        # Initialize Qdrant client
-        self.qdrant_client = QdrantClient(
+        # Initialize Qdrant client, unless a shared one is given.
+        if qdrant_client is None:
+            qdrant_client = QdrantClient(
+                url=qdrant_url,
+                prefer_grpc=False,
+                api_key=qdrant_api_key,
+            )
+            qdrant_client.get_collections()
+        self.qdrant_client = qdrant_client
+        self.async_qdrant_client = async_qdrant_client or AsyncQdrantClient(
             url=qdrant_url,
             prefer_grpc=False,
             api_key=qdrant_api_key,
         )
-        self.qdrant_client.get_collections()
+
+        # Use the embedding service shared by the process, which pools one OpenAI client.
+        self.embedding_service = embedding_service or get_embedding_service()
 
         # Initialize the chat history.
         self.count = 1  # Count the number of times the chatbot has been called.
         self._max_chat_history_length = 20
-        self.chat_history = deque(maxlen=self._max_chat_history_length)
+        # The oldest messages are compacted into a summary beyond the token budget.
+        self.chat_history = ChatHistory(
+            max_tokens=max_chat_history_tokens, max_turns=self._max_chat_history_length
+        )
         init_prompt = "I am TraceTalk, a cutting-edge chatbot designed to encapsulate the power of advanced AI technology, with a special focus on data science, machine learning, and deep learning. (https://github.com/Appointat/Chat-with-Document-s-using-ChatGPT-API-and-Text-Embedding)\n"
         self.chat_history.append({"role": "chatbot", "content": init_prompt})
+        messages = messages or []
         for i in range(len(messages)):
             if i % 2 == 0:
                 self.chat_history.append({"role": "user", "content": messages[i]})
@@ -67,8 +101,8 @@ class ChatbotAgent:
         self.query = ""
         self.answer = ""
 
-    def search_context_qdrant(
-        self, query, collection_name, vector_name="content", top_k=10
+    async def search_context_qdrant(
+        self, query, collection_name, vector_name="content", top_k=10, embedded_query=None
     ):
         """
         Search the Qdrant database for the top k most similar vectors to the query.
@@ -78,22 +112,61 @@ class ChatbotAgent:
             collection_name (str): The name of the collection to search in.
             vector_name (str): The name of the vector to search for.
             top_k (int): The number of results to return.
+            embedded_query (list): The embedding of the query, if it was already computed.
 
         Returns:
             query_results (list): A list of the top k most similar vectors to the query.
         """
         # Create embedding vector from user query.
-        embedded_query = get_emmbeddings(query)
+        if embedded_query is None:
+            embedded_query = await self.embedding_service.aembed(query)
 
-        query_results = self.qdrant_client.search(
+        query_results = await self.async_qdrant_client.search(
             collection_name=collection_name,
             query_vector=(vector_name, embedded_query),
             limit=top_k,
+            search_params=QUANTIZED_SEARCH_PARAMS,
         )
 
         return query_results
 
-    def prompt_chatbot(self, context, chat_history, resource, query):
+    async def search_context_qdrant_batch(
+        self, queries, collection_name, vector_name="content", top_k=10
+    ):
+        """
+        Search the Qdrant database for the top k most similar vectors to each query, in one request.
+
+        Args:
+            queries (list): The queries to search for.
+            collection_name (str): The name of the collection to search in.
+            vector_name (str): The name of the vector to search for.
+            top_k (int): The number of results to return for each query.
+
+        Returns:
+            query_results_list (list): The list of the top k most similar vectors of each query.
+        """
+        if not queries:
+            return []
+
+        # Create the embedding vectors of all the queries with one request.
+        embedded_queries = await self.embedding_service.aembed_many(list(queries))
+
+        query_results_list = await self.async_qdrant_client.search_batch(
+            collection_name=collection_name,
+            requests=[
+                models.SearchRequest(
+                    vector=models.NamedVector(name=vector_name, vector=embedded_query),
+                    limit=top_k,
+                    with_payload=True,
+                    params=QUANTIZED_SEARCH_PARAMS,
+                )
+                for embedded_query in embedded_queries
+            ],
+        )
+
+        return query_results_list
+
+    async def prompt_chatbot(self, context, chat_history, resource, query):
         """
         Prompt the chatbot to generate a response.
 
@@ -108,14 +181,14 @@ class ChatbotAgent:
         """
         prompt = f"Context: {context}\nChat History: {chat_history}\nResources: {resource}\nQuestion: {query}\nPlease provide an answer based on the given context and resources."
         
-        response = self.client.chat.completions.create(
+        response = await self.async_client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.8
         )
         return response.choices[0].message.content
 
-    def prompt_combine_chain(self, query, answer_list, link_list_list):
+    async def prompt_combine_chain(self, query, answer_list, link_list_list):
         """
         Prompt the chatbot to generate a response.
 
@@ -126,53 +199,147 @@ class ChatbotAgent:
         Returns:
             chatbot_answer (str): The chatbot's response to the user's query.
         """
-        MAX_TOKENS_CHAT_HISTORY = 1000
+        prompt, error_message = self.build_combine_prompt(
+            query, answer_list, link_list_list
+        )
+        if error_message:
+            return error_message
+
+        # Use the OpenAI API to generate a response based on the prompt
+        response = await self.async_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=1000,
+            n=1,
+            stop=None,
+        )
+
+        # Extract and return the generated response
+        print(f"Chatbot response:\n{response.choices[0].message.content.strip()}")
+        return response.choices[0].message.content.strip()
+
+    async def prompt_combine_chain_stream(self, query, answer_list, link_list_list):
+        """
+        Prompt the chatbot to generate a response, yielding its tokens as the model produces them.
+
+        Args:
+            query (str): The user's query.
+            answer_list (list): A list of answers to the user's query.
+            link_list_list (list): A list of the links of each answer.
+
+        Yields:
+            delta (str): The next piece of the chatbot's response.
+        """
+        prompt, error_message = self.build_combine_prompt(
+            query, answer_list, link_list_list
+        )
+        if error_message:
+            yield error_message
+            return
+
+        async for delta in self._stream_chat(prompt):
+            yield delta
+
+    async def prompt_synthesis_stream(self, prompt, error_message=None):
+        """
+        Prompt the chatbot to answer from all the sources with a single call, yielding its tokens.
+
+        Args:
+            prompt (str): The prompt built by build_synthesis_prompt or build_combine_prompt.
+            error_message (str): The answer to return instead of calling the model, or None.
+
+        Yields:
+            delta (str): The next piece of the chatbot's response.
+        """
+        if error_message:
+            yield error_message
+            return
+
+        async for delta in self._stream_chat(prompt):
+            yield delta
+
+    async def _stream_chat(self, prompt):
+        """
+        Send a prompt to the chat model, yielding the tokens of its response.
+        """
+        stream = await self.async_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=1000,
+            n=1,
+            stop=None,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def build_combine_prompt(self, query, answer_list, link_list_list):
+        """
+        Build the prompt combining the answers of every chain.
+
+        Args:
+            query (str): The user's query.
+            answer_list (list): A list of answers to the user's query.
+            link_list_list (list): A list of the links of each answer.
+
+        Returns:
+            prompt (str): The prompt, or None if it cannot be built.
+            error_message (str): The answer to return instead of calling the model, or None.
+        """
         n = len(answer_list)
 
         if n == 0:
-            return "I'm sorry, there is not enough information to provide a meaningful answer to your question. Can you please provide more context or a specific question?"
-        else:
-            chat_history = self.convert_chat_history_to_string()
-            if get_tokens_number(chat_history) >= MAX_TOKENS_CHAT_HISTORY:
-                print(
-                    f"Warning: chat history is too long, tokens: {get_tokens_number(chat_history)}."
-                )
-                chat_history = self.convert_chat_history_to_string(
-                    user_only=True, remove_resource=True
-                )
+            return None, "I'm sorry, there is not enough information to provide a meaningful answer to your question. Can you please provide more context or a specific question?"
+
+        chat_history = self.convert_chat_history_to_string()
+
+        # Convert the links before packing, so that the tokens counted are the ones sent.
+        prompt, tokens_number = combine_prompt(
+            chat_history=self.convert_links_in_text(chat_history),
+            query=self.convert_links_in_text(query),
+            answer_list=[self.convert_links_in_text(answer) for answer in answer_list],
+            link_list_list=[
+                [self.convert_links_in_text(link) for link in link_list]
+                for link_list in link_list_list
+            ],
+            MAX_TOKENS=4096 - 1000,
+        )
 
-            prompt = combine_prompt(
-                chat_history=chat_history,
-                query=query,
-                answer_list=answer_list,
-                link_list_list=link_list_list,
-                MAX_TOKENS=4096 - 1000,
+        if tokens_number > 4096 - 1000:
+            return None, "Tokens number of the prompt is too long: {}.".format(
+                tokens_number
             )
-            prompt = self.convert_links_in_text(prompt)
+        print("Tokens number of the prompt: {}.".format(tokens_number))
+        return prompt, None
 
-            if get_tokens_number(prompt) > 4096 - 1000:
-                return "Tokens number of the prompt is too long: {}.".format(
-                    get_tokens_number(prompt)
-                )
-            else:
-                print(
-                    "Tokens number of the prompt: {}.".format(get_tokens_number(prompt))
-                )
+    def build_synthesis_prompt(self, query, source_list):
+        """
+        Build the prompt answering from all the sources with a single call.
 
-            # return prompt
-            # Use the OpenAI API to generate a response based on the prompt
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=1000,
-                n=1,
-                stop=None,
-            )
+        Args:
+            query (str): The user's query.
+            source_list (list): The (link, content list) of each source, the most relevant first.
 
-            # Extract and return the generated response
-            print(f"Chatbot response:\n{response.choices[0].message.content.strip()}")
-            return response.choices[0].message.content.strip()
+        Returns:
+            prompt (str): The prompt, or None if it cannot be built.
+            link_list (list): The links of the sources packed into the prompt, the only ones the answer can cite.
+            error_message (str): The answer to return instead of calling the model, or None.
+        """
+        chat_history = self.convert_chat_history_to_string()
+        prompt, link_list, tokens_number = synthesis_prompt(
+            chat_history=chat_history,
+            query=query,
+            source_list=source_list,
+            MAX_TOKENS=4096 - 1000,
+        )
+        # Without any source in the prompt, the answer could not cite anything.
+        if not link_list:
+            return None, [], "I'm sorry, there is not enough information to provide a meaningful answer to your question. Can you please provide more context or a specific question?"
+        print("Tokens number of the prompt: {}.".format(tokens_number))
+        return prompt, link_list, None
 
     def update_chat_history(self, query, answer):
         """
@@ -182,9 +349,6 @@ class ChatbotAgent:
             query (str): The user's query.
             answer (str): The chatbot's response to the user's query.
         """
-        if len(self.chat_history) == self._max_chat_history_length:
-            self.chat_history.popleft()
-
         self.chat_history.append({"role": "user", "content": query})
         self.chat_history.append({"role": "chatbot", "content": answer})
         self.count += 1
@@ -198,7 +362,7 @@ class ChatbotAgent:
         remove_resource=False,
     ):
         """
-        Convert the chat history to a string.
+        Convert the chat history to a string, within the token budget of the chat history.
 
         Args:
             new_query (str): The user's query.
@@ -214,26 +378,13 @@ class ChatbotAgent:
             raise ValueError(
                 "user_only and chatbot_only cannot be True at the same time."
             )
-        chat_string = ""
-        if len(self.chat_history) > 0:
-            for message in self.chat_history:
-                if message["role"] == "chatbot" and ~user_only:
-                    # Delete the text (the text until to end) begin with "REFERENCE:" in the message['content'], because we do not need it.
-                    if remove_resource:
-                        chat_string += f"[{message['role']}]: {message['content'].split('RESOURCE:', 1)[0].split('REFERENCE', 1)[0]} \n"
-                    else:
-                        chat_string += f"[{message['role']}]: {message['content']} \n"
-                elif message["role"] == "user" and ~chatbot_only:
-                    chat_string += f"[{message['role']}]: {message['content']} \n"
+        chat_string, _ = self.chat_history.render(
+            user_only=user_only, chatbot_only=chatbot_only, remove_resource=remove_resource
+        )
         if new_query:
             chat_string += f"[user]: {new_query} \n"
         if new_answser:
             chat_string += f"[chatbot]: {new_answser} \n"
-
-        if get_tokens_number(chat_string) >= 3000:  # Max token length for GPT-3 is 4096.
-            print(
-                f"Chat history is too long: {get_tokens_number(chat_string)} tokens. Truncating chat history."
-            )
         return chat_string
 
     def convert_links_in_text(self, text):
@@ -0,0 +1,146 @@
+# Import basic libraries.
+from typing import List
+
+from src import make_point_id
+
+
+class ContextExpander:
+    """
+    A class used to expand search hits with the neighboring chunks of the same page.
+
+    The neighbors of all the hits are fetched in one deduplicated request and
+    matched by ID, so a missing point never shifts the context of another hit.
+    """
+
+    def __init__(self, qdrant_client, collection_name="Articles", window=1):
+        """
+        Initializes an instance of the ContextExpander class.
+
+        Args:
+            qdrant_client (AsyncQdrantClient): The asynchronous Qdrant client.
+            collection_name (str): The name of the collection.
+            window (int): The number of chunks added before and after each hit.
+        """
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.window = window
+        self._collection_size = None
+        self._collection_size_version = None
+
+    async def expand(self, hits, collection_version=None) -> List[str]:
+        """
+        Get the context of each hit: its content surrounded by its neighbors from the same page.
+
+        Args:
+            hits (list): The points returned by the search.
+            collection_version (str): The version of the collection, the size of the collection
+                being counted again when it changes.
+
+        Returns:
+            contexts (list): The context of each hit.
+        """
+        return [
+            "\n".join(point.payload["content"] for point in points)
+            for points in await self.expand_points(hits, collection_version)
+        ]
+
+    async def expand_points(self, hits, collection_version=None) -> List[list]:
+        """
+        Get the points of the context of each hit: its neighbors from the same page and itself, in order.
+
+        Args:
+            hits (list): The points returned by the search.
+            collection_version (str): The version of the collection, the size of the collection
+                being counted again when it changes.
+
+        Returns:
+            points_list (list): The points of the context of each hit.
+        """
+        neighbor_ids = []
+        for hit in hits:
+            neighbor_ids.append(await self._get_neighbor_ids(hit, collection_version))
+
+        # The hits themselves are already known, only the other points are retrieved.
+        known_points = {str(hit.id): hit for hit in hits}
+        missing_ids = list(
+            dict.fromkeys(
+                id
+                for before_ids, after_ids in neighbor_ids
+                for id in before_ids + after_ids
+                if str(id) not in known_points
+            )
+        )
+        if missing_ids:
+            for point in await self.qdrant_client.retrieve(
+                collection_name=self.collection_name,
+                ids=missing_ids,
+                with_payload=True,
+                with_vectors=False,
+            ):
+                known_points[str(point.id)] = point
+
+        points_list = []
+        for hit, (before_ids, after_ids) in zip(hits, neighbor_ids):
+            link = hit.payload.get("link")
+            points = []
+            for id in before_ids + [hit.id] + after_ids:
+                point = known_points.get(str(id))
+                # Stop at document boundaries: a neighbor must come from the same page.
+                if point is not None and point.payload.get("link") == link:
+                    points.append(point)
+            points_list.append(points)
+
+        return points_list
+
+    async def _get_neighbor_ids(self, hit, collection_version=None):
+        """
+        Get the IDs of the chunks before and after a hit.
+
+        Args:
+            hit (ScoredPoint): A point returned by the search.
+            collection_version (str): The version of the collection.
+
+        Returns:
+            before_ids (list): The IDs of the previous chunks, in order.
+            after_ids (list): The IDs of the next chunks, in order.
+        """
+        offsets_before = range(-self.window, 0)
+        offsets_after = range(1, self.window + 1)
+
+        chunk_index = hit.payload.get("chunk_index")
+        if chunk_index is not None:
+            # Point IDs are derived from (link, chunk_index).
+            link = hit.payload["link"]
+            before_ids = [
+                make_point_id(link, chunk_index + offset)
+                for offset in offsets_before
+                if chunk_index + offset >= 0
+            ]
+            after_ids = [
+                make_point_id(link, chunk_index + offset) for offset in offsets_after
+            ]
+            return before_ids, after_ids
+
+        # Collections ingested with a running integer ID, from 1 to the number of points.
+        collection_size = await self._get_collection_size(collection_version)
+        before_ids = [
+            hit.id + offset for offset in offsets_before if hit.id + offset >= 1
+        ]
+        after_ids = [
+            hit.id + offset
+            for offset in offsets_after
+            if hit.id + offset <= collection_size
+        ]
+        return before_ids, after_ids
+
+    async def _get_collection_size(self, collection_version=None):
+        """
+        Get the number of points of the collection, counted once per version of the collection.
+        """
+        if self._collection_size is None or collection_version != self._collection_size_version:
+            count_result = await self.qdrant_client.count(
+                collection_name=self.collection_name, exact=True
+            )
+            self._collection_size = count_result.count
+            self._collection_size_version = collection_version
+        return self._collection_size
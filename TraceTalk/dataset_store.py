@@ -0,0 +1,415 @@
+# Import basic libraries.
+import ast
+import json
+import os
+import shutil
+import uuid
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+BookDataset = namedtuple(
+    "BookDataset", ["metadata", "title_vectors", "content_vectors"]
+)
+
+METADATA_FILE = "metadata.jsonl"
+MANIFEST_FILE = "dataset.json"
+CHECKPOINT_FILE = "checkpoint.json"
+VECTOR_FILES = {
+    "title": "title_vectors.f32",
+    "content": "content_vectors.f32",
+}
+
+
+def save_book_dataset(dataset_directory, metadata, title_vectors, content_vectors):
+    """
+    Save the book data as a compact metadata table and one float32 matrix per vector.
+
+    Args:
+        dataset_directory (str): The directory where the book data is stored.
+        metadata (pd.DataFrame): One row per chunk, without the vectors.
+        title_vectors (np.ndarray): The title vectors, one row per chunk.
+        content_vectors (np.ndarray): The content vectors, one row per chunk.
+    """
+    title_vectors = np.ascontiguousarray(title_vectors, dtype=np.float32)
+    content_vectors = np.ascontiguousarray(content_vectors, dtype=np.float32)
+    if not (len(metadata) == len(title_vectors) == len(content_vectors)):
+        raise ValueError("The metadata and the vectors must have the same number of rows.")
+    dimension = content_vectors.shape[1] if content_vectors.ndim == 2 else 0
+
+    os.makedirs(dataset_directory, exist_ok=True)
+    # Write every file next to its final path first, so that a crash never leaves a mixed dataset.
+    pending_files = []
+    metadata_path = os.path.join(dataset_directory, METADATA_FILE)
+    metadata.to_json(metadata_path + ".tmp", orient="records", lines=True, force_ascii=False)
+    pending_files.append(metadata_path)
+    for name, vectors in (("title", title_vectors), ("content", content_vectors)):
+        vectors_path = os.path.join(dataset_directory, VECTOR_FILES[name])
+        vectors.tofile(vectors_path + ".tmp")
+        pending_files.append(vectors_path)
+    manifest_path = os.path.join(dataset_directory, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(
+            {
+                "count": len(metadata),
+                "dimension": dimension,
+                "dtype": "float32",
+                "version": uuid.uuid4().hex,
+            },
+            f,
+        )
+    pending_files.append(manifest_path)
+
+    for path in pending_files:
+        os.replace(path + ".tmp", path)
+
+
+def load_book_dataset(dataset_directory, mmap=True):
+    """
+    Load the book data saved by save_book_dataset.
+
+    Args:
+        dataset_directory (str): The directory where the book data is stored.
+        mmap (bool): If True, memory-map the vectors instead of reading them into memory.
+
+    Returns:
+        book_dataset (BookDataset): The metadata table and the title and content vector matrices.
+    """
+    with open(os.path.join(dataset_directory, MANIFEST_FILE), "r") as f:
+        manifest = json.load(f)
+    count, dimension = manifest["count"], manifest["dimension"]
+
+    metadata_path = os.path.join(dataset_directory, METADATA_FILE)
+    if count:
+        metadata = pd.read_json(metadata_path, orient="records", lines=True, dtype=False)
+    else:
+        metadata = pd.DataFrame()
+
+    vectors = {}
+    for name, file in VECTOR_FILES.items():
+        vectors_path = os.path.join(dataset_directory, file)
+        if not count:
+            vectors[name] = np.empty((0, dimension), dtype=np.float32)
+        elif mmap:
+            vectors[name] = np.memmap(
+                vectors_path, dtype=np.float32, mode="r", shape=(count, dimension)
+            )
+        else:
+            vectors[name] = np.fromfile(vectors_path, dtype=np.float32).reshape(
+                count, dimension
+            )
+
+    return BookDataset(metadata, vectors["title"], vectors["content"])
+
+
+def load_manifest(dataset_directory):
+    """
+    Load the manifest of the book data, with its number of rows, dimension and version.
+
+    Args:
+        dataset_directory (str): The directory where the book data is stored.
+
+    Returns:
+        manifest (dict): The manifest.
+    """
+    with open(os.path.join(dataset_directory, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+def iter_book_dataset(dataset_directory, window_size=1024):
+    """
+    Read the book data in windows of rows, so that only one window of metadata is in memory at once.
+
+    Args:
+        dataset_directory (str): The directory where the book data is stored.
+        window_size (int): The number of rows of a window.
+
+    Yields:
+        book_dataset (BookDataset): The metadata and the memory-mapped vectors of the rows of a window.
+    """
+    book_dataset = load_book_dataset_vectors(dataset_directory)
+    count = len(book_dataset.content_vectors)
+    if not count:
+        return
+    start = 0
+    with pd.read_json(
+        os.path.join(dataset_directory, METADATA_FILE),
+        orient="records",
+        lines=True,
+        dtype=False,
+        chunksize=window_size,
+    ) as reader:
+        for metadata in reader:
+            end = min(start + len(metadata), count)
+            yield BookDataset(
+                metadata.iloc[: end - start].reset_index(drop=True),
+                book_dataset.title_vectors[start:end],
+                book_dataset.content_vectors[start:end],
+            )
+            start = end
+            if start == count:
+                return
+
+
+def load_book_dataset_vectors(dataset_directory):
+    """
+    Memory-map the vectors of the book data, without reading its metadata.
+
+    Args:
+        dataset_directory (str): The directory where the book data is stored.
+
+    Returns:
+        book_dataset (BookDataset): The book data, whose metadata is None.
+    """
+    manifest = load_manifest(dataset_directory)
+    count, dimension = manifest["count"], manifest["dimension"]
+    vectors = {}
+    for name, file in VECTOR_FILES.items():
+        if count:
+            vectors[name] = np.memmap(
+                os.path.join(dataset_directory, file),
+                dtype=np.float32,
+                mode="r",
+                shape=(count, dimension),
+            )
+        else:
+            vectors[name] = np.empty((0, dimension), dtype=np.float32)
+    return BookDataset(None, vectors["title"], vectors["content"])
+
+
+def index_dataset_pages(dataset_directory):
+    """
+    Find the rows of every page of the book data, scanning its metadata line by line.
+
+    Args:
+        dataset_directory (str): The directory where the book data is stored.
+
+    Returns:
+        pages (dict): A dictionary mapping the link of a page to its (page hash, first row, end row,
+            first byte, end byte) in the metadata file. The pages whose rows are not contiguous are left out.
+    """
+    count = load_manifest(dataset_directory)["count"]
+    pages = {}
+    split_links = set()
+    offset = 0
+    last_link = None
+    with open(os.path.join(dataset_directory, METADATA_FILE), "rb") as f:
+        for row, line in zip(range(count), f):
+            record = json.loads(line)
+            link = record.get("link")
+            if link != last_link and link in pages:
+                split_links.add(link)
+            if link == last_link:
+                page_hash, start, _, byte_start, _ = pages[link]
+                pages[link] = (page_hash, start, row + 1, byte_start, offset + len(line))
+            else:
+                pages[link] = (record.get("page_hash"), row, row + 1, offset, offset + len(line))
+            last_link = link
+            offset += len(line)
+    for link in split_links:
+        del pages[link]
+    return pages
+
+
+def read_metadata_rows(dataset_directory, byte_start, byte_end):
+    """
+    Read consecutive rows of the metadata of the book data.
+
+    Args:
+        dataset_directory (str): The directory where the book data is stored.
+        byte_start (int): The offset of the first row in the metadata file.
+        byte_end (int): The offset following the last row.
+
+    Returns:
+        records (list): The rows, as dictionaries.
+    """
+    with open(os.path.join(dataset_directory, METADATA_FILE), "rb") as f:
+        f.seek(byte_start)
+        return [json.loads(line) for line in f.read(byte_end - byte_start).splitlines()]
+
+
+def replace_dataset_directory(partial_directory, dataset_directory):
+    """
+    Replace the book data with a complete one, written in another directory.
+
+    Args:
+        partial_directory (str): The directory of the new book data.
+        dataset_directory (str): The directory of the book data to replace.
+    """
+    previous_directory = dataset_directory + ".previous"
+    shutil.rmtree(previous_directory, ignore_errors=True)
+    if os.path.exists(dataset_directory):
+        os.replace(dataset_directory, previous_directory)
+    os.replace(partial_directory, dataset_directory)
+    shutil.rmtree(previous_directory, ignore_errors=True)
+
+
+class BookDatasetWriter:
+    """
+    A class used to write the book data window by window, in the format of save_book_dataset.
+
+    The rows are appended to the metadata and vector files as they come, so the
+    memory used does not grow with the book. A checkpoint records the rows that are
+    safely on disk and the keys of the work they complete, and a writer resumed after
+    a crash truncates the files back to the last checkpoint.
+    """
+
+    def __init__(self, dataset_directory, resume=True):
+        """
+        Initializes an instance of the BookDatasetWriter class.
+
+        Args:
+            dataset_directory (str): The directory where the book data is written.
+            resume (bool): If True, continue from the last checkpoint of the directory instead of starting over.
+        """
+        self.dataset_directory = dataset_directory
+        os.makedirs(dataset_directory, exist_ok=True)
+        self.count = 0  # The number of rows at the last checkpoint.
+        self.dimension = None
+        self.done_keys = set()  # The keys of the work completed at the last checkpoint.
+        checkpoint = {"count": 0, "metadata_bytes": 0, "dimension": None, "done_keys": []}
+        checkpoint_path = os.path.join(dataset_directory, CHECKPOINT_FILE)
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+            self.count = checkpoint["count"]
+            self.dimension = checkpoint["dimension"]
+            self.done_keys = set(checkpoint["done_keys"])
+
+        # Drop the rows written after the last checkpoint.
+        self._files = {}
+        for name, file in [("metadata", METADATA_FILE), *VECTOR_FILES.items()]:
+            path = os.path.join(dataset_directory, file)
+            self._files[name] = open(path, "r+b" if os.path.exists(path) else "w+b")
+            if name == "metadata":
+                size = checkpoint["metadata_bytes"]
+            else:
+                size = self.count * (self.dimension or 0) * 4
+            self._files[name].truncate(size)
+            self._files[name].seek(size)
+        self._metadata_bytes = checkpoint["metadata_bytes"]  # The size of the metadata file.
+        self._checkpoint_metadata_bytes = checkpoint["metadata_bytes"]
+        self._pending_rows = []  # The end offset in the metadata file of every row written since the checkpoint.
+
+    @property
+    def rows_number(self):
+        # The number of rows written, including the ones not checkpointed yet.
+        return self.count + len(self._pending_rows)
+
+    def append(self, records, title_vectors, content_vectors):
+        """
+        Append rows to the book data.
+
+        Args:
+            records (list): One dictionary per row, without the vectors.
+            title_vectors (np.ndarray): The title vectors, one row per record.
+            content_vectors (np.ndarray): The content vectors, one row per record.
+        """
+        title_vectors = np.ascontiguousarray(title_vectors, dtype=np.float32)
+        content_vectors = np.ascontiguousarray(content_vectors, dtype=np.float32)
+        if not (len(records) == len(title_vectors) == len(content_vectors)):
+            raise ValueError("The metadata and the vectors must have the same number of rows.")
+        if not len(records):
+            return
+        if self.dimension is None:
+            self.dimension = content_vectors.shape[1]
+        elif content_vectors.shape[1] != self.dimension:
+            raise ValueError(f"The vectors must have {self.dimension} dimensions.")
+
+        for record in records:
+            line = (json.dumps(record, ensure_ascii=False, default=_to_json) + "\n").encode("utf-8")
+            self._files["metadata"].write(line)
+            self._metadata_bytes += len(line)
+            self._pending_rows.append(self._metadata_bytes)
+        self._files["title"].write(title_vectors.tobytes())
+        self._files["content"].write(content_vectors.tobytes())
+
+    def checkpoint(self, rows_number=None, done_keys=()):
+        """
+        Make the first rows durable, so that a resumed writer starts after them.
+
+        Args:
+            rows_number (int): The number of rows of the checkpoint, all the written rows if None.
+                The rows written after it are written again by a resumed run.
+            done_keys (iterable): The keys of the work completed by the rows, such as the links of the pages.
+        """
+        if rows_number is None:
+            rows_number = self.rows_number
+        if not self.count <= rows_number <= self.rows_number:
+            raise ValueError(f"The checkpoint must be between {self.count} and {self.rows_number} rows.")
+        for file in self._files.values():
+            file.flush()
+            os.fsync(file.fileno())
+
+        if rows_number > self.count:
+            self._checkpoint_metadata_bytes = self._pending_rows[rows_number - self.count - 1]
+        del self._pending_rows[: rows_number - self.count]
+        self.count = rows_number
+        self.done_keys.update(done_keys)
+        _write_json(
+            os.path.join(self.dataset_directory, CHECKPOINT_FILE),
+            {
+                "count": self.count,
+                "metadata_bytes": self._checkpoint_metadata_bytes,
+                "dimension": self.dimension,
+                "done_keys": sorted(self.done_keys),
+            },
+        )
+
+    def close(self):
+        """
+        Checkpoint all the rows, write the manifest and remove the checkpoint, the book data being complete.
+        """
+        self.checkpoint()
+        for file in self._files.values():
+            file.close()
+        _write_json(
+            os.path.join(self.dataset_directory, MANIFEST_FILE),
+            {
+                "count": self.count,
+                "dimension": self.dimension or 0,
+                "dtype": "float32",
+                "version": uuid.uuid4().hex,
+            },
+        )
+        os.remove(os.path.join(self.dataset_directory, CHECKPOINT_FILE))
+
+
+def _write_json(path, data):
+    """
+    Write a JSON file atomically.
+    """
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _to_json(value):
+    """
+    Convert the numpy scalars of a record to Python values.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def convert_csv_dataset(csv_file_path, dataset_directory):
+    """
+    Convert a book data CSV file with stringified vectors into the binary format, once.
+
+    Args:
+        csv_file_path (str): The path to the CSV file containing the book data.
+        dataset_directory (str): The directory where the converted book data is stored.
+    """
+    book_data_df = pd.read_csv(csv_file_path)
+    title_vectors = np.array(
+        [ast.literal_eval(s) for s in book_data_df["title_vector"]], dtype=np.float32
+    )
+    content_vectors = np.array(
+        [ast.literal_eval(s) for s in book_data_df["content_vector"]], dtype=np.float32
+    )
+    metadata = book_data_df.drop(columns=["title_vector", "content_vector"])
+    save_book_dataset(dataset_directory, metadata, title_vectors, content_vectors)
@@ -0,0 +1,236 @@
+# Import basic libraries.
+import hashlib
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+
+class EmbeddingCache:
+    """
+    A class used to cache embeddings on disk, with an in-memory LRU front.
+
+    Entries are addressed by a hash of (model name, text), so the same text
+    embedded by the same model is only ever sent to the API once. The disk
+    usage is only scanned by the first write, so a process that only reads
+    starts at once, and the entries read from disk are marked as recently used
+    in one batch, when the disk entries are evicted.
+    """
+
+    def __init__(
+        self,
+        cache_directory=r"vector-db-persist-directory/embedding cache",
+        max_memory_bytes=64 * 1024 * 1024,
+        max_disk_bytes=1024 * 1024 * 1024,
+    ):
+        """
+        Initializes an instance of the EmbeddingCache class.
+
+        Args:
+            cache_directory (str): The directory where the embeddings are stored, or None for memory only.
+            max_memory_bytes (int): The maximum size of the in-memory LRU front.
+            max_disk_bytes (int): The maximum size of the embeddings stored on disk.
+        """
+        self.cache_directory = cache_directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()  # Map the key to the float32 bytes of the embedding.
+        self._memory_bytes = 0
+        self._disk_bytes = None  # Scanned by the first write.
+        self._read_keys = set()  # The keys read from disk since the last eviction.
+        self._lock = threading.Lock()
+
+        # Counters used to size the cache.
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.cache_directory:
+            os.makedirs(self.cache_directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(model_name, text):
+        """
+        Make the content address of an embedding.
+
+        Args:
+            model_name (str): The embedding model name.
+            text (str): The embedded text.
+
+        Returns:
+            key (str): The hexadecimal hash of the model name and the text.
+        """
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, model_name, text):
+        """
+        Get the cached embedding of the text.
+
+        Args:
+            model_name (str): The embedding model name.
+            text (str): The embedded text.
+
+        Returns:
+            embedding (list): The cached embedding, or None if it is not cached.
+        """
+        key = self.make_key(model_name, text)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return array("f", data).tolist()
+
+        data = self._read_from_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_in_memory(key, data)
+        return array("f", data).tolist()
+
+    def put(self, model_name, text, embedding):
+        """
+        Store the embedding of the text.
+
+        Args:
+            model_name (str): The embedding model name.
+            text (str): The embedded text.
+            embedding (list): The embedding of the text.
+        """
+        key = self.make_key(model_name, text)
+        data = array("f", embedding).tobytes()
+        with self._lock:
+            self._put_in_memory(key, data)
+        self._write_to_disk(key, data)
+
+    def stats(self):
+        """
+        Get the counters of the cache.
+
+        Returns:
+            stats (dict): The hit, miss and eviction counters and the sizes of the cache.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,  # None until the first write.
+            }
+
+    def _put_in_memory(self, key, data):
+        """
+        Put an entry in the in-memory LRU front and evict the least recently used ones.
+        The caller must hold the lock.
+        """
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _entry_path(self, key):
+        """
+        Get the path of an entry, sharded by the first two characters of its key.
+        """
+        return os.path.join(self.cache_directory, key[:2], f"{key}.f32")
+
+    def _read_from_disk(self, key):
+        """
+        Read the bytes of an entry from disk, or None if it is not stored.
+        """
+        if not self.cache_directory:
+            return None
+        try:
+            with open(self._entry_path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._read_keys.add(key)
+        return data
+
+    def _write_to_disk(self, key, data):
+        """
+        Write the bytes of an entry to disk and evict old entries when over the limit.
+        """
+        if not self.cache_directory:
+            return
+        entry_path = self._entry_path(key)
+        if os.path.exists(entry_path):
+            return
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # Write to a temporary file first, so that readers never see a partial entry.
+        temporary_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, entry_path)
+
+        if self._disk_bytes is None:
+            disk_bytes = sum(entry_size for _, _, entry_size in self._scan_disk())
+            with self._lock:
+                if self._disk_bytes is None:
+                    # The scan already counts the new entry.
+                    self._disk_bytes = disk_bytes - len(data)
+        with self._lock:
+            self._disk_bytes += len(data)
+            over_limit = self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self._evict_from_disk()
+
+    def _scan_disk(self):
+        """
+        Yield (path, last access time, size) of every entry stored on disk.
+        """
+        for shard in os.scandir(self.cache_directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".f32"):
+                    entry_stat = entry.stat()
+                    yield entry.path, entry_stat.st_mtime, entry_stat.st_size
+
+    def _evict_from_disk(self):
+        """
+        Remove the least recently used entries until the disk usage is back to 90% of the limit.
+        """
+        # Mark the entries read since the last eviction as recently used.
+        with self._lock:
+            read_keys, self._read_keys = self._read_keys, set()
+        for key in read_keys:
+            try:
+                os.utime(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+        entries = sorted(self._scan_disk(), key=lambda entry: entry[1])
+        disk_bytes = sum(entry_size for _, _, entry_size in entries)
+        target_bytes = int(self.max_disk_bytes * 0.9)
+        evicted = 0
+        for entry_path, _, entry_size in entries:
+            if disk_bytes <= target_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            disk_bytes -= entry_size
+            evicted += 1
+
+        with self._lock:
+            self._disk_bytes = disk_bytes
+            self.evictions += evicted
@@ -0,0 +1,221 @@
+# Import basic libraries.
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class MarkdownFetcher:
+    """
+    A class used to download the Markdown pages of the book concurrently.
+
+    All the downloads share one keep-alive session with a bounded connection
+    pool, retry transient failures with backoff, and revalidate the pages
+    downloaded by a previous run with their ETag / Last-Modified validators.
+    """
+
+    def __init__(
+        self,
+        max_workers=8,
+        timeout=10,
+        retries=3,
+        backoff_factor=0.5,
+        cache_directory=r"vector-db-persist-directory/fetch cache",
+        local_directory=None,
+    ):
+        """
+        Initializes an instance of the MarkdownFetcher class.
+
+        Args:
+            max_workers (int): The maximum number of concurrent downloads and pooled connections.
+            timeout (float): The timeout of one request, in seconds.
+            retries (int): The number of retries of a failed request.
+            backoff_factor (float): The backoff factor between two retries, in seconds.
+            cache_directory (str): The directory where the pages and their validators are stored, or None.
+            local_directory (str): The root of a checked-out copy of the book, read instead of the network.
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache_directory = cache_directory
+        self.local_directory = local_directory
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=["GET"],
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._validators = {}  # Map the link to its ETag / Last-Modified validators.
+        self._lock = threading.Lock()
+        if self.cache_directory:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            validators_path = os.path.join(self.cache_directory, "validators.json")
+            if os.path.exists(validators_path):
+                with open(validators_path, "r") as f:
+                    self._validators = json.load(f)
+
+        # Counters of the last call to fetch_many.
+        self.stats = {}
+
+    def fetch(self, link):
+        """
+        Get the content of one page.
+
+        Args:
+            link (str): The link of the page.
+
+        Returns:
+            content (str): The content of the page, or None if it could not be downloaded.
+        """
+        if self.local_directory:
+            return self._read_local(link)
+
+        headers = {}
+        validators = self._validators.get(link)
+        if validators and os.path.exists(self._body_path(link)):
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        try:
+            response = self.session.get(link, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"Failed to download {link}: {e}")
+            self._count("failed")
+            return None
+
+        if response.status_code == 304:
+            try:
+                with open(self._body_path(link), "r", encoding="utf-8") as f:
+                    content = f.read()
+            except OSError:
+                # The cached page was removed since the request was sent,
+                # so drop its validators and download it again.
+                with self._lock:
+                    self._validators.pop(link, None)
+                return self.fetch(link)
+            self._count("not_modified")
+            return content
+        if response.status_code != 200:
+            print(f"Failed to download {link}: HTTP {response.status_code}")
+            self._count("failed")
+            return None
+
+        self._count("downloaded")
+        content = response.text
+        if not self.cache_directory:
+            return content
+        if response.headers.get("ETag") or response.headers.get("Last-Modified"):
+            with open(self._body_path(link), "w", encoding="utf-8") as f:
+                f.write(content)
+            with self._lock:
+                self._validators[link] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+        else:
+            # The page is no longer validated, so its outdated copy must not be served on a 304.
+            with self._lock:
+                self._validators.pop(link, None)
+            try:
+                os.remove(self._body_path(link))
+            except FileNotFoundError:
+                pass
+        return content
+
+    def fetch_many(self, links):
+        """
+        Get the content of many pages concurrently.
+
+        Args:
+            links (list): The links of the pages.
+
+        Returns:
+            contents (list): The content of each page, or None for the pages that could not be downloaded.
+        """
+        self.stats = {"downloaded": 0, "not_modified": 0, "local": 0, "failed": 0}
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            contents = list(executor.map(self.fetch, links))
+        elapsed_time = time.perf_counter() - start_time
+
+        self.save_validators()
+        self.stats["pages"] = len(links)
+        self.stats["seconds"] = elapsed_time
+        self.stats["pages_per_second"] = len(links) / elapsed_time if elapsed_time else 0.0
+        return contents
+
+    def local_path(self, link):
+        """
+        Get the path of a page in the checked-out copy of the book.
+
+        Args:
+            link (str): The link of the page, either on GitHub or on the rendered book.
+
+        Returns:
+            path (str): The path of the page under the local directory.
+        """
+        for marker in ("open-machine-learning-jupyter-book/", "/_sources/"):
+            if marker in link:
+                relative_path = link.split(marker, 1)[1]
+                break
+        else:
+            relative_path = link.rsplit("/", 1)[-1]
+        return os.path.join(self.local_directory, *relative_path.split("/"))
+
+    def _read_local(self, link):
+        """
+        Read a page from the checked-out copy of the book.
+        """
+        try:
+            with open(self.local_path(link), "r", encoding="utf-8") as f:
+                content = f.read()
+        except OSError as e:
+            print(f"Failed to read {link}: {e}")
+            self._count("failed")
+            return None
+        self._count("local")
+        return content
+
+    def _body_path(self, link):
+        """
+        Get the path where the last downloaded version of a page is stored.
+        """
+        return os.path.join(
+            self.cache_directory or "",
+            hashlib.sha256(link.encode("utf-8")).hexdigest() + ".md",
+        )
+
+    def save_validators(self):
+        """
+        Save the validators on disk, so that the next run can send conditional requests.
+        """
+        if not self.cache_directory:
+            return
+        validators_path = os.path.join(self.cache_directory, "validators.json")
+        with self._lock:
+            with open(validators_path + ".tmp", "w") as f:
+                json.dump(self._validators, f)
+        os.replace(validators_path + ".tmp", validators_path)
+
+    def _count(self, key):
+        """
+        Increment one of the counters of the current call to fetch_many.
+        """
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
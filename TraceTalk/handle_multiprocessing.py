@@ -1,8 +1,15 @@
 import re
 
-def process_request(params):
+# The minimum similarity of a chunk to the query to answer from it.
+SCORE_THRESHOLD = 0.5
+
+# The answer of a request whose call to the model failed.
+ERROR_ANSWER = "I'm sorry, but I encountered an error while processing your request."
+
+
+async def process_request(params):
     """
-    Process a request to the chatbot.
+    Process a request to the chatbot. The requests of one chat turn run as concurrent tasks.
 
     Args:
         params (tuple): A tuple of parameters.
@@ -11,7 +18,7 @@ def process_request(params):
         tuple: A tuple of the answer and the link.
     """
     chatbot_agent, context, chat_history, query, link, score = params
-    convert_link = link.replace("_sources", "").replace(".md", ".html") if score > 0.5 else ""
+    convert_link = link.replace("_sources", "").replace(".md", ".html") if score > SCORE_THRESHOLD else ""
     reject_context = "Sorry, the question is not associated with the context. The chatbot should refuse to answer."
 
     url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+|www.(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+|[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}'
@@ -20,13 +27,13 @@ def process_request(params):
     resource_str = convert_link + "\n" + resource_str
 
     try:
-        if score > 0.5:
-            answer = chatbot_agent.prompt_chatbot(context, chat_history, resource_str, query)
+        if score > SCORE_THRESHOLD:
+            answer = await chatbot_agent.prompt_chatbot(context, chat_history, resource_str, query)
         else:
             answer = reject_context
     except Exception as e:
         print(f"An error occurred: {e}")
-        answer = "I'm sorry, but I encountered an error while processing your request."
+        answer = ERROR_ANSWER
     finally:
         # Release resources here, for example:
         # chatbot_agent.close()
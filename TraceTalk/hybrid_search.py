@@ -0,0 +1,315 @@
+# Import basic libraries.
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# Import Qdrant libraries.
+from qdrant_client import models
+
+BM25_INDEX_FILE = "bm25_index.npz"
+BM25_VOCABULARY_FILE = "bm25_vocabulary.json"
+
+# Identifiers such as "GridSearchCV" or "train_test_split" are kept as one term.
+TERM_PATTERN = re.compile(r"[a-z0-9_]+")
+
+# Search the quantized vectors first, and rescore twice as many candidates as results with the
+# full precision vectors. The collections without quantized vectors ignore these parameters.
+QUANTIZED_SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+
+
+def tokenize_text(text):
+    """
+    Split a text into lowercase terms.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        terms (list): The terms of the text.
+    """
+    return TERM_PATTERN.findall(text.lower())
+
+
+def build_bm25_index(metadata, index_directory):
+    """
+    Build the inverted index of the titles and contents of the chunks.
+
+    The postings are stored as flat arrays, one slice per term, so the index is
+    loaded with a few reads and takes a few bytes per posting in memory.
+
+    Args:
+        metadata: One row per chunk, with the "id", "title" and "content" columns, either as a
+            pd.DataFrame or as an iterable of consecutive pd.DataFrame windows.
+        index_directory (str): The directory where the index is stored.
+    """
+    windows = [metadata] if isinstance(metadata, pd.DataFrame) else metadata
+    term_ids = {}
+    posting_terms, posting_rows, posting_frequencies = [], [], []
+    document_lengths, ids = [], []
+    for window in windows:
+        for title, content in zip(window["title"].astype(str), window["content"].astype(str)):
+            terms = tokenize_text(title + "\n" + content)
+            row = len(document_lengths)
+            document_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                posting_rows.append(row)
+                posting_frequencies.append(frequency)
+        ids.extend(window["id"].tolist())
+    document_lengths = np.array(document_lengths, dtype=np.int32)
+
+    posting_terms = np.array(posting_terms, dtype=np.int32)
+    order = np.argsort(posting_terms, kind="stable")
+    term_offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(posting_terms, minlength=len(term_ids)), out=term_offsets[1:])
+
+    os.makedirs(index_directory, exist_ok=True)
+    np.savez(
+        os.path.join(index_directory, BM25_INDEX_FILE),
+        term_offsets=term_offsets,
+        posting_rows=np.array(posting_rows, dtype=np.int32)[order],
+        posting_frequencies=np.array(posting_frequencies, dtype=np.float32)[order],
+        document_lengths=document_lengths,
+    )
+    with open(os.path.join(index_directory, BM25_VOCABULARY_FILE), "w", encoding="utf-8") as f:
+        json.dump({"terms": list(term_ids), "ids": ids}, f)
+
+
+class BM25Index:
+    """
+    A class used to rank the chunks by the BM25 score of their terms.
+    """
+
+    def __init__(self, index_directory, k1=1.2, b=0.75):
+        """
+        Initializes an instance of the BM25Index class.
+
+        Args:
+            index_directory (str): The directory where the index is stored.
+            k1 (float): The term frequency saturation of BM25.
+            b (float): The document length normalization of BM25.
+        """
+        self.k1 = k1
+        self.b = b
+
+        with np.load(os.path.join(index_directory, BM25_INDEX_FILE)) as index:
+            self.term_offsets = index["term_offsets"]
+            self.posting_rows = index["posting_rows"]
+            self.posting_frequencies = index["posting_frequencies"]
+            self.document_lengths = index["document_lengths"].astype(np.float32)
+        with open(os.path.join(index_directory, BM25_VOCABULARY_FILE), "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        self.term_ids = {term: i for i, term in enumerate(vocabulary["terms"])}
+        self.ids = vocabulary["ids"]
+
+        documents_number = len(self.document_lengths)
+        document_frequencies = np.diff(self.term_offsets).astype(np.float32)
+        self.idf = np.log(
+            1 + (documents_number - document_frequencies + 0.5) / (document_frequencies + 0.5)
+        )
+        average_length = self.document_lengths.mean() if documents_number else 0.0
+        self.length_norms = self.k1 * (
+            1 - self.b + self.b * self.document_lengths / (average_length or 1.0)
+        )
+
+    @classmethod
+    def exists(cls, index_directory):
+        """
+        Check whether an index is stored in the directory.
+        """
+        return os.path.exists(os.path.join(index_directory, BM25_INDEX_FILE))
+
+    def search(self, query, limit=10):
+        """
+        Search the chunks with the highest BM25 score for the query.
+
+        Args:
+            query (str): The query.
+            limit (int): The number of results to return.
+
+        Returns:
+            results (list): The (point ID, score) of the best chunks, by decreasing score.
+        """
+        scores = np.zeros(len(self.document_lengths), dtype=np.float32)
+        for term in set(tokenize_text(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            rows = self.posting_rows[start:end]
+            frequencies = self.posting_frequencies[start:end]
+            scores[rows] += (
+                self.idf[term_id]
+                * frequencies
+                * (self.k1 + 1)
+                / (frequencies + self.length_norms[rows])
+            )
+
+        matches_number = int(np.count_nonzero(scores))
+        limit = min(limit, matches_number)
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[row], float(scores[row])) for row in top]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several rankings with reciprocal rank fusion.
+
+    Args:
+        rankings (list): The rankings to fuse, each a list of point IDs by decreasing relevance.
+        k (int): The constant damping the weight of the first ranks.
+
+    Returns:
+        fused_ranking (list): The (point ID, fused score) pairs, by decreasing fused score.
+    """
+    fused_scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            fused_scores[id] = fused_scores.get(id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused_scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def deduplicate_title_ranking(title_results, content_ranking):
+    """
+    Keep one chunk per page in the title ranking.
+
+    The chunks of a page share the title vector of the page, so they tie in the title
+    ranking. Only the chunk of each page ranked best by the content ranking is kept,
+    so the title of a page boosts one of its chunks instead of all of them.
+
+    Args:
+        title_results (list): The points found with the title vectors, by decreasing score.
+        content_ranking (list): The IDs of the points found with the content vectors, by decreasing score.
+
+    Returns:
+        title_ranking (list): The IDs of the kept points, one per page, by decreasing title score.
+    """
+    content_ranks = {id: rank for rank, id in enumerate(content_ranking)}
+    page_ids = {}  # Map the link of a page to its kept point, in the order of the title ranking.
+    for point in title_results:
+        id = str(point.id)
+        link = (point.payload or {}).get("link", id)
+        kept_id = page_ids.get(link)
+        if kept_id is None or content_ranks.get(id, len(content_ranks)) < content_ranks.get(
+            kept_id, len(content_ranks)
+        ):
+            page_ids[link] = id
+    return list(page_ids.values())
+
+
+class HybridRetriever:
+    """
+    A class used to search the book with the title vectors, the content vectors and the BM25 index.
+
+    The three rankings are fused with reciprocal rank fusion, the title ranking
+    keeping one chunk per page. The returned points
+    keep the cosine similarity of their content vector as their score, so the
+    score thresholds used downstream keep their meaning.
+    """
+
+    def __init__(
+        self,
+        qdrant_client,
+        embedding_service,
+        bm25_index=None,
+        collection_name="Articles",
+        candidates_number=20,
+        rrf_k=60,
+        search_params=QUANTIZED_SEARCH_PARAMS,
+    ):
+        """
+        Initializes an instance of the HybridRetriever class.
+
+        Args:
+            qdrant_client (AsyncQdrantClient): The asynchronous Qdrant client, or a local index.
+            embedding_service (EmbeddingService): The embedding service.
+            bm25_index (BM25Index): The BM25 index of the collection, or None for vector search only.
+            collection_name (str): The name of the collection.
+            candidates_number (int): The number of candidates of every ranking.
+            rrf_k (int): The constant of the reciprocal rank fusion.
+            search_params (SearchParams): The parameters of the vector searches.
+        """
+        self.qdrant_client = qdrant_client
+        self.embedding_service = embedding_service
+        self.bm25_index = bm25_index
+        self.collection_name = collection_name
+        self.candidates_number = candidates_number
+        self.rrf_k = rrf_k
+        self.search_params = search_params
+
+    async def search(self, query, top_k=10, embedded_query=None):
+        """
+        Search the chunks the most relevant to the query.
+
+        Args:
+            query (str): The query.
+            top_k (int): The number of results to return.
+            embedded_query (list): The embedding of the query, if it was already computed.
+
+        Returns:
+            query_results (list): The top k chunks, by decreasing fused relevance.
+        """
+        if embedded_query is None:
+            embedded_query = await self.embedding_service.aembed(query)
+
+        # Search the title and the content vectors with one request.
+        title_results, content_results = await self.qdrant_client.search_batch(
+            collection_name=self.collection_name,
+            requests=[
+                models.SearchRequest(
+                    vector=models.NamedVector(name=vector_name, vector=embedded_query),
+                    limit=self.candidates_number,
+                    with_payload=True,
+                    params=self.search_params,
+                )
+                for vector_name in ("title", "content")
+            ],
+        )
+        # The rankings compare the IDs as strings, but a collection with integer IDs
+        # only retrieves its points by their original IDs.
+        original_ids = {str(point.id): point.id for point in title_results + content_results}
+        content_ranking = [str(point.id) for point in content_results]
+        rankings = [
+            deduplicate_title_ranking(title_results, content_ranking),
+            content_ranking,
+        ]
+        if self.bm25_index is not None:
+            bm25_ids = [id for id, _ in self.bm25_index.search(query, self.candidates_number)]
+            original_ids.update((str(id), id) for id in bm25_ids)
+            rankings.append([str(id) for id in bm25_ids])
+        fused_ranking = reciprocal_rank_fusion(rankings, k=self.rrf_k)[:top_k]
+
+        # Only the content similarity of the chunks found by the other rankings is missing.
+        content_points = {str(point.id): point for point in content_results}
+        missing_ids = [original_ids[id] for id, _ in fused_ranking if id not in content_points]
+        if missing_ids:
+            query_vector = np.asarray(embedded_query, dtype=np.float32)
+            query_vector /= np.linalg.norm(query_vector) or 1.0
+            for record in await self.qdrant_client.retrieve(
+                collection_name=self.collection_name,
+                ids=missing_ids,
+                with_payload=True,
+                with_vectors=["content"],
+            ):
+                content_vector = np.asarray(
+                    (record.vector or {}).get("content", []), dtype=np.float32
+                )
+                score = 0.0
+                if content_vector.size:
+                    score = float(
+                        content_vector @ query_vector / (np.linalg.norm(content_vector) or 1.0)
+                    )
+                content_points[str(record.id)] = models.ScoredPoint(
+                    id=record.id, version=0, score=score, payload=record.payload
+                )
+
+        return [content_points[id] for id, _ in fused_ranking if id in content_points]
@@ -0,0 +1,433 @@
+# Import basic libraries.
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from answer_cache import set_collection_version
+from bulk_upsert import upsert_book_dataset
+from fetcher import MarkdownFetcher
+from hybrid_search import build_bm25_index
+from prep_data import chunk_page, get_vectors_config, list_book_pages
+
+# Import Qdrant libraries.
+from qdrant_client import QdrantClient, models
+from src import get_embedding_service
+
+# A source of pages indexed into its own collection: either a book listed by the resource files
+# of resources_directory, downloaded or read from local_directory, or a tree of Markdown files
+# under markdown_directory, whose links start with base_url.
+IngestionSource = namedtuple(
+    "IngestionSource",
+    ["name", "collection_name", "resources_directory", "markdown_directory", "local_directory", "base_url"],
+    defaults=(None, None, None, None),
+)
+
+# The marker closing a queue, put once by the last worker of the stage that feeds it.
+_STOP = object()
+
+
+def list_source_pages(source):
+    """
+    List the pages of a source.
+
+    Args:
+        source (IngestionSource): The source.
+
+    Returns:
+        pages (list): The (title, link, path) of every page, the path being None for the pages to download.
+    """
+    if source.resources_directory:
+        return [
+            (md_title, converted_link, None)
+            for md_title, _, converted_link in list_book_pages(source.resources_directory)
+        ]
+
+    pages = []
+    for root, _, files in os.walk(source.markdown_directory):
+        for file in sorted(files):
+            if not file.endswith(".md"):
+                continue
+            path = os.path.join(root, file)
+            relative_path = os.path.relpath(path, source.markdown_directory).replace(os.sep, "/")
+            link = f"{source.base_url.rstrip('/')}/{relative_path}" if source.base_url else path
+            pages.append((file[:-3], link, path))
+    return pages
+
+
+def iter_collection_records(client, collection_name, payload_keys, limit=1000):
+    """
+    Read the points of a collection, page by page.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
+        payload_keys (list): The keys of the payload to read.
+        limit (int): The number of points read with one request.
+
+    Yields:
+        records (list): The next points, without their vectors, their IDs as stored (integers or UUID strings).
+    """
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            with_payload=payload_keys,
+            with_vectors=False,
+            limit=limit,
+            offset=offset,
+        )
+        yield records
+        if offset is None:
+            return
+
+
+class IngestionPipeline:
+    """
+    A class used to index several sources into their own collections with a streaming pipeline.
+
+    The pages flow through four stages, fetch -> chunk -> embed -> upsert, each with
+    its own workers and connected by bounded queues, so every stage works on a part of
+    the corpus while the others work on the next ones, and only a few batches are in
+    memory at once. The chunking runs in a process pool, the other stages wait on the
+    network and run in threads. Once every page is upserted, the points no longer
+    written by any page are deleted, and the BM25 index of every collection is rebuilt.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        embedding_service=None,
+        fetch_workers=8,
+        chunk_workers=None,
+        embed_workers=4,
+        upsert_workers=2,
+        queue_size=64,
+        embed_batch_size=256,
+        chunk_max_tokens=300,
+        vector_size=1536,
+        quantization=None,
+        bm25_directory=r"vector-db-persist-directory/bm25",
+    ):
+        """
+        Initializes an instance of the IngestionPipeline class.
+
+        Args:
+            client (QdrantClient): The Qdrant client, created from QDRANT_URL and QDRANT_API_KEY if not given.
+            embedding_service (EmbeddingService): The embedding service, the shared one if not given.
+            fetch_workers (int): The number of pages downloaded or read concurrently.
+            chunk_workers (int): The number of chunking processes, the number of CPUs if not given.
+            embed_workers (int): The number of embedding batches sent concurrently.
+            upsert_workers (int): The number of upsert batches sent concurrently.
+            queue_size (int): The maximum number of items waiting between two stages.
+            embed_batch_size (int): The number of chunks embedded and upserted together.
+            chunk_max_tokens (int): The number of tokens after which a chunk is closed.
+            vector_size (int): The size of the vectors of the collections.
+            quantization (str): "int8" or "binary" to create the collections with quantized vectors,
+                or None for full precision vectors only.
+            bm25_directory (str): The directory where the BM25 index of every collection is stored,
+                in a subdirectory named after the collection, or None to build no BM25 index.
+        """
+        if client is None:
+            qdrant_url = os.getenv("QDRANT_URL")
+            if not qdrant_url:
+                raise ValueError("QDRANT_URL environment variable not set.")
+            client = QdrantClient(url=qdrant_url, api_key=os.getenv("QDRANT_API_KEY"))
+        self.client = client
+        self.embedding_service = embedding_service or get_embedding_service()
+        self.fetch_workers = fetch_workers
+        self.chunk_workers = chunk_workers or os.cpu_count() or 1
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+        self.chunk_max_tokens = chunk_max_tokens
+        self.vector_size = vector_size
+        self.quantization = quantization
+        self.bm25_directory = bm25_directory
+
+        self._lock = threading.Lock()
+        self._errors = []
+        self._written_ids = {}  # Map every collection to the IDs of the points written by the run.
+        self._failed_links = {}  # Map every collection to the links of the pages that could not be fetched.
+        # Counters of the last call to run.
+        self.stats = {}
+
+    def run(self, sources, recreate=False):
+        """
+        Index the sources, each into its own collection.
+
+        Args:
+            sources (list): The IngestionSource of every source.
+            recreate (bool): If True, recreate the collections instead of upserting into the existing ones.
+
+        Returns:
+            stats (dict): The number of pages, chunks and points of each source, and the duration of the run.
+        """
+        self.stats = {
+            source.name: {"pages": 0, "failed_pages": 0, "chunks": 0, "points": 0}
+            for source in sources
+        }
+        self._errors = []
+        collection_names = list(dict.fromkeys(source.collection_name for source in sources))
+        self._written_ids = {collection_name: set() for collection_name in collection_names}
+        self._failed_links = {collection_name: set() for collection_name in collection_names}
+        self._prepare_collections(collection_names, recreate)
+        # The link of every point stored before the run, to delete the ones no page writes anymore.
+        stored_links = {collection_name: {} for collection_name in collection_names}
+        if not recreate:
+            for collection_name in collection_names:
+                for records in iter_collection_records(self.client, collection_name, ["link"]):
+                    for record in records:
+                        stored_links[collection_name][record.id] = (record.payload or {}).get("link")
+
+        start_time = time.perf_counter()
+        pages_queue = queue.Queue(maxsize=self.queue_size)
+        contents_queue = queue.Queue(maxsize=self.queue_size)
+        chunks_queue = queue.Queue(maxsize=self.queue_size)
+        batches_queue = queue.Queue(maxsize=self.queue_size)
+        embedded_queue = queue.Queue(maxsize=self.queue_size)
+
+        fetchers = {
+            source.name: MarkdownFetcher(max_workers=self.fetch_workers, local_directory=source.local_directory)
+            for source in sources
+        }
+        with ProcessPoolExecutor(max_workers=self.chunk_workers) as chunk_executor:
+            # Start the chunking processes before the threads, so that no process is forked from a busy thread.
+            chunk_executor.submit(int).result()
+            threads = [
+                *self._start_stage(self._fetch, pages_queue, contents_queue, self.fetch_workers, fetchers),
+                *self._start_stage(self._chunk, contents_queue, chunks_queue, self.chunk_workers, chunk_executor),
+                *self._start_stage(self._batch, chunks_queue, batches_queue, 1, {}),
+                *self._start_stage(self._embed, batches_queue, embedded_queue, self.embed_workers),
+                *self._start_stage(self._upsert, embedded_queue, None, self.upsert_workers),
+            ]
+            for source in sources:
+                for page in list_source_pages(source):
+                    pages_queue.put((source, page))
+            pages_queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+        for fetcher in fetchers.values():
+            fetcher.save_validators()
+        elapsed_time = time.perf_counter() - start_time
+
+        if self._errors:
+            raise self._errors[0]
+        for collection_name in collection_names:
+            changed = recreate or any(
+                self.stats[source.name]["points"]
+                for source in sources
+                if source.collection_name == collection_name
+            )
+            # The chunks of the pages that shrank or disappeared, the pages that failed keeping theirs.
+            removed_ids = [
+                id
+                for id, link in stored_links[collection_name].items()
+                if str(id) not in self._written_ids[collection_name]
+                and link not in self._failed_links[collection_name]
+            ]
+            if removed_ids:
+                print(f"Deleting {len(removed_ids)} removed chunks from {collection_name}.")
+                self.client.delete(
+                    collection_name=collection_name,
+                    points_selector=models.PointIdsList(points=removed_ids),
+                )
+                changed = True
+            if self.bm25_directory and changed:
+                self._build_bm25_index(collection_name)
+            # Drop the answers cached for the previous content of the collection.
+            if changed:
+                set_collection_version(self.client, collection_name)
+        self.stats["seconds"] = elapsed_time
+        return self.stats
+
+    def _build_bm25_index(self, collection_name):
+        """
+        Build the BM25 index of a collection from the points it stores.
+        """
+        build_bm25_index(
+            (
+                pd.DataFrame(
+                    {
+                        "id": [record.id for record in records],
+                        "title": [(record.payload or {}).get("title", "") for record in records],
+                        "content": [(record.payload or {}).get("content", "") for record in records],
+                    }
+                )
+                for records in iter_collection_records(
+                    self.client, collection_name, ["title", "content"]
+                )
+            ),
+            os.path.join(self.bm25_directory, collection_name),
+        )
+
+    def _prepare_collections(self, collection_names, recreate):
+        """
+        Create the collection of every source, or recreate it.
+        """
+        for collection_name in collection_names:
+            if recreate:
+                self.client.recreate_collection(
+                    collection_name=collection_name,
+                    vectors_config=get_vectors_config(self.vector_size, self.quantization),
+                )
+            elif not self.client.collection_exists(collection_name):
+                self.client.create_collection(
+                    collection_name=collection_name,
+                    vectors_config=get_vectors_config(self.vector_size, self.quantization),
+                )
+
+    def _start_stage(self, function, input_queue, output_queue, workers_number, *args):
+        """
+        Start the workers of a stage, which apply the function to every item of the input queue.
+
+        The function returns the items put into the output queue. Once the input queue is
+        closed, the last worker to stop flushes the function with a None item and closes
+        the output queue. A failed item is recorded and skipped, so that the stages upstream
+        never block on a full queue.
+
+        Returns:
+            threads (list): The started threads.
+        """
+        remaining_workers = [workers_number]
+
+        def work():
+            while True:
+                item = input_queue.get()
+                if item is _STOP:
+                    # Let the other workers of the stage see the marker too.
+                    input_queue.put(_STOP)
+                    break
+                self._apply(function, item, output_queue, *args)
+            with self._lock:
+                remaining_workers[0] -= 1
+                last_worker = remaining_workers[0] == 0
+            if last_worker:
+                self._apply(function, None, output_queue, *args)
+                if output_queue is not None:
+                    output_queue.put(_STOP)
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(workers_number)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _apply(self, function, item, output_queue, *args):
+        """
+        Apply the function of a stage to one item, recording its error if it fails.
+        """
+        try:
+            for output in function(item, *args):
+                if output_queue is not None:
+                    output_queue.put(output)
+        except Exception as e:
+            print(f"Ingestion stage {function.__name__} failed: {e}")
+            with self._lock:
+                self._errors.append(e)
+
+    def _fetch(self, item, fetchers):
+        """
+        Download or read the content of a page.
+        """
+        if item is None:
+            return []
+        source, (md_title, link, path) = item
+        if path is None:
+            md_content = fetchers[source.name].fetch(link)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                md_content = f.read()
+        with self._lock:
+            self.stats[source.name]["pages"] += 1
+            if md_content is None:
+                self.stats[source.name]["failed_pages"] += 1
+                self._failed_links[source.collection_name].add(link)
+        if md_content is None:
+            return []
+        return [(source, md_title, link, md_content)]
+
+    def _chunk(self, item, chunk_executor):
+        """
+        Split a page into chunks in the process pool.
+        """
+        if item is None:
+            return []
+        source, md_title, link, md_content = item
+        chunks = chunk_executor.submit(
+            chunk_page, md_title, link, md_content, None, self.chunk_max_tokens
+        ).result()
+        return [(source, chunks)]
+
+    def _batch(self, item, pending_chunks):
+        """
+        Group the chunks of each source into batches, the partial batches being flushed at the end.
+        """
+        if item is None:
+            return [(source, chunks) for source, chunks in pending_chunks.values() if chunks]
+        source, chunks = item
+        _, source_chunks = pending_chunks.setdefault(source.name, (source, []))
+        source_chunks.extend(chunks)
+        with self._lock:
+            self.stats[source.name]["chunks"] += len(chunks)
+
+        batches = []
+        while len(source_chunks) >= self.embed_batch_size:
+            batches.append((source, source_chunks[: self.embed_batch_size]))
+            del source_chunks[: self.embed_batch_size]
+        return batches
+
+    def _embed(self, item):
+        """
+        Embed the titles and contents of a batch of chunks.
+        """
+        if item is None:
+            return []
+        source, chunks = item
+        title_vectors = self.embedding_service.embed_many([chunk["title"] for chunk in chunks])
+        content_vectors = self.embedding_service.embed_many([chunk["content"] for chunk in chunks])
+        return [
+            (
+                source,
+                chunks,
+                np.array(title_vectors, dtype=np.float32),
+                np.array(content_vectors, dtype=np.float32),
+            )
+        ]
+
+    def _upsert(self, item):
+        """
+        Upsert a batch of embedded chunks into the collection of its source.
+        """
+        if item is None:
+            return []
+        source, chunks, title_vectors, content_vectors = item
+        upsert_book_dataset(
+            self.client,
+            source.collection_name,
+            pd.DataFrame(chunks),
+            {"title": title_vectors, "content": content_vectors},
+            max_workers=1,
+        )
+        with self._lock:
+            self.stats[source.name]["points"] += len(chunks)
+            self._written_ids[source.collection_name].update(str(chunk["id"]) for chunk in chunks)
+        return []
+
+
+if __name__ == "__main__":
+    stats = IngestionPipeline().run(
+        [
+            IngestionSource(
+                name="machine-learning",
+                collection_name="Articles",
+                resources_directory=r"vector-db-persist-directory/resources",
+            )
+        ]
+    )
+    print(f"Ingestion stats: {stats}")
@@ -0,0 +1,434 @@
+# Import basic libraries.
+import json
+import os
+
+import numpy as np
+
+# Import Qdrant libraries, the results have the same types as the ones of a Qdrant server.
+from qdrant_client import models
+
+from dataset_store import load_book_dataset, save_book_dataset
+from hybrid_search import build_bm25_index
+
+IVF_FILE = "{name}_ivf.npz"
+QUANTIZED_FILE = "{name}_quantized.npz"
+INDEX_MANIFEST_FILE = "index.json"
+
+# The quantizations of the vectors scanned by a search: one byte per dimension, or one bit.
+QUANTIZATIONS = ("int8", "binary")
+# The number of bits set in every byte, to count the differing bits of binary codes.
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int32)
+# The number of rows scored at once, bounding the memory of the decoded codes.
+_SCORE_BLOCK_SIZE = 2048
+
+
+def normalize_rows(vectors):
+    """
+    Normalize the rows of a matrix, so that the dot product of two rows is their cosine similarity.
+
+    Args:
+        vectors (np.ndarray): The matrix to normalize.
+
+    Returns:
+        normalized_vectors (np.ndarray): The float32 matrix with unit rows.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def train_ivf(vectors, nlist, iterations=10, seed=0):
+    """
+    Cluster normalized vectors with spherical k-means into an inverted file.
+
+    Args:
+        vectors (np.ndarray): The normalized vectors, one row per point.
+        nlist (int): The number of clusters.
+        iterations (int): The number of k-means iterations.
+        seed (int): The seed of the initial centroids.
+
+    Returns:
+        centroids (np.ndarray): The normalized centroid of each cluster.
+        list_offsets (np.ndarray): The start of each cluster in list_rows, followed by the number of points.
+        list_rows (np.ndarray): The rows of the points, grouped by cluster.
+    """
+    nlist = min(nlist, len(vectors))
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(nlist):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = normalize_rows(centroids)
+    assignments = np.argmax(vectors @ centroids.T, axis=1)
+
+    list_rows = np.argsort(assignments, kind="stable").astype(np.int32)
+    list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=nlist), out=list_offsets[1:])
+    return centroids, list_offsets, list_rows
+
+
+def quantize_vectors(vectors, quantization, quantile=0.99):
+    """
+    Quantize normalized vectors, like the scalar and binary quantizations of Qdrant.
+
+    The int8 quantization maps the values between the quantiles of all the values to
+    the 256 levels of a byte, the binary quantization keeps the sign of every value,
+    once the mean vector is subtracted, since text embeddings share a common direction.
+
+    Args:
+        vectors (np.ndarray): The normalized vectors, one row per point.
+        quantization (str): "int8" or "binary".
+        quantile (float): The fraction of the values kept unclipped by the int8 quantization.
+
+    Returns:
+        quantized (dict): The codes of the vectors, with the offset and scale of the int8 levels,
+            or the center of the binary codes.
+    """
+    if quantization == "int8":
+        if len(vectors):
+            low, high = np.quantile(vectors, [(1 - quantile) / 2, (1 + quantile) / 2])
+        else:
+            low, high = -1.0, 1.0
+        scale = max(float(high - low), 1e-12) / 255
+        codes = np.round((np.clip(vectors, low, high) - low) / scale) - 128
+        return {"codes": codes.astype(np.int8), "offset": np.float32(low), "scale": np.float32(scale)}
+    if quantization == "binary":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        center = vectors.mean(axis=0) if len(vectors) else np.zeros(vectors.shape[1], dtype=np.float32)
+        return {"codes": np.packbits(vectors > center, axis=1), "center": center}
+    raise ValueError(f"Unknown quantization {quantization}, expected one of {QUANTIZATIONS}.")
+
+
+def score_quantized(quantized, rows, vector):
+    """
+    Estimate the cosine similarity of a normalized query with quantized vectors.
+
+    Args:
+        quantized (dict): The codes of the vectors, as returned by quantize_vectors.
+        rows (np.ndarray): The rows to score, or None for all of them.
+        vector (np.ndarray): The normalized query vector.
+
+    Returns:
+        scores (np.ndarray): The estimated similarity of every row.
+    """
+    codes = quantized["codes"]
+    rows_number = len(codes) if rows is None else len(rows)
+    scores = np.empty(rows_number, dtype=np.float32)
+    if "scale" in quantized:
+        # The vector of codes c is offset + scale * (c + 128).
+        scaled_vector = vector * quantized["scale"]
+        bias = float(quantized["offset"] * vector.sum() + 128 * scaled_vector.sum())
+    else:
+        dimension = len(vector)
+        query_codes = np.packbits(vector > quantized["center"])
+    for start in range(0, rows_number, _SCORE_BLOCK_SIZE):
+        end = min(start + _SCORE_BLOCK_SIZE, rows_number)
+        block = codes[start:end] if rows is None else codes[rows[start:end]]
+        if "scale" in quantized:
+            scores[start:end] = block.astype(np.float32) @ scaled_vector + bias
+        else:
+            # The similarity of the signs, from the number of differing bits.
+            distances = _POPCOUNT[np.bitwise_xor(block, query_codes)].sum(axis=1)
+            scores[start:end] = 1.0 - 2.0 * distances / dimension
+    return scores
+
+
+def build_local_index(dataset_directory, index_directory, nlist=None, iterations=10, quantization=None):
+    """
+    Build the local index from the book data: the metadata, the normalized title and content vectors
+    and the BM25 index.
+
+    Args:
+        dataset_directory (str): The directory where the book data is stored.
+        index_directory (str): The directory where the index is stored.
+        nlist (int): The number of inverted lists of the IVF index, or None for an exact search only.
+        iterations (int): The number of k-means iterations of the IVF index.
+        quantization (str): "int8" or "binary" to scan quantized copies of the vectors kept in memory,
+            the full precision vectors only rescoring the best candidates, or None to scan the full
+            precision vectors.
+    """
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization}, expected one of {QUANTIZATIONS}.")
+    book_dataset = load_book_dataset(dataset_directory)
+    vectors = {
+        "title": normalize_rows(book_dataset.title_vectors),
+        "content": normalize_rows(book_dataset.content_vectors),
+    }
+    save_book_dataset(
+        index_directory, book_dataset.metadata, vectors["title"], vectors["content"]
+    )
+    build_bm25_index(book_dataset.metadata, index_directory)
+
+    if nlist and len(book_dataset.metadata):
+        for name, matrix in vectors.items():
+            centroids, list_offsets, list_rows = train_ivf(matrix, nlist, iterations)
+            np.savez(
+                os.path.join(index_directory, IVF_FILE.format(name=name)),
+                centroids=centroids,
+                list_offsets=list_offsets,
+                list_rows=list_rows,
+            )
+    if quantization:
+        for name, matrix in vectors.items():
+            np.savez(
+                os.path.join(index_directory, QUANTIZED_FILE.format(name=name)),
+                **quantize_vectors(matrix, quantization),
+            )
+    with open(os.path.join(index_directory, INDEX_MANIFEST_FILE), "w") as f:
+        json.dump({"nlist": nlist or 0, "quantization": quantization}, f)
+
+
+class LocalVectorIndex:
+    """
+    A class used to search the book in process, instead of sending requests to a Qdrant server.
+
+    The normalized vectors are memory-mapped, so a search is one matrix-vector
+    product and a top-k selection, or a scan of the closest inverted lists when
+    the index was built with an IVF index. When the index was built with a
+    quantization, the search scans the quantized vectors kept in memory, and
+    only the full precision vectors of the best candidates are read to rescore
+    them. The search, search_batch, retrieve and count methods return the same
+    types as the ones of QdrantClient.
+    """
+
+    def __init__(self, index_directory, collection_name="Articles", nprobe=8, oversampling=2.0):
+        """
+        Initializes an instance of the LocalVectorIndex class.
+
+        Args:
+            index_directory (str): The directory where the index is stored.
+            collection_name (str): The name of the collection served by the index.
+            nprobe (int): The number of inverted lists scanned by a search, if the index has an IVF index.
+            oversampling (float): The number of candidates rescored for every result, if the index has
+                quantized vectors and the search parameters do not give it.
+        """
+        self.collection_name = collection_name
+        self.nprobe = nprobe
+        self.oversampling = oversampling
+
+        book_dataset = load_book_dataset(index_directory, mmap=True)
+        self.vectors = {
+            "title": book_dataset.title_vectors,
+            "content": book_dataset.content_vectors,
+        }
+        metadata = book_dataset.metadata
+        self.ids = metadata["id"].tolist() if len(metadata) else []
+        self.payloads = metadata.to_dict("records")
+        self._rows = {str(id): row for row, id in enumerate(self.ids)}
+
+        self._ivf = {}
+        for name in self.vectors:
+            ivf_path = os.path.join(index_directory, IVF_FILE.format(name=name))
+            if os.path.exists(ivf_path):
+                with np.load(ivf_path) as ivf:
+                    self._ivf[name] = (
+                        ivf["centroids"],
+                        ivf["list_offsets"],
+                        ivf["list_rows"],
+                    )
+
+        self._quantized = {}
+        for name in self.vectors:
+            quantized_path = os.path.join(index_directory, QUANTIZED_FILE.format(name=name))
+            if os.path.exists(quantized_path):
+                with np.load(quantized_path) as quantized:
+                    self._quantized[name] = {key: quantized[key] for key in quantized.files}
+
+    def search(
+        self,
+        collection_name,
+        query_vector,
+        limit=10,
+        with_payload=True,
+        score_threshold=None,
+        search_params=None,
+        **kwargs,
+    ):
+        """
+        Search the points whose vector is the most similar to the query vector.
+
+        Args:
+            collection_name (str): The name of the collection.
+            query_vector: A (name, vector) tuple, a NamedVector, or a vector of the "content" vectors.
+            limit (int): The number of results to return.
+            with_payload (bool): If True, return the payload of the points.
+            score_threshold (float): The minimum score of the results.
+            search_params (SearchParams): The search parameters, whose quantization parameters
+                choose whether and how the quantized vectors are used.
+
+        Returns:
+            query_results (list): The most similar points, by decreasing score.
+        """
+        self._check_collection(collection_name)
+        if isinstance(query_vector, tuple):
+            vector_name, vector = query_vector
+        elif isinstance(query_vector, models.NamedVector):
+            vector_name, vector = query_vector.name, query_vector.vector
+        else:
+            vector_name, vector = "content", query_vector
+        vector = normalize_rows(vector)
+
+        matrix = self.vectors[vector_name]
+        if vector_name in self._ivf:
+            # Only score the points of the inverted lists closest to the query.
+            centroids, list_offsets, list_rows = self._ivf[vector_name]
+            nprobe = min(self.nprobe, len(centroids))
+            closest_lists = np.argpartition(-(centroids @ vector), nprobe - 1)[:nprobe]
+            candidate_rows = np.sort(
+                np.concatenate(
+                    [
+                        list_rows[list_offsets[i] : list_offsets[i + 1]]
+                        for i in closest_lists
+                    ]
+                )
+            )
+        else:
+            candidate_rows = None
+
+        quantized = self._quantized.get(vector_name)
+        quantization_params = getattr(search_params, "quantization", None)
+        if quantized is not None and not (quantization_params and quantization_params.ignore):
+            scores = score_quantized(quantized, candidate_rows, vector)
+            if not (quantization_params and quantization_params.rescore is False):
+                # Rescore the best candidates with their full precision vectors.
+                oversampling = (quantization_params and quantization_params.oversampling) or self.oversampling
+                rescored_number = min(len(scores), max(limit, int(np.ceil(limit * oversampling))))
+                if rescored_number > 0:
+                    best = np.argpartition(-scores, rescored_number - 1)[:rescored_number]
+                    candidate_rows = np.sort(best if candidate_rows is None else candidate_rows[best])
+                    scores = matrix[candidate_rows] @ vector
+        elif candidate_rows is not None:
+            scores = matrix[candidate_rows] @ vector
+        else:
+            scores = np.asarray(matrix @ vector)
+
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        query_results = []
+        for i in top:
+            score = float(scores[i])
+            if score_threshold is not None and score < score_threshold:
+                break
+            row = int(candidate_rows[i]) if candidate_rows is not None else int(i)
+            query_results.append(
+                models.ScoredPoint(
+                    id=self.ids[row],
+                    version=0,
+                    score=score,
+                    payload=self.payloads[row] if with_payload else None,
+                )
+            )
+        return query_results
+
+    def search_batch(self, collection_name, requests, **kwargs):
+        """
+        Run several searches.
+
+        Args:
+            collection_name (str): The name of the collection.
+            requests (list): The SearchRequest of each search.
+
+        Returns:
+            query_results_list (list): The results of each search.
+        """
+        return [
+            self.search(
+                collection_name,
+                request.vector,
+                limit=request.limit,
+                with_payload=request.with_payload is not False,
+                score_threshold=request.score_threshold,
+                search_params=request.params,
+            )
+            for request in requests
+        ]
+
+    def retrieve(self, collection_name, ids, with_payload=True, with_vectors=False, **kwargs):
+        """
+        Get the points with the given IDs, skipping the ones that do not exist.
+
+        Args:
+            collection_name (str): The name of the collection.
+            ids (list): The IDs of the points.
+            with_payload (bool): If True, return the payload of the points.
+            with_vectors (bool): If True, return the normalized vectors of the points.
+
+        Returns:
+            records (list): The existing points.
+        """
+        self._check_collection(collection_name)
+        records = []
+        for id in ids:
+            row = self._rows.get(str(id))
+            if row is None:
+                continue
+            records.append(
+                models.Record(
+                    id=self.ids[row],
+                    payload=self.payloads[row] if with_payload else None,
+                    vector=(
+                        {name: matrix[row].tolist() for name, matrix in self.vectors.items()}
+                        if with_vectors
+                        else None
+                    ),
+                )
+            )
+        return records
+
+    def count(self, collection_name, exact=True, **kwargs):
+        """
+        Get the number of points of the collection.
+        """
+        self._check_collection(collection_name)
+        return models.CountResult(count=len(self.ids))
+
+    def _check_collection(self, collection_name):
+        """
+        Raise an error for the collections that are not served by the index.
+        """
+        if collection_name != self.collection_name:
+            raise ValueError(f"Collection {collection_name} not found in the local index.")
+
+
+class AsyncLocalVectorIndex:
+    """
+    A class used to give a local index the interface of AsyncQdrantClient.
+
+    The searches are fast enough to run directly on the event loop.
+    """
+
+    def __init__(self, index):
+        """
+        Initializes an instance of the AsyncLocalVectorIndex class.
+
+        Args:
+            index (LocalVectorIndex): The local index.
+        """
+        self.index = index
+
+    async def search(self, *args, **kwargs):
+        return self.index.search(*args, **kwargs)
+
+    async def search_batch(self, *args, **kwargs):
+        return self.index.search_batch(*args, **kwargs)
+
+    async def retrieve(self, *args, **kwargs):
+        return self.index.retrieve(*args, **kwargs)
+
+    async def count(self, *args, **kwargs):
+        return self.index.count(*args, **kwargs)
+
+
+if __name__ == "__main__":
+    build_local_index(
+        r"vector-db-persist-directory/book data",
+        r"vector-db-persist-directory/local index",
+    )
@@ -1,94 +1,228 @@
+import asyncio
 import os
-from concurrent.futures import ThreadPoolExecutor
-
-from chatbot_agent import ChatbotAgent
-from handle_multiprocessing import process_request
-
-def main(message="", messages=[""]):
-    # Initialize the ChatbotAgent.
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    if not openai_api_key:
-        raise ValueError("OPENAI_API_KEY environment variable not set.")
-    qdrant_url = os.getenv("QDRANT_URL")
-    if not qdrant_url:
-        raise ValueError("QDRANT_URL environment variable not set.")
-    qdrant_api_key = os.getenv("QDRANT_API_KEY")
-    if not qdrant_api_key:
-        raise ValueError("QDRANT_API_KEY environment variable not set.")
+import time
 
+from agent_pool import get_agent_pool
+from handle_multiprocessing import ERROR_ANSWER, SCORE_THRESHOLD, process_request
+
+# "single" answers from all the chunks with one call, "map_reduce" answers from every chunk then combines the answers.
+# The default is "single"; set SYNTHESIS_MODE=map_reduce to answer as before.
+SYNTHESIS_MODES = ("single", "map_reduce")
+DEFAULT_SYNTHESIS_MODE = os.getenv("SYNTHESIS_MODE", "single")
+
+OFF_TOPIC_ANSWER = "I'm sorry, I could not find anything related to your question in the book. Could you ask a question about data science, machine learning or deep learning?"
+
+
+def format_links(link_list_list):
+    """
+    Format the links of an answer as one link per line, without duplicates.
+
+    Args:
+        link_list_list (list): The links of every source or partial answer.
+
+    Returns:
+        links (str): The links, in their first order of appearance.
+    """
+    return "\n".join(dict.fromkeys(link for link_list in link_list_list for link in link_list))
+
+
+async def amain_stream(message="", messages=None, agent_pool=None, synthesis_mode=None):
+    """
+    Run the chat pipeline, yielding progress events during retrieval and answering,
+    then the tokens of the final answer as the model produces them.
+
+    Args:
+        message (str): A new message appended to the conversation.
+        messages (list): The messages of the conversation, the last one being the query.
+        agent_pool (AgentPool): The pool providing the shared clients.
+        synthesis_mode (str): One of SYNTHESIS_MODES, DEFAULT_SYNTHESIS_MODE by default.
+
+    Yields:
+        event (dict): An event with an "event" type ("progress", "token" or "links") and its "data",
+            the links of the answer being sent once the answer is complete.
+    """
+    synthesis_mode = synthesis_mode or DEFAULT_SYNTHESIS_MODE
+    if synthesis_mode not in SYNTHESIS_MODES:
+        raise ValueError(f"Unknown synthesis mode: {synthesis_mode}.")
+
+    # Get a ChatbotAgent for this conversation, backed by the clients shared across requests.
+    if agent_pool is None:
+        agent_pool = get_agent_pool()
+
+    # Copy the messages, so that neither the caller's list nor a default is mutated.
+    messages = list(messages) if messages is not None else [""]
     if message:
         messages.append(message)
 
-    global chatbot_agent
-    chatbot_agent = ChatbotAgent(
-        openai_api_key=openai_api_key,
-        qdrant_url=qdrant_url,
-        qdrant_api_key=qdrant_api_key,
-        messages=messages,
-    )
+    chatbot_agent = agent_pool.acquire(messages=messages)
 
     # Start the conversation.
+    start_time = time.perf_counter()
     query = messages[-1]
     answer_list = []
     link_list = []
-    # query it using content vector.
-    query_results = chatbot_agent.search_context_qdrant(
-        chatbot_agent.convert_chat_history_to_string(new_query=query, user_only=True),
-        "Articles",
-        top_k=4,
+    search_query = chatbot_agent.convert_chat_history_to_string(
+        new_query=query, user_only=True
     )
+    embedded_query = await chatbot_agent.embedding_service.aembed(search_query)
 
-    article_ids_plus_one = [min(article.id + 1, 932 - 1) for article in query_results]
-    article_ids_minus_one = [max(article.id - 1, 0) for article in query_results]
-    retrieved_articles_plus_one = chatbot_agent.qdrant_client.retrieve(
-        collection_name="Articles", ids=article_ids_plus_one
+    # Answer from the cache when a similar question was answered from the same collection.
+    answer_cache = agent_pool.answer_cache
+    collection_version = await answer_cache.acollection_version(
+        agent_pool.async_qdrant_client, "Articles"
     )
-    retrieved_articles_minus_one = chatbot_agent.qdrant_client.retrieve(
-        collection_name="Articles", ids=article_ids_minus_one
-    )
-    requests = [
-        (
-            chatbot_agent,
-            # Concatenate the existing article content with the content retrieved using the article's id.
-            # 'retrieve' function returns a list of points, so we need to access the first (and in this case, only) result with '[0]'.
-            (retrieved_articles_minus_one[i].payload["content"] + "\n" +
-             article.payload["content"] + "\n" +
-             retrieved_articles_plus_one[i].payload["content"]),
-            chatbot_agent.convert_chat_history_to_string(
-                user_only=True, remove_resource=True
-            ),
-            query,
-            article.payload["link"],
-            article.score,
+    cached_answer = answer_cache.lookup(embedded_query, collection_version)
+    if cached_answer is not None:
+        print(
+            f"Answer cache hit (similarity {cached_answer.similarity:.3f}), "
+            f"saved {cached_answer.latency:.2f} s. Cache stats: {answer_cache.stats()}"
         )
-        for i, article in enumerate(query_results)
+        yield {"event": "progress", "data": "Found an answer to a similar question."}
+        yield {"event": "token", "data": cached_answer.answer}
+        yield {"event": "links", "data": format_links(cached_answer.link_list_list)}
+        return
+
+    # query it using the title and content vectors and the BM25 index.
+    yield {"event": "progress", "data": "Searching the book..."}
+    query_results = await agent_pool.retriever.search(
+        search_query, top_k=4, embedded_query=embedded_query
+    )
+
+    # Drop the chunks that would be rejected before spending any request on them.
+    query_results = [
+        article for article in query_results if article.score > SCORE_THRESHOLD
     ]
+    if not query_results:
+        print("No chunk passed the score threshold, answering without the model.")
+        yield {"event": "token", "data": OFF_TOPIC_ANSWER}
+        return
+
+    if synthesis_mode == "single":
+        # Answer from all the chunks with one call, sending the chunks shared by several hits once.
+        sources = {}
+        seen_ids = set()
+        for points in await agent_pool.context_expander.expand_points(
+            query_results, collection_version
+        ):
+            for point in points:
+                if str(point.id) in seen_ids:
+                    continue
+                seen_ids.add(str(point.id))
+                link = point.payload["link"].replace("_sources", "").replace(".md", ".html")
+                sources.setdefault(link, []).append(point.payload["content"])
+        prompt, link_list, error_message = chatbot_agent.build_synthesis_prompt(
+            query, list(sources.items())
+        )
+        # Only the pages packed into the prompt can be cited by the answer.
+        link_list_list = [[link] for link in link_list]
 
-    # Use a Pool to manage the processes.
-    with ThreadPoolExecutor(max_workers=len(query_results)) as executor:
-        results = list(executor.map(process_request, requests))
+        yield {"event": "progress", "data": f"Writing the answer from {len(link_list)} pages..."}
+        answer_stream = chatbot_agent.prompt_synthesis_stream(prompt, error_message)
+        cacheable = True
+    else:
+        # Surround every chunk with its neighbors in the same page, fetched in a single request.
+        contexts = await agent_pool.context_expander.expand(query_results, collection_version)
+        requests = [
+            (
+                chatbot_agent,
+                context,
+                chatbot_agent.convert_chat_history_to_string(
+                    user_only=True, remove_resource=True
+                ),
+                query,
+                article.payload["link"],
+                article.score,
+            )
+            for article, context in zip(query_results, contexts)
+        ]
 
-    # Results is a list of tuples of the form (answer, link).
-    answer_list, link_list = zip(*results)
+        # Answer every chunk concurrently on the event loop, reporting each one as it completes.
+        yield {"event": "progress", "data": f"Reading {len(requests)} sections of the book..."}
+        tasks = [asyncio.ensure_future(process_request(request)) for request in requests]
+        try:
+            for answered_number, task in enumerate(asyncio.as_completed(tasks), start=1):
+                await task
+                yield {
+                    "event": "progress",
+                    "data": f"Answered from {answered_number}/{len(tasks)} sections.",
+                }
+        finally:
+            for task in tasks:
+                task.cancel()  # Only has an effect if the client went away mid-stream.
+        results = [task.result() for task in tasks]
 
-    # Initialize link_list_list with each link from link_list as a separate list.
-    link_list_list = [[link] for link in link_list]
-    # For each answer, perform the query and add the result to the corresponding list in link_list_list.
-    for i, answer in enumerate(answer_list):
-        secondary_query_results_temp = chatbot_agent.search_context_qdrant(
-            answer, "Articles", top_k=2
+        # Results is a list of tuples of the form (answer, link).
+        answer_list, link_list = zip(*results)
+
+        # Initialize link_list_list with each link from link_list as a separate list.
+        link_list_list = [[link] for link in link_list]
+        # Search the links related to every answer with one embedding request and one search request.
+        secondary_query_results_list = await chatbot_agent.search_context_qdrant_batch(
+            answer_list, "Articles", top_k=2
         )
-        link_list_list[i].extend(
-            article.payload["link"].replace("_sources", "").replace(".md", ".html")
-            for article in secondary_query_results_temp
+        for related_links, secondary_query_results in zip(
+            link_list_list, secondary_query_results_list
+        ):
+            related_links.extend(
+                article.payload["link"].replace("_sources", "").replace(".md", ".html")
+                for article in secondary_query_results
+            )
+
+        yield {"event": "progress", "data": "Writing the answer..."}
+        prompt, error_message = chatbot_agent.build_combine_prompt(
+            query, answer_list, link_list_list
         )
+        answer_stream = chatbot_agent.prompt_synthesis_stream(prompt, error_message)
+        # The combined answer misses the sections whose call failed, so it is not cached.
+        cacheable = ERROR_ANSWER not in answer_list
 
-    combine_answer = chatbot_agent.prompt_combine_chain(
-        query=query, answer_list=answer_list, link_list_list=link_list_list
-    )
+    combine_answer = ""
+    async for delta in answer_stream:
+        combine_answer += delta
+        yield {"event": "token", "data": delta}
+    yield {"event": "links", "data": format_links(link_list_list)}
+
+    # Only cache the answers written by the model, not the error messages answered instead.
+    if cacheable and error_message is None and link_list_list:
+        answer_cache.store(
+            embedded_query,
+            collection_version,
+            combine_answer,
+            link_list_list,
+            time.perf_counter() - start_time,
+        )
+
+
+async def amain(message="", messages=None, agent_pool=None, synthesis_mode=None):
+    """
+    Run the chat pipeline and return the complete answer.
+    """
+    combine_answer = ""
+    async for event in amain_stream(
+        message=message,
+        messages=messages,
+        agent_pool=agent_pool,
+        synthesis_mode=synthesis_mode,
+    ):
+        if event["event"] == "token":
+            combine_answer += event["data"]
 
     return combine_answer
 
 
+def main(message="", messages=None, agent_pool=None, synthesis_mode=None):
+    """
+    Run the chat pipeline from synchronous code, such as a script.
+    """
+    return asyncio.run(
+        amain(
+            message=message,
+            messages=messages,
+            agent_pool=agent_pool,
+            synthesis_mode=synthesis_mode,
+        )
+    )
+
+
 if __name__ == "__main__":
     main()
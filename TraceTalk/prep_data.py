@@ -1,36 +1,212 @@
 # Import basic libraries.
-import ast
+import hashlib
+import json
 import os
 import re
-import warnings
 
-import pandas as pd
-import requests
+import numpy as np
+
+from answer_cache import set_collection_version
+from bulk_upsert import upsert_book_dataset
+from dataset_store import (
+    MANIFEST_FILE,
+    BookDatasetWriter,
+    index_dataset_pages,
+    iter_book_dataset,
+    load_book_dataset_vectors,
+    load_manifest,
+    read_metadata_rows,
+    replace_dataset_directory,
+)
+from fetcher import MarkdownFetcher
+from hybrid_search import build_bm25_index
 
 # Import Qdrant libraries.
 from qdrant_client import QdrantClient, models
-from src import get_emmbeddings, get_tokens_number
+from src import count_tokens_many, get_embedding_service, make_point_id
+
+CODE_CELL_PLACEHOLDER = "TEMPLATE_CODE_CELL_"
+CODE_FENCE = "```"
+PARTIAL_DIRECTORY_SUFFIX = ".partial"
+UPSERT_CHECKPOINT_FILE = "upsert_checkpoint.json"
 
 
 def prep_book_data(
-    csv_file_path=r"vector-db-persist-directory/book data/book data.csv",
+    dataset_directory=r"vector-db-persist-directory/book data",
+    incremental=False,
+    local_directory=None,
+    input_directory=r"vector-db-persist-directory/resources",
+    window_size=256,
+    resume=True,
 ):
     """
     This function prepares the book data for the vector database.
 
+    The pages flow through generators, window by window: they are fetched, chunked and
+    embedded, then appended to the book data of a partial directory, which replaces the
+    previous book data once complete. A checkpoint is made after every window, so the
+    memory used does not grow with the book, and a crashed run resumes after the last
+    page it wrote.
+
     Args:
-        csv_file_path (str): The path to the CSV file containing the book data.
+        dataset_directory (str): The directory where the book data is stored.
+        incremental (bool): If True, reuse the rows of the pages whose content did not change since the last run.
+        local_directory (str): The root of a checked-out copy of the book, read instead of downloading the pages.
+        input_directory (str): The directory of the resource files listing the pages of the book.
+        window_size (int): The number of chunks embedded and written together.
+        resume (bool): If True, continue the partial book data of a crashed run instead of starting over.
+    """
+    # The rows of the previous run, by page, so that unchanged pages can be copied as they are.
+    previous_pages = {}
+    if incremental and os.path.exists(os.path.join(dataset_directory, MANIFEST_FILE)):
+        previous_pages = index_dataset_pages(dataset_directory)
+
+    partial_directory = dataset_directory + PARTIAL_DIRECTORY_SUFFIX
+    writer = BookDatasetWriter(partial_directory, resume=resume)
+    if writer.done_keys:
+        print(f"Resuming after {len(writer.done_keys)} pages and {writer.count} chunks.")
+
+    # The (title, link, converted link) of every page left.
+    pages = [page for page in list_book_pages(input_directory) if page[2] not in writer.done_keys]
+    fetcher = MarkdownFetcher(local_directory=local_directory)
+    embedding_service = get_embedding_service()
+    page_records = iter_page_records(pages, fetcher, dataset_directory, previous_pages)
+    for records, title_vectors, content_vectors, page_ends in iter_embedded_windows(
+        page_records, embedding_service, window_size
+    ):
+        window_start = writer.rows_number
+        writer.append(records, title_vectors, content_vectors)
+        if page_ends:
+            # Only the complete pages are checkpointed, a resumed run writes the others again.
+            writer.checkpoint(window_start + page_ends[-1][0], [link for _, link in page_ends])
+    writer.close()
+    print(f"Number of chunks: {writer.count}")
+    print(f"Number of embedding requests: {embedding_service.requests_number}")
+    if embedding_service.cache is not None:
+        print(f"Embedding cache stats: {embedding_service.cache.stats()}")
+
+    build_bm25_index(
+        (book_dataset.metadata for book_dataset in iter_book_dataset(partial_directory)),
+        partial_directory,
+    )
+    replace_dataset_directory(partial_directory, dataset_directory)
 
-    Returns:
-        book_data (list): A list of dictionaries containing the book data.
+
+def iter_page_records(pages, fetcher, dataset_directory=None, previous_pages=None, fetch_window=32):
     """
-    book_data = []  # Create an empty list to store book data.
-    id = 0  # Set an initial value for the ID counter.
+    Fetch and chunk the pages, a window of pages at a time.
 
-    input_directory = (
-        r"vector-db-persist-directory/resources"  # Set the defualt directory.
-    )
+    Args:
+        pages (list): The (title, link, converted link) of the pages.
+        fetcher (MarkdownFetcher): The fetcher of the pages.
+        dataset_directory (str): The directory of the previous book data.
+        previous_pages (dict): The rows of every page of the previous book data, as given by index_dataset_pages.
+        fetch_window (int): The number of pages downloaded concurrently.
+
+    Yields:
+        link (str): The converted link of the page.
+        records (list): The chunks of the page, without their vectors.
+        title_vectors (np.ndarray): The title vectors of the reused chunks, or None for chunks to embed.
+        content_vectors (np.ndarray): The content vectors of the reused chunks, or None for chunks to embed.
+    """
+    previous_pages = previous_pages or {}
+    previous_vectors = load_book_dataset_vectors(dataset_directory) if previous_pages else None
+
+    def previous_rows(converted_link):
+        _, start, end, byte_start, byte_end = previous_pages[converted_link]
+        return (
+            converted_link,
+            read_metadata_rows(dataset_directory, byte_start, byte_end),
+            np.array(previous_vectors.title_vectors[start:end]),
+            np.array(previous_vectors.content_vectors[start:end]),
+        )
+
+    for start in range(0, len(pages), fetch_window):
+        window = pages[start : start + fetch_window]
+        # Download the pages of the window concurrently, or read them from a local copy of the book.
+        md_contents = fetcher.fetch_many([converted_link for _, _, converted_link in window])
+        print(f"Fetch stats: {fetcher.stats}")
+
+        for (md_title, link, converted_link), md_content in zip(window, md_contents):
+            if md_content is None:
+                if converted_link in previous_pages:
+                    # Keep the previous version of the page rather than dropping it on a failed download.
+                    yield previous_rows(converted_link)
+                    continue
+                md_content = ""
+
+            page_hash = get_content_hash(md_content)
+            if (
+                converted_link in previous_pages
+                and previous_pages[converted_link][0] == page_hash
+            ):
+                yield previous_rows(converted_link)
+                continue
+            print(f"Processing {md_title}: {link}...")
+            yield converted_link, chunk_page(md_title, converted_link, md_content, page_hash), None, None
+
+
+def iter_embedded_windows(page_records, embedding_service, window_size=256):
+    """
+    Group the chunks of the pages into windows, embedding the ones without vectors with batched requests.
 
+    Args:
+        page_records (iterable): The (link, records, title vectors, content vectors) of every page,
+            as given by iter_page_records.
+        embedding_service (EmbeddingService): The embedding service.
+        window_size (int): The number of chunks of a window, the last one being smaller.
+
+    Yields:
+        records (list): The chunks of the window.
+        title_vectors (np.ndarray): Their title vectors.
+        content_vectors (np.ndarray): Their content vectors.
+        page_ends (list): The (number of chunks of the window, link) of every page ending in the window.
+    """
+    records, title_vectors, content_vectors, page_ends = [], [], [], []
+
+    def flush():
+        # Embed the missing vectors of the window in one batched call per vector.
+        missing_rows = [i for i, vector in enumerate(content_vectors) if vector is None]
+        if missing_rows:
+            for vectors, field in ((title_vectors, "title"), (content_vectors, "content")):
+                embeddings = embedding_service.embed_many([records[i][field] for i in missing_rows])
+                for i, embedding in zip(missing_rows, embeddings):
+                    vectors[i] = embedding
+        return (
+            records,
+            np.array(title_vectors, dtype=np.float32).reshape(len(records), -1),
+            np.array(content_vectors, dtype=np.float32).reshape(len(records), -1),
+            page_ends,
+        )
+
+    for link, page_records_list, page_title_vectors, page_content_vectors in page_records:
+        for i, record in enumerate(page_records_list):
+            records.append(record)
+            title_vectors.append(None if page_title_vectors is None else page_title_vectors[i])
+            content_vectors.append(None if page_content_vectors is None else page_content_vectors[i])
+            if i == len(page_records_list) - 1:
+                page_ends.append((len(records), link))
+            if len(records) >= window_size:
+                yield flush()
+                records, title_vectors, content_vectors, page_ends = [], [], [], []
+        if not page_records_list:
+            page_ends.append((len(records), link))
+    if records or page_ends:
+        yield flush()
+
+
+def list_book_pages(input_directory=r"vector-db-persist-directory/resources"):
+    """
+    List the pages of the book from the resource files.
+
+    Args:
+        input_directory (str): The directory of the .txt resource files listing the links of the pages.
+
+    Returns:
+        pages (list): The (title, link, converted link) of every page, each page once.
+    """
+    pages = []
+    processed_links = set()  # The same page can be listed in several resource files.
     for file in os.listdir(input_directory):
         if file.endswith(".txt"):
             with open(os.path.join(input_directory, file), "r") as f:
@@ -42,69 +218,126 @@ def prep_book_data(
                 md_file = link.rsplit("/", 1)[-1]
                 md_title = md_file[:-3]  # Remove the .md suffix.
 
-                # Get the contents of the .md file.
+                # Get the link of the .md file on the rendered book.
                 converted_link = (
                     link.replace("github.com/open-academy", "ocademy-ai.github.io")
                     .replace("tree/main", "_sources")
                     .replace("open-machine-learning-jupyter-book/", "")
                 )
-                md_content_request = requests.get(converted_link)
-                md_content = (
-                    md_content_request.text
-                    if md_content_request.status_code == 200
-                    else ""
-                )
-                print(f"Processing {md_title}: {link}...")
-
-                md_content_split = split_text_into_chunks(
-                    md_content, chunk_max_tokens=300
-                )  # Split the text into chunks.
-                for text in md_content_split:
-                    if not text:
-                        continue
-                    id = id + 1
-
-                    # Add the book data to the list.
-                    book_data.append(
-                        {
-                            "id": id,
-                            "title": md_title,
-                            "title_vector": get_emmbeddings(md_title),
-                            "content": text,  # Further optimization can be done by splitting files to reduce text volume.
-                            "content_vector": get_emmbeddings(
-                                text
-                            ),  # Further optimization can be done by splitting files to reduce text volume.
-                            "link": converted_link,
-                        }
-                    )
-
-    # Convert the book_data list into a pandas DataFrame.
-    book_data_df = pd.DataFrame(book_data)
-    print("Shape of the book data DataFrame:", book_data_df.shape)
-    book_data_df.to_csv(csv_file_path, index=False)
+                if converted_link in processed_links:
+                    continue
+                processed_links.add(converted_link)
+                pages.append((md_title, link, converted_link))
+    return pages
+
+
+def chunk_page(md_title, link, md_content, page_hash=None, chunk_max_tokens=300):
+    """
+    Split a page into the chunk records stored in the vector database, without their vectors.
+
+    Args:
+        md_title (str): The title of the page.
+        link (str): The link of the page.
+        md_content (str): The Markdown content of the page.
+        page_hash (str): The content hash of the page, computed if not given.
+        chunk_max_tokens (int): The number of tokens after which a chunk is closed.
+
+    Returns:
+        chunks (list): One dictionary per chunk, with its stable ID and content hashes.
+    """
+    if page_hash is None:
+        page_hash = get_content_hash(md_content)
+    md_content_split = split_text_into_chunks(md_content, chunk_max_tokens=chunk_max_tokens)
+    md_content_split = [text for text in md_content_split if text]
+    return [
+        {
+            "id": make_point_id(link, chunk_index),
+            "title": md_title,
+            "content": text,
+            "link": link,
+            "chunk_index": chunk_index,
+            "page_hash": page_hash,
+            "chunk_hash": get_content_hash(md_title + "\n" + text),
+        }
+        for chunk_index, text in enumerate(md_content_split)
+    ]
+
+
+def get_quantization_config(quantization=None):
+    """
+    Get the configuration of the quantized vectors searched first by Qdrant.
+
+    The quantized vectors are kept in memory, the full precision vectors are only
+    read to rescore the best candidates.
+
+    Args:
+        quantization (str): "int8" for the scalar quantization, "binary" for the binary
+            quantization, or None for no quantization.
+
+    Returns:
+        quantization_config: The ScalarQuantization or BinaryQuantization, or None.
+    """
+    if quantization is None:
+        return None
+    if quantization == "int8":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+            )
+        )
+    if quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    raise ValueError(f"Unknown quantization {quantization}, expected 'int8' or 'binary'.")
+
+
+def get_vectors_config(vector_size=1536, quantization=None):
+    """
+    Get the configuration of the title and content vectors of a collection.
+
+    Args:
+        vector_size (int): The size of the vectors.
+        quantization (str): "int8" or "binary" to search quantized vectors first, with the full
+            precision vectors stored on disk, or None to only store the full precision vectors.
+
+    Returns:
+        vectors_config (dict): The VectorParams of each named vector.
+    """
+    quantization_config = get_quantization_config(quantization)
+    return {
+        name: models.VectorParams(
+            size=vector_size,
+            distance=models.Distance.COSINE,
+            on_disk=True if quantization_config else None,
+            quantization_config=quantization_config,
+        )
+        for name in ("title", "content")
+    }
 
 
 def update_collection_to_database(
-    csv_file_path=r"vector-db-persist-directory/book data/book data.csv",
+    dataset_directory=r"vector-db-persist-directory/book data",
+    incremental=False,
+    window_size=1024,
+    resume=True,
+    quantization=None,
 ):
     """
     This function updates the Qdrant database collection with the book data.
 
+    The book data is read and upserted window by window, so the memory used does not
+    grow with the book. When the collection is recreated, the upserted rows are
+    checkpointed, and a crashed run resumes after them.
+
     Args:
-        csv_file_path (str, optional): The path to the CSV file containing the book data.
+        dataset_directory (str, optional): The directory where the book data is stored.
+        incremental (bool): If True, only upsert the changed chunks and delete the removed ones,
+            instead of recreating the collection.
+        window_size (int): The number of rows read and upserted together.
+        resume (bool): If True, continue the upsert of a crashed run of the same book data.
+        quantization (str): "int8" or "binary" to create the collection with quantized vectors,
+            or None for full precision vectors only. An existing collection keeps its configuration.
     """
-    # Load the book data DataFrame.
-    book_data_df = pd.read_csv(csv_file_path)
-
-    def convert_string_to_list(s):
-        return ast.literal_eval(s)
-
-    book_data_df["title_vector"] = book_data_df["title_vector"].apply(
-        convert_string_to_list
-    )
-    book_data_df["content_vector"] = book_data_df["content_vector"].apply(
-        convert_string_to_list
-    )
+    manifest = load_manifest(dataset_directory)
 
     # Initialize client.
     qdrant_url = os.getenv("QDRANT_URL")
@@ -118,118 +351,274 @@ def update_collection_to_database(
 
     client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key)
 
+    # The rows already upserted into the recreated collection by a crashed run of the same book data.
+    checkpoint_path = os.path.join(dataset_directory, UPSERT_CHECKPOINT_FILE)
+    upserted_rows = 0
+    if resume and not incremental and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r") as f:
+            checkpoint = json.load(f)
+        if checkpoint["version"] == manifest.get("version"):
+            upserted_rows = checkpoint["rows"]
+            print(f"Resuming after {upserted_rows} upserted chunks.")
+
     # Create a new collection of the Qdrant database.
-    vector_size = 1536
-    client.recreate_collection(
-        collection_name="Articles",
-        vectors_config={
-            "title": models.VectorParams(
-                size=vector_size, distance=models.Distance.COSINE
-            ),
-            "content": models.VectorParams(
-                size=vector_size, distance=models.Distance.COSINE
-            ),
-        },
-    )
+    vectors_config = get_vectors_config(manifest["dimension"] or 1536, quantization)
+    stored_chunk_hashes = {}
+    if not incremental:
+        if not upserted_rows:
+            client.recreate_collection(
+                collection_name="Articles",
+                vectors_config=vectors_config,
+            )
+    else:
+        if not client.collection_exists("Articles"):
+            client.create_collection(
+                collection_name="Articles",
+                vectors_config=vectors_config,
+            )
+        # Compare the chunk hashes stored in the collection with the ones of the book data.
+        stored_chunk_hashes = get_stored_chunk_hashes(client, "Articles")
+
+    # Upsert the data into the collection of the Qdrant database, window by window.
+    upsert_stats = {"points": 0, "batches": 0, "retries": 0, "seconds": 0.0}
+    rows_number = 0
+    for book_dataset in iter_book_dataset(dataset_directory, window_size):
+        metadata = book_dataset.metadata
+        title_vectors = book_dataset.title_vectors
+        content_vectors = book_dataset.content_vectors
+        rows_number += len(metadata)
+        if rows_number <= upserted_rows:
+            continue
+        if incremental:
+            # The IDs left in stored_chunk_hashes at the end are the ones of the removed chunks.
+            changed = np.array(
+                [
+                    stored_chunk_hashes.pop(str(id), None) != chunk_hash
+                    for id, chunk_hash in zip(metadata["id"], metadata["chunk_hash"])
+                ],
+                dtype=bool,
+            )
+            metadata = metadata[changed]
+            title_vectors = title_vectors[changed]
+            content_vectors = content_vectors[changed]
+        if len(metadata):
+            window_stats = upsert_book_dataset(
+                client,
+                "Articles",
+                metadata,
+                {"title": title_vectors, "content": content_vectors},
+            )
+            for key in upsert_stats:
+                upsert_stats[key] += window_stats[key]
+        if not incremental:
+            with open(checkpoint_path + ".tmp", "w") as f:
+                json.dump({"version": manifest.get("version"), "rows": rows_number}, f)
+            os.replace(checkpoint_path + ".tmp", checkpoint_path)
+    print(f"Upsert stats: {upsert_stats}")
+
+    removed_ids = list(stored_chunk_hashes)
+    if removed_ids:
+        print(f"Deleting {len(removed_ids)} removed chunks.")
+        client.delete(
+            collection_name="Articles",
+            points_selector=models.PointIdsList(points=removed_ids),
+        )
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    # Drop the answers cached for the previous content of the collection.
+    if not incremental or removed_ids or upsert_stats["points"]:
+        set_collection_version(client, "Articles")
+
+
+def get_stored_chunk_hashes(client, collection_name):
+    """
+    Get the chunk hash of every point stored in the collection.
 
-    # Upsert the data into the collection of the Qdrant database.
-    batch_size = 50  # Adjust this value to fit within Qdrant's size limits.
-    # Divide data into batches.
-    batches = [
-        book_data_df[i : i + batch_size]
-        for i in range(0, book_data_df.shape[0], batch_size)
-    ]
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): The name of the collection.
 
-    for batch in batches:
-        points = []
-        for _, row in batch.iterrows():
-            point = models.PointStruct(
-                id=row["id"],
-                vector={
-                    "title": row["title_vector"],
-                    "content": row["content_vector"],
-                },
-                payload=row.to_dict(),
-            )
-            points.append(point)
-            print(f"Upserting point with id: {row['id']}")
+    Returns:
+        chunk_hashes (dict): A dictionary mapping the point ID, as stored (an integer or a UUID string),
+            to its chunk hash, None for the points ingested before the chunk hashes.
+    """
+    chunk_hashes = {}
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            with_payload=["chunk_hash"],
+            with_vectors=False,
+            limit=1000,
+            offset=offset,
+        )
+        for record in records:
+            # Keep the ID as stored, so that the legacy integer IDs can still be deleted.
+            chunk_hashes[record.id] = (record.payload or {}).get("chunk_hash")
+        if offset is None:
+            return chunk_hashes
+
+
+def get_content_hash(text):
+    """
+    Get the content hash of the text.
+
+    Args:
+        text (str): The text to hash.
 
-        client.upsert(collection_name="Articles", points=points)
+    Returns:
+        content_hash (str): The hexadecimal SHA-256 hash of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
 def split_text_into_chunks(
-    text, delimiter="\n# ", chunk_max_tokens=600, MAX_TOKENS=4096
+    text,
+    delimiter="\n# ",
+    chunk_max_tokens=600,
+    MAX_TOKENS=4096,
+    overlap_tokens=0,
+    heading_levels=None,
 ):
+    """
+    Split a Markdown page into chunks of about chunk_max_tokens tokens.
+
+    Every sentence and code cell is tokenized once and the chunk sizes are kept
+    as running totals, so the work is linear in the length of the page.
+
+    Args:
+        text (str): The Markdown text to split.
+        delimiter (str): The delimiter where a new section starts, when heading_levels is not set.
+        chunk_max_tokens (int): The number of tokens after which a chunk is closed.
+        MAX_TOKENS (int): The maximum number of tokens of the model.
+        overlap_tokens (int): The number of tokens of trailing sentences repeated at the start of the next chunk.
+        heading_levels (int): If set, start a new section at every heading of this level or above.
+
+    Returns:
+        final_chunks (list): The chunks of the text.
+    """
     begin_pattern = r"---.*?---"
     text = re.sub(begin_pattern, "", text, flags=re.DOTALL)
     text = "\n" + text
 
-    # Remove code cells from text.
+    # Replace the code cells with numbered placeholders, they are put back once the prose is chunked.
     code_pattern = r"(```{code-cell}.*?```)"
     code_cells = re.findall(code_pattern, text, flags=re.DOTALL)
-    text = re.sub(code_pattern, "TEMPLATE_CODE_CELL\n", text, flags=re.DOTALL)
-
-    chunks = re.split(
-        "((?:^|\n)(?={}(?!#)))".format(delimiter), text, flags=re.MULTILINE
+    code_cell_index = iter(range(len(code_cells)))
+    text = re.sub(
+        code_pattern,
+        lambda _: f"{CODE_CELL_PLACEHOLDER}{next(code_cell_index)}\n",
+        text,
+        flags=re.DOTALL,
     )
-    chunks = [chunk for chunk in chunks if chunk.strip()]
-
-    final_chunks = []
-    for chunk in chunks:
-        # Split the chunk into the sentences.
-        sentences = re.split(r"([.?!])", chunk)
-        current_n_sentences = []
-        for sentence in sentences:
-            current_n_sentences.append(sentence)
-
-            # When the number of words reaches chunk_size, add a new chunk.
-            if get_tokens_number("".join(current_n_sentences)) >= chunk_max_tokens:
-                final_chunks.append("".join(current_n_sentences))
-                current_n_sentences = []
-        # Add the last chunk.
-        if current_n_sentences:
-            final_chunks.append("".join(current_n_sentences))
-
-    for i, chunk in enumerate(final_chunks):
-        try:
-            while "TEMPLATE_CODE_CELL" in chunk and code_cells:
-                code_cell = code_cells.pop(0)
 
-                # Split the code cell into lines.
-                code_cell_lines = code_cell.split("\n")
+    if heading_levels:
+        section_pattern = r"(?=\n#{{1,{}}} )".format(heading_levels)
+    else:
+        section_pattern = "(?={})".format(re.escape(delimiter))
+    sections = [section for section in re.split(section_pattern, text) if section.strip()]
 
-                # If the code cell can be inserted without exceeding the chunk size, do it.
-                if (
-                    get_tokens_number(chunk.replace("TEMPLATE_CODE_CELL", code_cell, 1))
-                    <= chunk_max_tokens * 2
+    final_chunks = []
+    final_chunks_tokens = []
+    for section in sections:
+        # Split the section into sentences, keeping each punctuation mark with its sentence.
+        parts = re.split(r"([.?!])", section)
+        sentences = [
+            sentence + punctuation
+            for sentence, punctuation in zip(parts[0::2], parts[1::2] + [""])
+        ]
+
+        current_sentences = []
+        current_tokens = []
+        current_tokens_number = 0
+        # Whether the current chunk has sentences that are not in the previous chunk.
+        has_new_sentences = False
+        for sentence, sentence_tokens_number in zip(
+            sentences, count_tokens_many(sentences)
+        ):
+            current_sentences.append(sentence)
+            current_tokens.append(sentence_tokens_number)
+            current_tokens_number += sentence_tokens_number
+            has_new_sentences = has_new_sentences or bool(sentence.strip())
+
+            # When the number of tokens reaches chunk_max_tokens, add a new chunk.
+            if current_tokens_number >= chunk_max_tokens:
+                final_chunks.append("".join(current_sentences))
+                final_chunks_tokens.append(current_tokens_number)
+
+                # Start the next chunk with the trailing sentences that fit in the overlap window.
+                overlap_start = len(current_sentences)
+                overlap_tokens_number = 0
+                while (
+                    overlap_start > 0
+                    and overlap_tokens_number + current_tokens[overlap_start - 1]
+                    <= overlap_tokens
+                    and CODE_CELL_PLACEHOLDER not in current_sentences[overlap_start - 1]
                 ):
-                    chunk = chunk.replace("TEMPLATE_CODE_CELL", code_cell, 1)
-                # If not, insert as many lines as possible.
-                else:
-                    code_cell_lines = []
-                    for line in code_cell_lines:
-                        # If the next line can be inserted without exceeding the chunk size, do it.
-                        if (
-                            get_tokens_number(
-                                chunk.replace(
-                                    "TEMPLATE_CODE_CELL", "\n".join(code_cell_lines), 1
-                                )
-                            )
-                            <= chunk_max_tokens * 2
-                        ):  # chunk_size
-                            code_cell_lines.append(line)
-                        # If not, put the remaining lines back into code_cells and stop.
-                        else:
-                            break
-                    chunk = chunk.replace(
-                        "TEMPLATE_CODE_CELL", "\n".join(code_cell_lines)
-                    )
-
-            final_chunks[i] = chunk
-            print(f"Tokens number of chunk {i}: {get_tokens_number(chunk)}")
-        except IndexError:
-            warnings.warn(
-                "Code cells mismatch. The number of 'TEMPLATE_CODE_CELL' placeholders and actual code cells do not match."
+                    overlap_start -= 1
+                    overlap_tokens_number += current_tokens[overlap_start]
+                current_sentences = current_sentences[overlap_start:]
+                current_tokens = current_tokens[overlap_start:]
+                current_tokens_number = overlap_tokens_number
+                has_new_sentences = False
+        # Add the last chunk, unless it only repeats the overlap of the previous one.
+        if has_new_sentences:
+            final_chunks.append("".join(current_sentences))
+            final_chunks_tokens.append(current_tokens_number)
+
+    # Put the code cells back, tokenizing each of them once.
+    code_cells_tokens = count_tokens_many(code_cells)
+    for i, chunk in enumerate(final_chunks):
+        if CODE_CELL_PLACEHOLDER in chunk:
+            final_chunks[i] = insert_code_cells(
+                chunk,
+                final_chunks_tokens[i],
+                code_cells,
+                code_cells_tokens,
+                chunk_max_tokens * 2,
             )
 
     return final_chunks
+
+
+def insert_code_cells(chunk, chunk_tokens_number, code_cells, code_cells_tokens, max_tokens):
+    """
+    Replace the code cell placeholders of a chunk with the code cells, as long as the chunk fits.
+
+    Args:
+        chunk (str): The chunk containing the placeholders.
+        chunk_tokens_number (int): The number of tokens of the chunk.
+        code_cells (list): The code cells of the page.
+        code_cells_tokens (list): The number of tokens of each code cell.
+        max_tokens (int): The maximum number of tokens of the chunk with its code cells.
+
+    Returns:
+        chunk (str): The chunk with its code cells.
+    """
+    parts = re.split(r"{}(\d+)".format(CODE_CELL_PLACEHOLDER), chunk)
+    for j in range(1, len(parts), 2):
+        code_cell_index = int(parts[j])
+        code_cell = code_cells[code_cell_index]
+
+        # If the code cell can be inserted without exceeding the chunk size, do it.
+        if chunk_tokens_number + code_cells_tokens[code_cell_index] <= max_tokens:
+            parts[j] = code_cell
+            chunk_tokens_number += code_cells_tokens[code_cell_index]
+        # If not, insert as many lines as possible, and close the truncated code cell.
+        else:
+            code_cell_lines = []
+            lines = code_cell.split("\n")
+            lines_tokens = count_tokens_many([line + "\n" for line in lines] + [CODE_FENCE])
+            fence_tokens_number = lines_tokens.pop()
+            for line, line_tokens_number in zip(lines, lines_tokens):
+                if chunk_tokens_number + line_tokens_number + fence_tokens_number > max_tokens:
+                    break
+                code_cell_lines.append(line)
+                chunk_tokens_number += line_tokens_number
+            if code_cell_lines:
+                code_cell_lines.append(CODE_FENCE)
+                chunk_tokens_number += fence_tokens_number
+            parts[j] = "\n".join(code_cell_lines)
+
+    return "".join(parts)
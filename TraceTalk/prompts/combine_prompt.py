@@ -1,22 +1,19 @@
-import re
-from langchain.prompts import PromptTemplate
 from jinja2 import Template
-from src import get_tokens_number
 
+from src import count_tokens_many
 
-# Combine prompt.
-def combine_prompt(chat_history, query, answer_list, link_list_list, MAX_TOKENS=3000):
-    n = len(answer_list)
 
-    template = f"""
+# The static sections of the combine prompt, compiled once.
+RULES_TEMPLATE = Template(
+    """
 ===== RULES =====
-Now I will provide you with {n} chains, here is the definition of chain: each chain contains an answer and a link. The answers in the chain are the results from the links.
+Now I will provide you with {{n}} chains, here is the definition of chain: each chain contains an answer and a link. The answers in the chain are the results from the links.
 In theory, each chain should produce a paragraph with links as the resources. It means that you MUST tell me from which references you make the summery.
 The smaller the number of the chain, the more important the information contained in the chain.
 Your final answer is verbose.
 But if the meaning of an answer in a certain chain is similar to 'I am not sure about your question' or 'I refuse to answer such a question', it means that this answer chain is deprecated, and you should actively ignore the information in this answer chain.
 
-You now are asked to try to answer and integrate these {n} chains (integration means avoiding repetition, writing logically, smooth writing, giving verbose answer), and answer it in 2-4 paragraphs appropriately.
+You now are asked to try to answer and integrate these {{n}} chains (integration means avoiding repetition, writing logically, smooth writing, giving verbose answer), and answer it in 2-4 paragraphs appropriately.
 The final answer is ALWAYS in Markdown format.
 Provide your answer in a style of CITATION format where you also list the resources from where you found the information at the end of the text. (an example is provided below)
 In addition, in order to demostrate the knowledge resources you have referred, please ALWAYs return a "RESOURCE" part in your answer. 
@@ -43,41 +40,91 @@ REFERENCE:
     [1] [title_link1](https://link1.com)
     [2] [title_link2](https://link2.com)
 
-"""
-
-    chat_history_text = """
+""",
+    keep_trailing_newline=True,
+)
+CHAT_HISTORY_TEMPLATE = Template(
+    """
 ===== CHAT HISTORY =====
 {{chat_history}}
 
-"""
-    template += chat_history_text
-
-    init_chain_tmp = f"Now I provide you with {n} chains:"
-    template += init_chain_tmp
-    for i in range(n):
-        link_list = "\n".join([item for item in link_list_list[i]])
-        template_tmp = f"""
-===== CHAIN {i+1} =====
+""",
+    keep_trailing_newline=True,
+)
+INIT_CHAIN_TEMPLATE = Template("Now I provide you with {{n}} chains:")
+CHAIN_TEMPLATE = Template(
+    """
+===== CHAIN {{index}} =====
 CONTEXT:
-{answer_list[i]}
+{{answer}}
 RESOURCE:
-{link_list}
-"""
-        if get_tokens_number(template + template_tmp) > MAX_TOKENS:
+{{link_list}}
+""",
+    keep_trailing_newline=True,
+)
+QUESTION_TEMPLATE = Template(
+    """
+=========
+ANSWER THE QUESTION "{{query}}", FINAL A VERBOSE ANSWER, language used for answers is CONSISTENT with QUESTION:"""
+)
+
+
+# Combine prompt.
+def combine_prompt(chat_history, query, answer_list, link_list_list, MAX_TOKENS=3000):
+    """
+    Pack the chains into the combine prompt, within the token budget.
+
+    Every section is tokenized once and the chains are packed against a running total.
+    The chains that do not fit only contribute their links, while they fit.
+
+    Args:
+        chat_history (str): The chat history.
+        query (str): The user's query.
+        answer_list (list): The answer of each chain, the most important first.
+        link_list_list (list): The links of each chain.
+        MAX_TOKENS (int): The maximum number of tokens of the prompt.
+
+    Returns:
+        prompt (str): The prompt.
+        tokens_number (int): The number of tokens of the prompt, as the sum of its sections.
+    """
+    n = len(answer_list)
+
+    head = (
+        RULES_TEMPLATE.render(n=n)
+        + CHAT_HISTORY_TEMPLATE.render(chat_history=chat_history)
+        + INIT_CHAIN_TEMPLATE.render(n=n)
+    )
+    question = QUESTION_TEMPLATE.render(query=query)
+    link_texts = ["\n".join(link_list) for link_list in link_list_list]
+    chains = [
+        CHAIN_TEMPLATE.render(index=i + 1, answer=answer, link_list=link_text)
+        for i, (answer, link_text) in enumerate(zip(answer_list, link_texts))
+    ]
+    leftover_links = [f"{link_text}\n" for link_text in link_texts]
+    tokens_numbers = count_tokens_many([head, question] + chains + leftover_links)
+    head_tokens, question_tokens = tokens_numbers[:2]
+    chains_tokens = tokens_numbers[2 : 2 + n]
+    leftover_links_tokens = tokens_numbers[2 + n :]
+
+    # The question is always part of the prompt, so it is counted from the start.
+    sections = [head]
+    tokens_number = head_tokens + question_tokens
+    packed_number = 0
+    for chain, chain_tokens in zip(chains, chains_tokens):
+        if tokens_number + chain_tokens > MAX_TOKENS:
             break
-        template += template_tmp
-    # After breaking from the loop, print the remaining links.
-    for j in range(i + 1, n):
-        link_list = "\n".join([item for item in link_list_list[j]])
-        template_tmp = f"{link_list}\n"
-        if get_tokens_number(template + template_tmp) > MAX_TOKENS:
+        sections.append(chain)
+        tokens_number += chain_tokens
+        packed_number += 1
+    # After breaking from the loop, add the links of the remaining chains.
+    for link_text, link_tokens in zip(
+        leftover_links[packed_number:], leftover_links_tokens[packed_number:]
+    ):
+        if tokens_number + link_tokens > MAX_TOKENS:
             break
-        template += template_tmp
-
-    template += """
-=========
-ANSWER THE QUESTION "{{query}}", FINAL A VERBOSE ANSWER, language used for answers is CONSISTENT with QUESTION:
-"""
+        sections.append(link_text)
+        tokens_number += link_tokens
+    sections.append(question)
 
-    prompt = Template(template).render(query=query, chat_history=chat_history)
-    return prompt
+    return "".join(sections), tokens_number
@@ -0,0 +1,107 @@
+import numpy as np
+from jinja2 import Template
+
+from src import count_tokens_many, get_tokens_number
+
+# The static sections of the synthesis prompt, compiled once.
+HEADER_TEMPLATE = Template(
+    """
+===== RULES =====
+Now I will provide you with numbered sources, each source contains a link and the context drawn from that link.
+The smaller the number of the source, the more relevant the information contained in the source.
+If a source is not related to the question, you should actively ignore it.
+Answer the question from these sources only (integration means avoiding repetition, writing logically, smooth writing, giving verbose answer), in 2-4 paragraphs appropriately.
+If the answer to the QUESTION is not within the sources, admit it instead of concocting an answer.
+The final answer is ALWAYS in Markdown format.
+Cite the sources you use with their number, such as [1], and ALWAYS end your answer with a "REFERENCE" part listing the link of every cited source.
+Strictly PROHIBITED to create or fabricate the links within REFERENCE, they can ONLY be the links of the sources.
+
+===== EXAMPLE =====
+Integrated text of source 1 [1] and source 2 [2]. Blablabla.
+REFERENCE:
+    [1] [title_link1](https://link1.com)
+    [2] [title_link2](https://link2.com)
+
+===== CHAT HISTORY =====
+{{chat_history}}
+
+""",
+    keep_trailing_newline=True,
+)
+SOURCE_TEMPLATE = Template(
+    """
+===== SOURCE [{{index}}] =====
+LINK: {{link}}
+CONTEXT:
+""",
+    keep_trailing_newline=True,
+)
+QUESTION_TEMPLATE = Template(
+    """
+=========
+ANSWER THE QUESTION "{{query}}", FINAL A VERBOSE ANSWER, language used for answers is CONSISTENT with QUESTION:
+""",
+    keep_trailing_newline=True,
+)
+
+
+# Synthesis prompt: answer from all the sources with a single call.
+def synthesis_prompt(chat_history, query, source_list, MAX_TOKENS=3000):
+    """
+    Pack the sources into one prompt, within the token budget.
+
+    Args:
+        chat_history (str): The chat history.
+        query (str): The user's query.
+        source_list (list): The (link, content list) of each source, the most relevant first.
+            When the budget is short, the last contents of each source are left out.
+        MAX_TOKENS (int): The maximum number of tokens of the prompt.
+
+    Returns:
+        prompt (str): The prompt.
+        link_list (list): The links of the sources packed into the prompt, numbered from 1.
+        tokens_number (int): The number of tokens of the prompt, as the sum of its pieces.
+    """
+    header = HEADER_TEMPLATE.render(chat_history=chat_history)
+    footer = QUESTION_TEMPLATE.render(query=query)
+
+    # Count the tokens of every piece once, the prompt being their concatenation.
+    source_list = [(link, content_list) for link, content_list in source_list if content_list]
+    source_headers = [
+        SOURCE_TEMPLATE.render(index=i + 1, link=link) for i, (link, _) in enumerate(source_list)
+    ]
+    # Every content is followed by a line break, counted with it.
+    contents = [content + "\n" for _, content_list in source_list for content in content_list]
+    tokens_numbers = iter(count_tokens_many(source_headers + contents))
+    source_headers_tokens = [next(tokens_numbers) for _ in source_headers]
+    contents_tokens = list(tokens_numbers)
+
+    # Share the budget between the sources: every round adds the next content of each source that still fits.
+    tokens_number = get_tokens_number(header) + get_tokens_number(footer)
+    content_starts = np.cumsum([0] + [len(content_list) for _, content_list in source_list])
+    kept_numbers = [0] * len(source_list)
+    open_sources = list(range(len(source_list)))
+    while open_sources:
+        for i in list(open_sources):
+            content_tokens_number = contents_tokens[content_starts[i] + kept_numbers[i]]
+            if kept_numbers[i] == 0:
+                content_tokens_number += source_headers_tokens[i]
+            if tokens_number + content_tokens_number > MAX_TOKENS:
+                open_sources.remove(i)
+                continue
+            tokens_number += content_tokens_number
+            kept_numbers[i] += 1
+            if kept_numbers[i] == len(source_list[i][1]):
+                open_sources.remove(i)
+
+    prompt = header
+    link_list = []
+    for i, ((link, _), kept_number) in enumerate(zip(source_list, kept_numbers)):
+        if not kept_number:
+            continue
+        link_list.append(link)
+        prompt += SOURCE_TEMPLATE.render(index=len(link_list), link=link)
+        prompt += "".join(contents[content_starts[i] : content_starts[i] + kept_number])
+
+    prompt += footer
+    return prompt, link_list, tokens_number
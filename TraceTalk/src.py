@@ -1,8 +1,230 @@
+import asyncio
+import functools
 import os
+import threading
+import uuid
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import tiktoken
 
+from embedding_cache import EmbeddingCache
+
+
+class EmbeddingService:
+    """
+    A class used to embed texts through one pooled OpenAI client.
+
+    Texts are looked up in the embedding cache first, and the remaining ones are
+    deduplicated and packed into multi-input requests, so embedding a whole
+    corpus costs a handful of round-trips instead of one per string.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        model_name="text-embedding-ada-002",
+        max_batch_tokens=100000,
+        max_batch_size=2048,
+        client=None,
+        cache=None,
+        async_client=None,
+        max_input_tokens=8191,
+    ):
+        """
+        Initializes an instance of the EmbeddingService class.
+
+        Args:
+            api_key (str): The OpenAI API key, defaults to the OPENAI_API_KEY environment variable.
+            model_name (str): The embedding model name.
+            max_batch_tokens (int): The maximum number of tokens sent in one request.
+            max_batch_size (int): The maximum number of inputs sent in one request.
+            client (OpenAI): An existing OpenAI client to reuse.
+            cache (EmbeddingCache): The cache consulted before any network call, or None.
+            async_client (AsyncOpenAI): An existing asynchronous OpenAI client to reuse.
+            max_input_tokens (int): The maximum number of tokens of one input, the longer inputs being truncated.
+        """
+        self.client = client or OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+        self.async_client = async_client or AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY")
+        )
+        self.model_name = model_name
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_input_tokens = max_input_tokens
+        self.cache = cache
+        self.requests_number = 0  # Count the number of embedding requests sent.
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        """
+        Get the embeddings of one text.
+
+        Args:
+            text (str): The text to get the embeddings of.
+
+        Returns:
+            embedding (list): The embeddings of the text.
+        """
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts):
+        """
+        Get the embeddings of many texts with as few requests as possible.
+
+        Args:
+            texts (list): The texts to get the embeddings of.
+
+        Returns:
+            embeddings (list): The embeddings of the texts, in the same order.
+        """
+        embeddings, missing_texts = self._lookup_cache(texts)
+        for batch, inputs in self._split_into_batches(missing_texts):
+            response = self.client.embeddings.create(input=inputs, model=self.model_name)
+            self._store_response(batch, response, embeddings)
+
+        return [embeddings[text] for text in texts]
+
+    async def aembed(self, text):
+        """
+        Get the embeddings of one text, without blocking the event loop.
+
+        Args:
+            text (str): The text to get the embeddings of.
+
+        Returns:
+            embedding (list): The embeddings of the text.
+        """
+        return (await self.aembed_many([text]))[0]
+
+    async def aembed_many(self, texts):
+        """
+        Get the embeddings of many texts, sending the batched requests concurrently.
+
+        Args:
+            texts (list): The texts to get the embeddings of.
+
+        Returns:
+            embeddings (list): The embeddings of the texts, in the same order.
+        """
+        # The cache reads and writes files, so they run in a thread instead of on the event loop.
+        embeddings, missing_texts = await asyncio.to_thread(self._lookup_cache, texts)
+        batches = list(self._split_into_batches(missing_texts))
+        responses = await asyncio.gather(
+            *(
+                self.async_client.embeddings.create(input=inputs, model=self.model_name)
+                for _, inputs in batches
+            )
+        )
+        for (batch, _), response in zip(batches, responses):
+            await asyncio.to_thread(self._store_response, batch, response, embeddings)
+
+        return [embeddings[text] for text in texts]
+
+    def _lookup_cache(self, texts):
+        """
+        Look the texts up in the cache.
+
+        Args:
+            texts (list): The texts to get the embeddings of.
+
+        Returns:
+            embeddings (dict): The embeddings found in the cache, by text.
+            missing_texts (list): The unique texts that still have to be embedded.
+        """
+        # Identical inputs are only sent once, even if they fall into different batches.
+        unique_texts = list(dict.fromkeys(texts))
+        embeddings = {}
+        if self.cache is not None:
+            for text in unique_texts:
+                embedding = self.cache.get(self.model_name, text)
+                if embedding is not None:
+                    embeddings[text] = embedding
+            unique_texts = [text for text in unique_texts if text not in embeddings]
+        return embeddings, unique_texts
+
+    def _store_response(self, batch, response, embeddings):
+        """
+        Store the embeddings of one response in the result and in the cache.
+
+        Args:
+            batch (list): The texts sent in the request.
+            response (CreateEmbeddingResponse): The response of the request.
+            embeddings (dict): The embeddings by text, updated in place.
+        """
+        with self._lock:
+            self.requests_number += 1
+        for item in response.data:
+            embeddings[batch[item.index]] = item.embedding
+            if self.cache is not None:
+                self.cache.put(self.model_name, batch[item.index], item.embedding)
+
+    def _split_into_batches(self, texts):
+        """
+        Split the texts into batches that fit the token and size budget of one request.
+
+        The tokens are counted with the encoding of the embedding model, and the texts
+        longer than the input limit of the model are truncated, so that a single long
+        text does not make the whole request fail.
+
+        Args:
+            texts (list): The texts to split.
+
+        Yields:
+            batch (list): A list of texts sent in one request.
+            inputs (list): The inputs sent for the texts, truncated to the input limit of the model.
+        """
+        encoding = get_encoding(model_name=self.model_name)
+        batch, inputs = [], []
+        batch_tokens = 0
+        for text, tokens in zip(texts, encoding.encode_ordinary_batch(texts, num_threads=8)):
+            if len(tokens) > self.max_input_tokens:
+                print(
+                    f"Truncating an input of {len(tokens)} tokens to the {self.max_input_tokens} "
+                    f"tokens accepted by {self.model_name}."
+                )
+                tokens = tokens[: self.max_input_tokens]
+                sent_text = encoding.decode(tokens)
+            else:
+                sent_text = text
+            if batch and (
+                batch_tokens + len(tokens) > self.max_batch_tokens
+                or len(batch) >= self.max_batch_size
+            ):
+                yield batch, inputs
+                batch, inputs = [], []
+                batch_tokens = 0
+            batch.append(text)
+            inputs.append(sent_text)
+            batch_tokens += len(tokens)
+        if batch:
+            yield batch, inputs
+
+
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+
+def get_embedding_service():
+    """
+    Get the embedding service shared by the whole process.
+
+    Returns:
+        embedding_service (EmbeddingService): The shared embedding service.
+    """
+    global _embedding_service
+    if _embedding_service is None:
+        with _embedding_service_lock:
+            if _embedding_service is None:
+                _embedding_service = EmbeddingService(
+                    cache=EmbeddingCache(
+                        cache_directory=os.getenv(
+                            "EMBEDDING_CACHE_DIRECTORY",
+                            r"vector-db-persist-directory/embedding cache",
+                        )
+                    )
+                )
+    return _embedding_service
+
 
 def get_emmbeddings(text):
     """
@@ -14,17 +236,48 @@ def get_emmbeddings(text):
     Returns:
         embedded_query (list): The embeddings of the text.
     """
-    client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
-    embedded_query = client.embeddings.create(
-        input=text,
-        model="text-embedding-ada-002",
-    ).data[0].embedding
+    embedded_query = get_embedding_service().embed(text)
 
     return embedded_query  # It is a vector of numbers.
 
 
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(encoding_type="cl100k_base", model_name="gpt-4o-mini"):
+    """
+    Get the tokenizer of the model, loading each encoding only once per process.
+
+    Args:
+        encoding_type (str): The encoding type, used when the model is unknown to tiktoken.
+        model_name (str): The model name.
+
+    Returns:
+        encoding (tiktoken.Encoding): The tokenizer.
+    """
+    key = (encoding_type, model_name)
+    encoding = _encodings.get(key)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(key)
+            if encoding is None:
+                try:
+                    encoding = tiktoken.encoding_for_model(model_name)
+                except KeyError:
+                    encoding = tiktoken.get_encoding(encoding_type)
+                _encodings[key] = encoding
+    return encoding
+
+
+@functools.lru_cache(maxsize=2048)
+def _count_tokens(text, encoding_type, model_name):
+    """
+    Count the tokens of the text, memoized for repeated strings such as the chat history.
+    """
+    return len(get_encoding(encoding_type, model_name).encode_ordinary(text))
+
+
 def get_tokens_number(text="", encoding_type="cl100k_base", model_name="gpt-4o-mini"):
     """
     Get the number of tokens in the text.
@@ -37,6 +290,40 @@ def get_tokens_number(text="", encoding_type="cl100k_base", model_name="gpt-4o-m
     Returns:
         tokens_number (int): The number of tokens in the text.
     """
-    encoding = tiktoken.get_encoding(encoding_type)
-    encoding = tiktoken.encoding_for_model(model_name)
-    return len(encoding.encode(text))
+    return _count_tokens(text, encoding_type, model_name)
+
+
+def count_tokens_many(
+    texts, encoding_type="cl100k_base", model_name="gpt-4o-mini", num_threads=8
+):
+    """
+    Get the number of tokens of many texts, encoded in parallel threads.
+
+    Args:
+        texts (list): The texts to get the number of tokens of.
+        encoding_type (str): The encoding type.
+        model_name (str): The model name.
+        num_threads (int): The number of threads used by tiktoken.
+
+    Returns:
+        tokens_numbers (list): The number of tokens of each text.
+    """
+    encoding = get_encoding(encoding_type, model_name)
+    return [
+        len(tokens)
+        for tokens in encoding.encode_ordinary_batch(texts, num_threads=num_threads)
+    ]
+
+
+def make_point_id(link, chunk_index):
+    """
+    Make the stable point ID of a chunk, so that re-ingesting a page always maps its chunks to the same points.
+
+    Args:
+        link (str): The link of the page the chunk comes from.
+        chunk_index (int): The position of the chunk in the page.
+
+    Returns:
+        point_id (str): The UUID of the point.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{link}#{chunk_index}"))
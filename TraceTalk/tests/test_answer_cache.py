@@ -0,0 +1,146 @@
+import asyncio
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+
+import main
+
+from answer_cache import AnswerCache, set_collection_version
+
+DIMENSION = 16
+
+
+def make_embedding(similarity, seed=0):
+    """
+    Make an embedding whose cosine similarity with the first axis is the given similarity.
+    """
+    orthogonal = np.random.default_rng(seed).standard_normal(DIMENSION)
+    orthogonal[0] = 0.0
+    orthogonal /= np.linalg.norm(orthogonal)
+    embedding = similarity * np.eye(DIMENSION)[0] + np.sqrt(1 - similarity**2) * orthogonal
+    return embedding.tolist()
+
+
+def test_paraphrase_hits_and_same_topic_question_misses():
+    answer_cache = AnswerCache()
+    answer_cache.store(make_embedding(1.0), "v1", "An answer.", [["https://example.com/page"]], 2.0)
+
+    cached_answer = answer_cache.lookup(make_embedding(0.99), "v1")
+    assert cached_answer.answer == "An answer."
+    assert cached_answer.link_list_list == [["https://example.com/page"]]
+    # A different question on the same topic.
+    assert answer_cache.lookup(make_embedding(0.95), "v1") is None
+    assert answer_cache.stats()["hits"] == 1
+    assert answer_cache.stats()["misses"] == 1
+
+
+def test_answers_of_another_collection_version_are_not_served():
+    answer_cache = AnswerCache()
+    answer_cache.store(make_embedding(1.0), "v1", "An answer.", [], 1.0)
+
+    assert answer_cache.lookup(make_embedding(1.0), "v2") is None
+
+
+def test_expired_and_evicted_entries_are_dropped():
+    answer_cache = AnswerCache(ttl=0.0, max_entries=2)
+    answer_cache.store(make_embedding(1.0), "v1", "An answer.", [], 1.0)
+    assert answer_cache.lookup(make_embedding(1.0), "v1") is None
+    assert answer_cache.stats()["expirations"] == 1
+
+    answer_cache = AnswerCache(max_entries=2)
+    for seed in range(3):
+        answer_cache.store(make_embedding(0.0, seed), "v1", f"Answer {seed}.", [], 1.0)
+    assert answer_cache.stats()["evictions"] == 1
+    assert answer_cache.lookup(make_embedding(0.0, 0), "v1") is None
+    assert answer_cache.lookup(make_embedding(0.0, 2), "v1").answer == "Answer 2."
+
+
+def test_a_new_collection_version_invalidates_the_cache(tmp_path):
+    client = QdrantClient(path=str(tmp_path))
+    set_collection_version(client, "Articles")
+    client.close()
+    answer_cache = AnswerCache(version_refresh_interval=0.0)
+
+    async def get_version():
+        async_client = AsyncQdrantClient(path=str(tmp_path))
+        try:
+            return await answer_cache.acollection_version(async_client, "Articles")
+        finally:
+            await async_client.close()
+
+    version = asyncio.run(get_version())
+    answer_cache.store(make_embedding(1.0), version, "An answer.", [], 1.0)
+    client = QdrantClient(path=str(tmp_path))
+    set_collection_version(client, "Articles")
+    client.close()
+
+    new_version = asyncio.run(get_version())
+    assert new_version != version
+    assert answer_cache.stats()["entries"] == 0
+
+
+class StubEmbeddingService:
+    async def aembed(self, text):
+        return make_embedding(1.0)
+
+
+class StubChatbotAgent:
+    embedding_service = StubEmbeddingService()
+
+    def __init__(self, error_message=None):
+        self.error_message = error_message
+
+    def convert_chat_history_to_string(self, new_query="", **kwargs):
+        return new_query
+
+    def build_synthesis_prompt(self, query, source_list):
+        if self.error_message:
+            return None, [], self.error_message
+        return "A prompt.", [link for link, _ in source_list], None
+
+    async def prompt_synthesis_stream(self, prompt, error_message=None):
+        yield error_message or "An answer from the model."
+
+
+class StubAgentPool:
+    def __init__(self, chatbot_agent):
+        self.chatbot_agent = chatbot_agent
+        self.answer_cache = AnswerCache()
+        self.async_qdrant_client = None
+        self.retriever = self
+        self.context_expander = self
+
+    def acquire(self, messages):
+        return self.chatbot_agent
+
+    async def search(self, query, top_k=10, embedded_query=None):
+        payload = {"link": "page.md", "content": "A chunk."}
+        return [models.ScoredPoint(id=1, version=0, score=0.9, payload=payload)]
+
+    async def expand_points(self, hits, collection_version=None):
+        return [hits]
+
+
+def answer(agent_pool):
+    async def collect():
+        events = main.amain_stream("A question?", agent_pool=agent_pool, synthesis_mode="single")
+        return [event async for event in events]
+
+    return asyncio.run(collect())
+
+
+def test_only_the_answers_of_the_model_are_cached(monkeypatch):
+    async def acollection_version(self, async_client, collection_name):
+        return "v1"
+
+    monkeypatch.setattr(AnswerCache, "acollection_version", acollection_version)
+
+    agent_pool = StubAgentPool(StubChatbotAgent(error_message="There is not enough information."))
+    answer(agent_pool)
+    assert agent_pool.answer_cache.stats()["entries"] == 0
+
+    agent_pool = StubAgentPool(StubChatbotAgent())
+    answer(agent_pool)
+    assert agent_pool.answer_cache.stats()["entries"] == 1
+    # The links are sent again with the cached answer.
+    assert answer(agent_pool)[-1] == {"event": "links", "data": "page.html"}
@@ -0,0 +1,57 @@
+from chat_history import SUMMARY_PREFIX, ChatHistory
+from src import get_tokens_number
+
+
+def add_turns(chat_history, turns_number):
+    for i in range(turns_number):
+        chat_history.append({"role": "user", "content": f"Question {i} about gradient descent and learning rates?"})
+        chat_history.append(
+            {
+                "role": "chatbot",
+                "content": f"Answer {i}. " + "The learning rate scales every step. " * 10
+                + "RESOURCE: https://example.com/page",
+            }
+        )
+
+
+def test_the_rendered_history_stays_within_the_budget():
+    chat_history = ChatHistory(max_tokens=300, max_turns=100)
+    add_turns(chat_history, 20)
+
+    for options in [{}, {"user_only": True}, {"remove_resource": True}]:
+        chat_string, tokens_number = chat_history.render(**options)
+        assert tokens_number <= 300
+        assert get_tokens_number(chat_string) <= 300
+
+
+def test_the_oldest_turns_are_compacted_into_a_summary():
+    chat_history = ChatHistory(max_tokens=300, max_turns=100)
+    add_turns(chat_history, 20)
+
+    chat_string, _ = chat_history.render()
+    assert chat_string.startswith(SUMMARY_PREFIX)
+    # The last turn is kept in full, the first one only survives in the summary.
+    assert "[user]: Question 19 about" in chat_string
+    assert "[user]: Question 0 about" not in chat_string
+    assert len(chat_history) < 40
+
+
+def test_the_cached_rendering_is_extended_in_place():
+    chat_history = ChatHistory(max_tokens=10000, max_turns=100)
+    add_turns(chat_history, 2)
+    chat_history.render(user_only=True)
+    chat_history.append({"role": "user", "content": "A new question?"})
+
+    chat_string, tokens_number = chat_history.render(user_only=True)
+    assert chat_string.endswith("[user]: A new question? \n")
+    assert "[chatbot]" not in chat_string
+    assert tokens_number == sum(get_tokens_number(line + "\n") for line in chat_string.split("\n")[:-1])
+
+
+def test_long_messages_are_truncated_and_the_turns_bounded():
+    chat_history = ChatHistory(max_tokens=200, max_turns=4)
+    chat_history.append({"role": "user", "content": "word " * 1000})
+    add_turns(chat_history, 3)
+
+    assert len(chat_history) <= 4
+    assert chat_history.render()[1] <= 200
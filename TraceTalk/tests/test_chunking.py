@@ -0,0 +1,41 @@
+import re
+
+import pytest
+
+from prep_data import CODE_FENCE, split_text_into_chunks
+
+
+def get_sentences(chunk):
+    return {sentence.strip() for sentence in re.split(r"(?<=[.?!])", chunk) if sentence.strip()}
+
+
+@pytest.mark.parametrize("chunk_max_tokens", [20, 30, 50, 80])
+def test_overlapping_chunks_share_sentences_and_add_new_ones(chunk_max_tokens):
+    text = "".join(f" Sentence number {i} has some words." for i in range(7))
+    chunks = split_text_into_chunks(text, chunk_max_tokens=chunk_max_tokens, overlap_tokens=20)
+
+    assert get_sentences(text) == set().union(*(get_sentences(chunk) for chunk in chunks))
+    for previous_chunk, chunk in zip(chunks, chunks[1:]):
+        assert get_sentences(previous_chunk) & get_sentences(chunk)
+        # No chunk only repeats the end of the previous one.
+        assert get_sentences(chunk) - get_sentences(previous_chunk)
+
+
+def test_chunks_without_overlap_do_not_repeat_sentences():
+    text = "".join(f" Sentence number {i} has some words." for i in range(12))
+    chunks = split_text_into_chunks(text, chunk_max_tokens=30)
+
+    sentences = [sentence for chunk in chunks for sentence in get_sentences(chunk)]
+    assert len(sentences) == len(set(sentences)) == 12
+
+
+def test_truncated_code_cell_is_closed():
+    code_lines = "\n".join(f"print('line {i}')" for i in range(200))
+    text = f"# Title\n\nSome prose before the code.\n\n```{{code-cell}} python\n{code_lines}\n```\n\nSome prose after."
+    chunks = split_text_into_chunks(text, chunk_max_tokens=50)
+
+    code_chunks = [chunk for chunk in chunks if "{code-cell}" in chunk]
+    assert code_chunks
+    assert "line 199" not in "".join(code_chunks)
+    for chunk in code_chunks:
+        assert chunk.count(CODE_FENCE) % 2 == 0
@@ -0,0 +1,49 @@
+import asyncio
+
+from qdrant_client import models
+
+from context_expansion import ContextExpander
+from src import make_point_id
+
+
+class StubAsyncQdrantClient:
+    def __init__(self, points):
+        self.points = {str(point.id): point for point in points}
+        self.count_calls = 0
+
+    async def count(self, collection_name, exact=True):
+        self.count_calls += 1
+        return models.CountResult(count=len(self.points))
+
+    async def retrieve(self, collection_name, ids, **kwargs):
+        return [self.points[str(id)] for id in ids if str(id) in self.points]
+
+
+def make_record(id, link, content, chunk_index=None):
+    payload = {"link": link, "content": content}
+    if chunk_index is not None:
+        payload["chunk_index"] = chunk_index
+    return models.Record(id=id, payload=payload)
+
+
+def test_neighbors_stop_at_the_page_boundaries():
+    points = [make_record(make_point_id("page-1", i), "page-1", f"1.{i}", i) for i in range(3)]
+    points.append(make_record(make_point_id("page-2", 0), "page-2", "2.0", 0))
+    expander = ContextExpander(StubAsyncQdrantClient(points), window=1)
+
+    contexts = asyncio.run(expander.expand([points[2], points[3], points[1]]))
+
+    assert contexts == ["1.1\n1.2", "2.0", "1.0\n1.1\n1.2"]
+
+
+def test_the_collection_size_is_counted_again_for_a_new_version():
+    points = [make_record(id, "page", f"chunk {id}") for id in range(1, 4)]
+    client = StubAsyncQdrantClient(points)
+    expander = ContextExpander(client, window=1)
+
+    assert asyncio.run(expander.expand([points[2]], "v1")) == ["chunk 2\nchunk 3"]
+    # An ingest appends a point and gives a new version to the collection.
+    client.points["4"] = make_record(4, "page", "chunk 4")
+    assert asyncio.run(expander.expand([points[2]], "v1")) == ["chunk 2\nchunk 3"]
+    assert asyncio.run(expander.expand([points[2]], "v2")) == ["chunk 2\nchunk 3\nchunk 4"]
+    assert client.count_calls == 2
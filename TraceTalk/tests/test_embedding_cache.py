@@ -0,0 +1,55 @@
+import asyncio
+import os
+import time
+import types
+
+from embedding_cache import EmbeddingCache
+from src import EmbeddingService
+
+
+def test_embeddings_are_read_back_from_disk(tmp_path):
+    EmbeddingCache(str(tmp_path)).put("model", "text", [0.5, 0.25])
+    cache = EmbeddingCache(str(tmp_path))
+
+    assert cache.get("model", "text") == [0.5, 0.25]
+    assert cache.get("model", "other text") is None
+    assert cache.get("model", "text") == [0.5, 0.25]
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_the_least_recently_used_disk_entries_are_evicted(tmp_path):
+    # Every entry takes 16 bytes, the limit keeps 3 of them.
+    cache = EmbeddingCache(str(tmp_path), max_memory_bytes=0, max_disk_bytes=56)
+    for i in range(3):
+        cache.put("model", f"text {i}", [float(i)] * 4)
+        path = cache._entry_path(cache.make_key("model", f"text {i}"))
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    # Reading the oldest entry makes it recently used.
+    assert cache.get("model", "text 0") is not None
+    cache.put("model", "text 3", [3.0] * 4)
+
+    cache = EmbeddingCache(str(tmp_path), max_memory_bytes=0)
+    assert cache.get("model", "text 0") is not None
+    assert cache.get("model", "text 1") is None
+    assert cache.get("model", "text 3") is not None
+
+
+def test_cached_texts_are_not_embedded_again(tmp_path):
+    requests = []
+
+    async def create(input, model):
+        requests.append(list(input))
+        return types.SimpleNamespace(
+            data=[types.SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        )
+
+    async_client = types.SimpleNamespace(embeddings=types.SimpleNamespace(create=create))
+    embedding_service = EmbeddingService(
+        client=types.SimpleNamespace(), async_client=async_client, cache=EmbeddingCache(str(tmp_path))
+    )
+
+    assert asyncio.run(embedding_service.aembed_many(["a", "bb", "a"])) == [[1.0], [2.0], [1.0]]
+    assert asyncio.run(embedding_service.aembed_many(["bb", "ccc"])) == [[2.0], [3.0]]
+    assert requests == [["a", "bb"], ["ccc"]]
@@ -0,0 +1,57 @@
+import types
+
+from src import EmbeddingService, get_encoding
+
+MAX_INPUT_TOKENS = 50
+
+
+class StubEmbeddings:
+    """
+    A stand-in for the embedding endpoint, rejecting the requests with an input over the limit.
+    """
+
+    def __init__(self):
+        self.inputs = []
+
+    def create(self, input, model):
+        encoding = get_encoding(model_name=model)
+        if any(len(encoding.encode_ordinary(text)) > MAX_INPUT_TOKENS for text in input):
+            raise ValueError("An input is longer than the context length of the model.")
+        self.inputs.append(list(input))
+        return types.SimpleNamespace(
+            data=[
+                types.SimpleNamespace(index=i, embedding=[float(len(text))])
+                for i, text in enumerate(input)
+            ]
+        )
+
+
+def test_a_long_input_is_truncated_instead_of_failing_its_batch():
+    embeddings = StubEmbeddings()
+    stub = types.SimpleNamespace(embeddings=embeddings)
+    embedding_service = EmbeddingService(client=stub, async_client=stub, max_input_tokens=MAX_INPUT_TOKENS)
+    texts = ["A short text.", "A long text. " * 100, "Another short text."]
+
+    vectors = embedding_service.embed_many(texts)
+
+    assert len(embeddings.inputs) == 1
+    sent_texts = embeddings.inputs[0]
+    assert sent_texts[0::2] == texts[0::2]
+    assert texts[1].startswith(sent_texts[1]) and sent_texts[1] != texts[1]
+    # The embedding of the truncated input is returned for the original text.
+    assert vectors[1] == [float(len(sent_texts[1]))]
+
+
+def test_the_batches_are_split_with_the_tokens_of_the_embedding_model():
+    embeddings = StubEmbeddings()
+    stub = types.SimpleNamespace(embeddings=embeddings)
+    embedding_service = EmbeddingService(client=stub, async_client=stub, max_batch_tokens=30)
+    texts = [f"Text number {i} of the batch." for i in range(6)]
+    encoding = get_encoding(model_name="text-embedding-ada-002")
+    tokens_numbers = [len(encoding.encode_ordinary(text)) for text in texts]
+
+    embedding_service.embed_many(texts)
+
+    for batch in embeddings.inputs:
+        assert sum(tokens_numbers[texts.index(text)] for text in batch) <= 30
+    assert sum(embeddings.inputs, []) == texts
@@ -0,0 +1,64 @@
+import os
+import types
+
+from fetcher import MarkdownFetcher
+
+LINK = "https://example.com/page.md"
+
+
+class StubSession:
+    """
+    A stand-in for a requests session serving one page with an ETag.
+    """
+
+    def __init__(self, on_conditional_request=None):
+        self.on_conditional_request = on_conditional_request
+        self.requests_headers = []
+
+    def get(self, link, headers=None, timeout=None):
+        self.requests_headers.append(dict(headers or {}))
+        if headers and headers.get("If-None-Match") == '"v1"':
+            if self.on_conditional_request:
+                self.on_conditional_request()
+            return types.SimpleNamespace(status_code=304, headers={}, text="")
+        return types.SimpleNamespace(status_code=200, headers={"ETag": '"v1"'}, text="# Page")
+
+
+def make_fetcher(cache_directory, session):
+    fetcher = MarkdownFetcher(cache_directory=str(cache_directory))
+    fetcher.session = session
+    return fetcher
+
+
+def test_unchanged_pages_are_read_from_the_cache(tmp_path):
+    make_fetcher(tmp_path, StubSession()).fetch_many([LINK])
+    fetcher = make_fetcher(tmp_path, StubSession())
+
+    assert fetcher.fetch_many([LINK]) == ["# Page"]
+    assert fetcher.stats["not_modified"] == 1
+
+
+def test_a_removed_cached_page_is_downloaded_again(tmp_path):
+    make_fetcher(tmp_path, StubSession()).fetch_many([LINK])
+    fetcher = make_fetcher(tmp_path, None)
+    # The cached page disappears while the conditional request is in flight.
+    fetcher.session = StubSession(lambda: os.remove(fetcher._body_path(LINK)))
+
+    assert fetcher.fetch_many([LINK]) == ["# Page"]
+    assert fetcher.stats["downloaded"] == 1
+    assert fetcher.session.requests_headers[-1] == {}
+
+
+def test_a_page_downloaded_without_validators_is_not_served_from_the_cache(tmp_path):
+    fetcher = make_fetcher(tmp_path, StubSession())
+    fetcher.fetch_many([LINK])
+    # The page changed, and the server stopped sending its ETag.
+    fetcher.session.get = lambda link, headers=None, timeout=None: types.SimpleNamespace(
+        status_code=200, headers={}, text="# New page"
+    )
+    assert fetcher.fetch_many([LINK]) == ["# New page"]
+
+    fetcher.session = StubSession()
+    assert fetcher.fetch_many([LINK]) == ["# Page"]
+    assert fetcher.session.requests_headers == [{}]
+    assert fetcher.stats["downloaded"] == 1
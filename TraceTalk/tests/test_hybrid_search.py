@@ -0,0 +1,114 @@
+import asyncio
+
+import pandas as pd
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+
+from hybrid_search import BM25Index, HybridRetriever, build_bm25_index, reciprocal_rank_fusion
+
+
+def test_reciprocal_rank_fusion_favors_points_ranked_well_everywhere():
+    fused_ranking = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "a"], ["b", "d"]], k=60)
+
+    assert [id for id, _ in fused_ranking] == ["b", "a", "c", "d"]
+    assert fused_ranking[0][1] == pytest.approx(2 / 61 + 1 / 62)
+
+
+def test_bm25_index_ranks_exact_terms_first(tmp_path):
+    metadata = pd.DataFrame(
+        {
+            "id": ["a", "b", "c"],
+            "title": ["Model selection", "Linear models", "Trees"],
+            "content": [
+                "Use GridSearchCV to tune the hyperparameters.",
+                "A linear model fits a line.",
+                "A decision tree splits the data.",
+            ],
+        }
+    )
+    build_bm25_index(metadata, str(tmp_path))
+
+    assert BM25Index(str(tmp_path)).search("gridsearchcv", 3)[0][0] == "a"
+
+
+class StubAsyncQdrantClient:
+    def __init__(self, title_results, content_results):
+        self.results = {"title": title_results, "content": content_results}
+
+    async def search_batch(self, collection_name, requests):
+        return [self.results[request.vector.name] for request in requests]
+
+    async def retrieve(self, collection_name, ids, **kwargs):
+        return [models.Record(id=id, payload={"link": "page"}, vector={"content": [1.0, 0.0]}) for id in ids]
+
+
+def make_point(id, link, score):
+    return models.ScoredPoint(id=id, version=0, score=score, payload={"link": link})
+
+
+def test_the_chunks_of_a_page_share_one_title_boost():
+    # Every chunk of page 1 has the title vector of the page, so they tie in the title ranking.
+    title_results = [make_point(f"page-1-{i}", "page-1", 0.9) for i in range(4)] + [
+        make_point("page-2-0", "page-2", 0.8)
+    ]
+    content_results = [
+        make_point("page-2-0", "page-2", 0.85),
+        make_point("page-1-2", "page-1", 0.84),
+        make_point("page-1-0", "page-1", 0.7),
+    ]
+    retriever = HybridRetriever(StubAsyncQdrantClient(title_results, content_results), None)
+
+    query_results = asyncio.run(retriever.search("question", top_k=4, embedded_query=[1.0, 0.0]))
+
+    # The best chunk of page 1 by content gets the title boost, not the first ones of the tie.
+    ids = [str(point.id) for point in query_results]
+    assert set(ids[:2]) == {"page-1-2", "page-2-0"}
+    assert ids[2:] == ["page-1-0"]
+
+
+def test_the_points_of_a_collection_with_integer_ids_are_retrieved(tmp_path):
+    metadata = pd.DataFrame(
+        {
+            "id": [1, 2, 3],
+            "title": ["Model selection", "Linear models", "Trees"],
+            "content": [
+                "Use GridSearchCV to tune the hyperparameters.",
+                "A linear model fits a line.",
+                "A decision tree splits the data.",
+            ],
+            "link": ["page-1", "page-2", "page-3"],
+        }
+    )
+    build_bm25_index(metadata, str(tmp_path))
+    vectors = {1: [0.0, 1.0], 2: [1.0, 0.0], 3: [0.7, 0.7]}
+
+    async def search():
+        client = AsyncQdrantClient(":memory:")
+        await client.create_collection(
+            "Articles",
+            vectors_config={
+                name: models.VectorParams(size=2, distance=models.Distance.COSINE)
+                for name in ("title", "content")
+            },
+        )
+        await client.upsert(
+            "Articles",
+            points=[
+                models.PointStruct(
+                    id=row.id,
+                    vector={"title": vectors[row.id], "content": vectors[row.id]},
+                    payload={"link": row.link, "content": row.content},
+                )
+                for row in metadata.itertuples()
+            ],
+        )
+        # Only the BM25 ranking finds the first point.
+        retriever = HybridRetriever(client, None, BM25Index(str(tmp_path)), candidates_number=1)
+        return await retriever.search("gridsearchcv", top_k=3, embedded_query=[1.0, 0.0])
+
+    query_results = asyncio.run(search())
+
+    points = {point.id: point for point in query_results}
+    assert sorted(points) == [1, 2]
+    assert points[1].payload["link"] == "page-1"
+    assert points[1].score == pytest.approx(0.0, abs=1e-6)
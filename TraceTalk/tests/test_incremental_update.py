@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+from qdrant_client import QdrantClient, models
+
+import prep_data
+from dataset_store import save_book_dataset
+from src import make_point_id
+
+VECTOR_SIZE = 4
+
+
+def make_chunks(link, contents):
+    return [
+        {
+            "id": make_point_id(link, chunk_index),
+            "title": "Page",
+            "content": content,
+            "link": link,
+            "chunk_index": chunk_index,
+            "page_hash": "page",
+            "chunk_hash": prep_data.get_content_hash(content),
+        }
+        for chunk_index, content in enumerate(contents)
+    ]
+
+
+def save_dataset(dataset_directory, chunks):
+    vectors = np.ones((len(chunks), VECTOR_SIZE), dtype=np.float32)
+    save_book_dataset(str(dataset_directory), pd.DataFrame(chunks), vectors, vectors)
+
+
+def get_point_ids(client):
+    records, _ = client.scroll("Articles", limit=100, with_payload=False, with_vectors=False)
+    return sorted(str(record.id) for record in records)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = QdrantClient(":memory:")
+    monkeypatch.setenv("QDRANT_URL", "http://localhost:6333")
+    monkeypatch.setenv("QDRANT_API_KEY", "key")
+    monkeypatch.setattr(prep_data, "QdrantClient", lambda **kwargs: client)
+    return client
+
+
+def test_incremental_update_replaces_legacy_integer_ids(client, tmp_path):
+    # A collection built before the chunk hashes, with integer IDs and no chunk_hash payload.
+    client.create_collection("Articles", vectors_config=prep_data.get_vectors_config(VECTOR_SIZE))
+    client.upsert(
+        "Articles",
+        [
+            models.PointStruct(
+                id=id,
+                vector={"title": [1.0] * VECTOR_SIZE, "content": [1.0] * VECTOR_SIZE},
+                payload={"title": "Page", "content": f"Old chunk {id}"},
+            )
+            for id in range(5)
+        ],
+    )
+    chunks = make_chunks("https://example.com/page", ["First chunk.", "Second chunk."])
+    save_dataset(tmp_path, chunks)
+
+    prep_data.update_collection_to_database(str(tmp_path), incremental=True)
+
+    assert get_point_ids(client) == sorted(chunk["id"] for chunk in chunks)
+
+
+def test_incremental_update_upserts_changed_and_deletes_removed_chunks(client, tmp_path):
+    link = "https://example.com/page"
+    save_dataset(tmp_path, make_chunks(link, ["First chunk.", "Second chunk.", "Third chunk."]))
+    prep_data.update_collection_to_database(str(tmp_path), incremental=True)
+
+    chunks = make_chunks(link, ["First chunk.", "Second chunk, changed."])
+    save_dataset(tmp_path, chunks)
+    upserted_ids = []
+    upsert = client.upsert
+
+    def recording_upsert(collection_name, points, **kwargs):
+        if collection_name == "Articles":
+            upserted_ids.extend(points.ids if hasattr(points, "ids") else [point.id for point in points])
+        return upsert(collection_name, points, **kwargs)
+
+    client.upsert = recording_upsert
+    prep_data.update_collection_to_database(str(tmp_path), incremental=True)
+
+    assert get_point_ids(client) == sorted(chunk["id"] for chunk in chunks)
+    assert upserted_ids == [chunks[1]["id"]]
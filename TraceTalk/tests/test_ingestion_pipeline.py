@@ -0,0 +1,74 @@
+import contextlib
+import io
+import os
+import types
+
+from qdrant_client import QdrantClient
+
+from hybrid_search import BM25Index
+from ingestion_pipeline import IngestionPipeline, IngestionSource
+from src import EmbeddingService
+
+VECTOR_SIZE = 3
+
+
+class StubEmbeddings:
+    def create(self, input, model):
+        return types.SimpleNamespace(
+            data=[
+                types.SimpleNamespace(index=i, embedding=[float(len(text)), 1.0, 0.0])
+                for i, text in enumerate(input)
+            ]
+        )
+
+
+def write_page(book_directory, name, sentences_number):
+    with open(os.path.join(book_directory, f"{name}.md"), "w") as f:
+        f.write(f"# {name}\n\n" + "".join(f"Sentence {i} about {name}. " for i in range(sentences_number)))
+
+
+def run(client, source, bm25_directory):
+    stub = types.SimpleNamespace(embeddings=StubEmbeddings())
+    pipeline = IngestionPipeline(
+        client=client,
+        embedding_service=EmbeddingService(client=stub, async_client=stub),
+        chunk_workers=1,
+        embed_batch_size=8,
+        vector_size=VECTOR_SIZE,
+        bm25_directory=str(bm25_directory),
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        return pipeline.run([source])
+
+
+def test_the_chunks_of_shrunk_and_removed_pages_are_deleted(tmp_path):
+    book_directory = tmp_path / "book"
+    book_directory.mkdir()
+    write_page(book_directory, "linear-models", 400)
+    write_page(book_directory, "trees", 200)
+    write_page(book_directory, "gridsearchcv", 100)
+    source = IngestionSource(
+        name="book",
+        collection_name="Book",
+        markdown_directory=str(book_directory),
+        base_url="https://example.com/book",
+    )
+    client = QdrantClient(":memory:")
+    run(client, source, tmp_path / "bm25")
+    assert BM25Index(str(tmp_path / "bm25" / "Book")).search("gridsearchcv", 1)
+
+    # One page shrinks and another one disappears.
+    write_page(book_directory, "linear-models", 20)
+    os.remove(book_directory / "gridsearchcv.md")
+    stats = run(client, source, tmp_path / "bm25")
+
+    records, _ = client.scroll("Book", with_payload=["link"], limit=1000)
+    assert len(records) == stats["book"]["points"]
+    assert {record.payload["link"] for record in records} == {
+        "https://example.com/book/linear-models.md",
+        "https://example.com/book/trees.md",
+    }
+    # The BM25 index is rebuilt from the points left.
+    bm25_index = BM25Index(str(tmp_path / "bm25" / "Book"))
+    assert len(bm25_index.ids) == len(records)
+    assert bm25_index.search("gridsearchcv", 1) == []
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from utils.json_tokenizer import JSONTokenizer
+
+DOCUMENTS = [
+    '{"name": "Ada", "age": 36, "tags": ["math", "code"], "ok": true, "spouse": null}',
+    '[1, -2.5e+3, 0, 0.25, {"a": []}, "\\u00e9\\n\\"quoted\\""]',
+    '"just a string"',
+    "0",
+    '  {"nested": {"deep": [[], [{}]]}}  ',
+]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+@pytest.mark.parametrize("fragment_size", [1, 3, 1000])
+def test_valid_documents_are_accepted_in_any_fragments(document, fragment_size):
+    json.loads(document)
+    json_tokenizer = JSONTokenizer()
+    for start in range(0, len(document), fragment_size):
+        fragment = document[start : start + fragment_size]
+        assert json_tokenizer.feed(fragment) == len(fragment)
+    assert json_tokenizer.is_complete()
+
+
+@pytest.mark.parametrize(
+    "text, accepted_number",
+    [
+        ('{"a": 1,}', 8),
+        ("[1 2]", 3),
+        ('{"a" 1}', 5),
+        ("tru e", 3),
+        ("01", 1),
+        ('{"a": 1} x', 9),
+        ('["// comment"] // comment', 15),
+    ],
+)
+def test_invalid_text_is_rejected_at_its_first_wrong_character(text, accepted_number):
+    assert JSONTokenizer().feed(text) == accepted_number
+
+
+def test_incomplete_documents_are_not_complete():
+    json_tokenizer = JSONTokenizer()
+    json_tokenizer.feed('{"a": [1, 2')
+    assert not json_tokenizer.is_complete()
+    assert json_tokenizer.stack == ["}", "]"]
+
+
+def test_the_schema_is_checked_while_the_value_is_generated():
+    schema = {"name": "string", "age": "integer", "tags": ["string"]}
+
+    assert JSONTokenizer(schema).feed('{"name": "Ada", "age": 36, "tags": ["a"]}') == 41
+    # A missing required property.
+    assert JSONTokenizer(schema).feed('{"name": "Ada"}') == 14
+    # A wrong type and a fraction for an integer.
+    assert JSONTokenizer(schema).feed('{"name": 1') == 9
+    assert JSONTokenizer(schema).feed('{"age": 3.5') == 9
+    # A property that is not in the schema.
+    assert JSONTokenizer(schema).feed('{"other"') == 2
+
+
+def test_allowed_characters_follow_the_schema():
+    json_tokenizer = JSONTokenizer(
+        {"type": "object", "properties": {"name": {"type": "string"}}, "additionalProperties": False}
+    )
+    json_tokenizer.feed('{"')
+    assert json_tokenizer.allowed_characters() == frozenset("n")
+    json_tokenizer.feed('name": ')
+    assert '"' in json_tokenizer.allowed_characters()
+    assert "1" not in json_tokenizer.allowed_characters()
+
+
+def test_every_next_character_of_a_valid_document_is_allowed():
+    document = DOCUMENTS[0]
+    json_tokenizer = JSONTokenizer()
+    for char in document:
+        assert char in json_tokenizer.allowed_characters() or not char.isascii()
+        assert json_tokenizer.feed(char) == 1
+
+
+def test_a_snapshot_restores_the_state():
+    json_tokenizer = JSONTokenizer()
+    json_tokenizer.feed('{"a": [1, ')
+    snapshot = json_tokenizer.snapshot()
+
+    assert not json_tokenizer.is_valid("}")
+    assert json_tokenizer.is_valid('2]}')
+    assert json_tokenizer.is_complete()
+    json_tokenizer.restore(snapshot)
+    assert json_tokenizer.feed('"b"]}') == 5
+    assert json_tokenizer.is_complete()
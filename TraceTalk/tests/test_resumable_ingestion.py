@@ -0,0 +1,140 @@
+import contextlib
+import io
+import os
+import types
+
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+
+import prep_data
+from dataset_store import CHECKPOINT_FILE, BookDatasetWriter, load_book_dataset
+from src import EmbeddingService
+
+PAGES_NUMBER = 12
+
+
+class StubEmbeddings:
+    """
+    Embed a text into a small vector derived from it, failing after a given number of requests.
+    """
+
+    def __init__(self):
+        self.requests_number = 0
+        self.fail_after = None
+
+    def create(self, input, model):
+        self.requests_number += 1
+        if self.fail_after is not None and self.requests_number > self.fail_after:
+            raise RuntimeError("The embedding service is down.")
+        return types.SimpleNamespace(
+            data=[
+                types.SimpleNamespace(index=i, embedding=[float(len(text)), float(sum(map(ord, text)) % 97), 1.0])
+                for i, text in enumerate(input)
+            ]
+        )
+
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    # The fetcher keeps its cache under the working directory.
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("resources")
+    os.makedirs(os.path.join("book", "ml"))
+    links = []
+    for page in range(PAGES_NUMBER):
+        links.append(
+            "'https://github.com/open-academy/machine-learning/tree/main/"
+            f"open-machine-learning-jupyter-book/ml/page-{page}.md',"
+        )
+        with open(os.path.join("book", "ml", f"page-{page}.md"), "w") as f:
+            f.write(f"# Page {page}\n\n" + "".join(f"Sentence {i} of page {page}. " for i in range(100 + 20 * page)))
+    with open(os.path.join("resources", "resources.txt"), "w") as f:
+        f.write("\n".join(links))
+
+    embeddings = StubEmbeddings()
+    stub = types.SimpleNamespace(embeddings=embeddings)
+    monkeypatch.setattr(
+        prep_data, "get_embedding_service", lambda: EmbeddingService(client=stub, async_client=stub)
+    )
+    return embeddings
+
+
+def prep(dataset_directory, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        prep_data.prep_book_data(
+            dataset_directory, local_directory="book", input_directory="resources", window_size=8, **kwargs
+        )
+
+
+def test_a_resumed_writer_starts_after_the_last_checkpoint(tmp_path):
+    records = [{"id": str(i), "content": f"Chunk {i}"} for i in range(6)]
+    vectors = np.arange(18, dtype=np.float32).reshape(6, 3)
+
+    writer = BookDatasetWriter(str(tmp_path))
+    writer.append(records[:4], vectors[:4], vectors[:4])
+    writer.checkpoint(rows_number=3, done_keys=["page-1"])
+    # The fourth row is not checkpointed, so it is written again after the crash.
+    for file in writer._files.values():
+        file.close()
+
+    writer = BookDatasetWriter(str(tmp_path))
+    assert (writer.count, writer.done_keys) == (3, {"page-1"})
+    writer.append(records[3:], vectors[3:], vectors[3:])
+    writer.close()
+
+    book_dataset = load_book_dataset(str(tmp_path), mmap=False)
+    assert book_dataset.metadata["id"].tolist() == [record["id"] for record in records]
+    assert np.array_equal(book_dataset.content_vectors, vectors)
+    assert not os.path.exists(tmp_path / CHECKPOINT_FILE)
+
+
+def test_a_crashed_preparation_resumes_to_the_same_book_data(book):
+    prep("clean")
+    requests_number = book.requests_number
+
+    book.requests_number, book.fail_after = 0, 4
+    with pytest.raises(RuntimeError):
+        prep("crashed")
+    assert os.path.exists(os.path.join("crashed" + prep_data.PARTIAL_DIRECTORY_SUFFIX, CHECKPOINT_FILE))
+    book.requests_number, book.fail_after = 0, None
+    prep("crashed")
+
+    clean, crashed = load_book_dataset("clean", mmap=False), load_book_dataset("crashed", mmap=False)
+    assert crashed.metadata.equals(clean.metadata)
+    assert np.array_equal(crashed.title_vectors, clean.title_vectors)
+    assert np.array_equal(crashed.content_vectors, clean.content_vectors)
+    # The pages of the checkpoint are not embedded again.
+    assert book.requests_number < requests_number
+    assert not os.path.exists("crashed" + prep_data.PARTIAL_DIRECTORY_SUFFIX)
+
+
+def test_a_crashed_upsert_resumes_after_the_upserted_rows(book, monkeypatch):
+    prep("book data")
+    client = QdrantClient(":memory:")
+    monkeypatch.setenv("QDRANT_URL", "http://localhost:6333")
+    monkeypatch.setenv("QDRANT_API_KEY", "key")
+    monkeypatch.setattr(prep_data, "QdrantClient", lambda **kwargs: client)
+
+    upsert_book_dataset = prep_data.upsert_book_dataset
+    upserted_rows = []
+
+    def failing_upsert(client, collection_name, metadata, vectors, **kwargs):
+        if len(upserted_rows) == 2:
+            raise RuntimeError("The Qdrant server is down.")
+        upserted_rows.append(len(metadata))
+        return upsert_book_dataset(client, collection_name, metadata, vectors, **kwargs)
+
+    monkeypatch.setattr(prep_data, "upsert_book_dataset", failing_upsert)
+    with pytest.raises(RuntimeError), contextlib.redirect_stdout(io.StringIO()):
+        prep_data.update_collection_to_database("book data", window_size=16)
+    assert client.count("Articles").count == sum(upserted_rows) == 32
+
+    monkeypatch.setattr(prep_data, "upsert_book_dataset", upsert_book_dataset)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        prep_data.update_collection_to_database("book data", window_size=16)
+
+    assert "Resuming after 32 upserted chunks." in output.getvalue()
+    assert client.count("Articles").count == len(load_book_dataset("book data").metadata)
+    assert not os.path.exists(os.path.join("book data", prep_data.UPSERT_CHECKPOINT_FILE))
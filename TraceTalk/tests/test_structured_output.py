@@ -0,0 +1,60 @@
+import types
+
+import pytest
+
+from utils.json_tokenizer import JSONTokenizer
+from utils.structured_output import CONTINUE_PROMPT, generate_json, stream_valid_prefix
+
+SCHEMA = {"name": "string", "age": "number"}
+
+
+class StubClient:
+    """
+    A stand-in for an OpenAI client streaming one prepared answer per call.
+    """
+
+    def __init__(self, answers):
+        self.answers = iter(answers)
+        self.messages = []
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, model, messages, stream=False, **kwargs):
+        self.messages.append(messages)
+        return iter(
+            types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=chunk))])
+            for chunk in next(self.answers)
+        )
+
+
+def test_the_valid_prefix_stops_at_the_first_invalid_chunk():
+    chunks = ["```json\n", '{"name": "Ada",', " // a comment", ' "age": 36}']
+
+    text, valid = stream_valid_prefix(chunks, JSONTokenizer(SCHEMA), skip_preamble=True)
+
+    assert (text, valid) == ('{"name": "Ada", ', False)
+
+
+def test_an_invalid_answer_is_continued_from_its_valid_prefix():
+    client = StubClient(
+        [
+            ["```json\n", '{"name": ', '"Ada", ', "// the name\n", '"age": 36}'],
+            ['"age": 36}', "\n```"],
+        ]
+    )
+
+    value, stats = generate_json(client, "Describe a person.", schema=SCHEMA)
+
+    assert value == {"name": "Ada", "age": 36}
+    assert stats["calls_number"] == 2
+    # The second call continues the valid prefix instead of generating it again.
+    assert client.messages[1][-2:] == [
+        {"role": "assistant", "content": '{"name": "Ada", '},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+
+
+def test_an_answer_breaking_the_schema_is_rejected():
+    client = StubClient([['{"name": 36}']] * 2)
+
+    with pytest.raises(ValueError):
+        generate_json(client, "Describe a person.", schema=SCHEMA, max_attempts=2)
@@ -0,0 +1,41 @@
+from chatbot_agent import ChatbotAgent
+from prompts.synthesis_prompt import synthesis_prompt
+from src import get_tokens_number
+
+
+def test_only_the_packed_sources_are_linked():
+    source_list = [
+        (f"https://example.com/page-{i}", [f"Content {j} of page {i}. " * 20 for j in range(3)])
+        for i in range(10)
+    ]
+    prompt, link_list, tokens_number = synthesis_prompt("", "What is a model?", source_list, MAX_TOKENS=1000)
+
+    assert 0 < len(link_list) < len(source_list)
+    assert tokens_number <= 1000
+    for link, _ in source_list:
+        assert (link in link_list) == (f"LINK: {link}\n" in prompt)
+    for number, link in enumerate(link_list, start=1):
+        assert f"===== SOURCE [{number}] =====\nLINK: {link}\n" in prompt
+
+
+def test_the_line_breaks_between_the_contents_are_counted():
+    source_list = [(f"https://example.com/page-{i}", [f"content{j}" for j in range(200)]) for i in range(5)]
+    prompt, _, tokens_number = synthesis_prompt("", "What is a model?", source_list, MAX_TOKENS=600)
+
+    assert get_tokens_number(prompt) <= tokens_number <= 600
+
+
+def test_no_model_call_when_no_source_fits_the_budget():
+    chatbot_agent = ChatbotAgent(
+        client=object(),
+        qdrant_client=object(),
+        embedding_service=object(),
+        async_client=object(),
+        async_qdrant_client=object(),
+    )
+    source_list = [("https://example.com/page", ["A very long section. " * 2000])]
+
+    prompt, link_list, error_message = chatbot_agent.build_synthesis_prompt("What is a model?", source_list)
+
+    assert (prompt, link_list) == (None, [])
+    assert "not enough information" in error_message
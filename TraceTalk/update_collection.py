@@ -1,6 +1,6 @@
 from prep_data import update_collection_to_database
 
 if __name__ == "__main__":
-    scv_file_path = r"vector-db-persist-directory/book dada/book data.csv"
-    # prep_book_data(scv_file_path)
-    update_collection_to_database(scv_file_path)
+    dataset_directory = r"vector-db-persist-directory/book data"
+    # prep_book_data(dataset_directory, incremental=True)
+    update_collection_to_database(dataset_directory, incremental=True)
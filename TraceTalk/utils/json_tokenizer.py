@@ -1,43 +1,508 @@
+import re
+import string
+
+# The states of the tokenizer: what the next character must be.
+VALUE, ARRAY_FIRST, OBJECT_FIRST, OBJECT_KEY, COLON, AFTER_VALUE, DONE = range(7)
+STRING, STRING_ESCAPE, LITERAL = 7, 8, 9
+# The states of a \uXXXX escape are UNICODE + the number of hexadecimal digits left.
+UNICODE = 10
+NUMBER_SIGN, NUMBER_ZERO, NUMBER_INTEGER, NUMBER_POINT = 15, 16, 17, 18
+NUMBER_FRACTION, NUMBER_EXPONENT_START, NUMBER_EXPONENT_SIGN, NUMBER_EXPONENT = 19, 20, 21, 22
+# The number states where the number may end.
+NUMBER_ENDS = frozenset((NUMBER_ZERO, NUMBER_INTEGER, NUMBER_FRACTION, NUMBER_EXPONENT))
+
+WHITESPACE = frozenset(" \t\n\r")
+DIGITS = frozenset(string.digits)
+HEX_DIGITS = frozenset(string.hexdigits)
+LITERALS = {"t": "true", "f": "false", "n": "null"}
+ESCAPES = frozenset('"\\/bfnrtu')
+# The type of the value started by each character.
+VALUE_TYPES = {
+    "{": "object",
+    "[": "array",
+    '"': "string",
+    "t": "boolean",
+    "f": "boolean",
+    "n": "null",
+    **{char: "number" for char in "-" + string.digits},
+}
+# The ASCII characters allowed inside a string, where any non-ASCII character is allowed too.
+STRING_CHARACTERS = frozenset(chr(i) for i in range(0x20, 0x7F))
+# The runs of characters that need no check, inside a string or between tokens.
+STRING_RUN = re.compile(r'[^"\\\x00-\x1f]+')
+WHITESPACE_RUN = re.compile(r"[ \t\n\r]+")
+
+
+def compile_schema(schema):
+    """
+    Compile a schema into the nodes used by the tokenizer.
+
+    The schema is a subset of JSON Schema: "type" (a type or a list of types), "properties",
+    "required", "additionalProperties" and "items". A shorthand is accepted as well: a type
+    name such as "string", a list [item_schema], or a dictionary mapping every required
+    property to its schema, as in {"name": "string", "age": "number"}.
+
+    Args:
+        schema: The schema, or None to accept any value.
+
+    Returns:
+        node (dict): The compiled schema, or None to accept any value.
+    """
+    if schema is None or schema is True or schema == {}:
+        return None
+    if isinstance(schema, str):
+        schema = {"type": schema}
+    elif isinstance(schema, list):
+        schema = {"type": "array", "items": schema[0] if schema else None}
+    elif not {"type", "properties", "items", "required", "additionalProperties"} & set(schema):
+        schema = {
+            "type": "object",
+            "properties": schema,
+            "required": list(schema),
+            "additionalProperties": False,
+        }
+
+    types = schema.get("type")
+    if types is None and "properties" in schema:
+        types = "object"
+    elif types is None and "items" in schema:
+        types = "array"
+    integer = False
+    if types is not None:
+        types = {types} if isinstance(types, str) else set(types)
+        integer = "integer" in types and "number" not in types
+        types = frozenset(types | {"number"} if "integer" in types else types)
+
+    properties = {name: compile_schema(value) for name, value in schema.get("properties", {}).items()}
+    required = list(dict.fromkeys(schema.get("required", [])))
+    additional_properties = schema.get("additionalProperties", True)
+    # A trie of the property names, whose leaves hold the (schema, required bit) of each property.
+    key_trie = {}
+    for name, value in properties.items():
+        node = key_trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node[""] = (value, 1 << required.index(name) if name in required else 0)
+    return {
+        "types": types,
+        "integer": integer,
+        "key_trie": key_trie,
+        "restricted_keys": additional_properties is False,
+        "additional": (
+            None
+            if isinstance(additional_properties, bool)
+            else compile_schema(additional_properties)
+        ),
+        "required_mask": (1 << len(required)) - 1,
+        "items": compile_schema(schema.get("items")),
+    }
+
+
 class JSONTokenizer:
-    def __init__(self):
-        self.stack = []  # 用于保存当前的JSON片段，如开始一个对象或数组
-        self.last_token_type = None
-
-    def is_valid(self, current_state, token):
-        # 检查token是否合法，并更新内部状态
-        if self.is_start_of_object(token) and (
-            self.last_token_type in [None, "start_array", "comma", "colon"]
-        ):
-            self.stack.append("object")
-            self.last_token_type = "start_object"
-            return True
-        if self.is_start_of_array(token) and (
-            self.last_token_type in [None, "start_array", "comma", "colon"]
-        ):
-            self.stack.append("array")
-            self.last_token_type = "start_array"
-            return True
-        if self.is_end_of_object(token) and self.stack[-1] == "object":
-            self.stack.pop()
-            self.last_token_type = "end_object"
-            return True
-        if self.is_end_of_array(token) and self.stack[-1] == "array":
-            self.stack.pop()
-            self.last_token_type = "end_array"
-            return True
-        if self.is_key_or_value(token) and (
-            self.last_token_type in ["start_object", "comma"]
-        ):
-            self.last_token_type = "key_or_value"
-            return True
-        if self.is_colon(token) and self.last_token_type == "key_or_value":
-            self.last_token_type = "colon"
-            return True
-        if self.is_comma(token) and self.last_token_type in [
-            "key_or_value",
-            "end_object",
-            "end_array",
-        ]:
-            self.last_token_type = "comma"
+    """
+    A streaming JSON validator, fed with fragments of any size.
+
+    It accepts a text as long as the text is the prefix of a JSON value matching the
+    schema, so the output of a model can be validated while it is produced. Every
+    character is processed in constant time, and the runs of string characters and
+    whitespace are skipped by a single regular expression match. The state is a few
+    integers and references to immutable values, the open objects and arrays being
+    the bits of an integer, so a snapshot is taken and restored in constant time.
+    """
+
+    def __init__(self, schema=None):
+        """
+        Initializes an instance of the JSONTokenizer class.
+
+        Args:
+            schema: The schema of the value, as accepted by compile_schema, or None to accept any value.
+        """
+        self.schema = compile_schema(schema)
+        self.state = VALUE
+        self.position = 0  # The number of characters accepted.
+        self._containers = 0  # A bit per open container, 1 for an object and 0 for an array.
+        self._depth = 0
+        self._literal = ""  # The literal being read, with the index of its next character.
+        self._literal_index = 0
+        self._in_key = False
+        self._key_node = None  # The node of the property names trie matching the key read so far.
+        # The (schema, required bits read, parent frame) of the innermost open container.
+        self._frame = None
+        self._value_schema = self.schema  # The schema of the value expected next.
+
+    @property
+    def stack(self):
+        # The closing characters of the open objects and arrays, the innermost last.
+        return ["}" if self._containers >> i & 1 else "]" for i in range(self._depth - 1, -1, -1)]
+
+    @property
+    def has_content(self):
+        # True once a value was started.
+        return self.state != VALUE or self._depth > 0
+
+    def feed(self, text):
+        """
+        Feed a fragment of text, stopping at the first character that cannot continue the JSON value.
+
+        Args:
+            text (str): The fragment.
+
+        Returns:
+            accepted_number (int): The number of characters of the fragment that were accepted.
+        """
+        i, length = 0, len(text)
+        step = self._step
+        while i < length:
+            state = self.state
+            if state == STRING and self._key_node is None:
+                match = STRING_RUN.match(text, i)
+                if match:
+                    i = match.end()
+                    continue
+            elif state <= DONE and text[i] in WHITESPACE:
+                i = WHITESPACE_RUN.match(text, i).end()
+                continue
+            if not step(text[i]):
+                break
+            i += 1
+        self.position += i
+        return i
+
+    def is_valid(self, token):
+        """
+        Check whether the token continues the JSON value, and feed it if it does.
+
+        Args:
+            token (str): The token.
+
+        Returns:
+            valid (bool): True if the whole token was accepted.
+        """
+        snapshot = self.snapshot()
+        if self.feed(token) == len(token):
+            return True
+        self.restore(snapshot)
+        return False
+
+    def is_complete(self):
+        """
+        Check whether the text fed so far is a complete JSON value.
+        """
+        if self.state in NUMBER_ENDS:
+            # A top-level number is complete, but could still be continued.
+            return self._depth == 0
+        return self.state == DONE
+
+    def snapshot(self):
+        """
+        Get the state of the tokenizer, to restore it later.
+        """
+        return (
+            self.state,
+            self.position,
+            self._containers,
+            self._depth,
+            self._literal,
+            self._literal_index,
+            self._in_key,
+            self._key_node,
+            self._frame,
+            self._value_schema,
+        )
+
+    def restore(self, snapshot):
+        """
+        Restore a state returned by snapshot.
+        """
+        (
+            self.state,
+            self.position,
+            self._containers,
+            self._depth,
+            self._literal,
+            self._literal_index,
+            self._in_key,
+            self._key_node,
+            self._frame,
+            self._value_schema,
+        ) = snapshot
+
+    def allowed_characters(self):
+        """
+        Get the characters that may follow the text fed so far.
+
+        Returns:
+            characters (frozenset): The allowed ASCII characters. A non-ASCII character is
+                allowed where the printable ASCII characters are, inside a string.
+        """
+        state = self.state
+        if state == STRING:
+            if self._key_node is None:
+                return STRING_CHARACTERS
+            characters = {char for char in self._key_node if char}
+            if "" in self._key_node or not self._restricted_keys():
+                characters.add('"')
+            if not self._restricted_keys():
+                characters |= STRING_CHARACTERS
+            return frozenset(characters)
+        if state == STRING_ESCAPE:
+            return ESCAPES
+        if UNICODE <= state < NUMBER_SIGN:
+            return HEX_DIGITS
+        if state == LITERAL:
+            return frozenset(self._literal[self._literal_index])
+
+        if state >= NUMBER_SIGN:
+            if state not in NUMBER_ENDS:
+                return DIGITS | {"+", "-"} if state == NUMBER_EXPONENT_START else DIGITS
+            characters = self._after_value_characters()
+            if state != NUMBER_ZERO:
+                characters |= DIGITS
+            if not self._integer_only():
+                if state == NUMBER_ZERO or state == NUMBER_INTEGER:
+                    characters.add(".")
+                if state != NUMBER_EXPONENT:
+                    characters |= {"e", "E"}
+            return frozenset(characters)
+
+        characters = set(WHITESPACE)
+        if state == VALUE or state == ARRAY_FIRST:
+            types = self._value_schema["types"] if self._value_schema is not None else None
+            characters |= {
+                char for char, value_type in VALUE_TYPES.items() if types is None or value_type in types
+            }
+            if state == ARRAY_FIRST:
+                characters.add("]")
+        elif state == OBJECT_FIRST or state == OBJECT_KEY:
+            characters.add('"')
+            if state == OBJECT_FIRST and self._required_satisfied():
+                characters.add("}")
+        elif state == COLON:
+            characters.add(":")
+        else:
+            characters |= self._after_value_characters()
+        return frozenset(characters)
+
+    def _step(self, char):
+        """
+        Advance the state machine by one character.
+
+        Returns:
+            accepted (bool): False if the character cannot continue the JSON value.
+        """
+        state = self.state
+
+        if state == STRING:
+            if char == '"':
+                return self._end_string()
+            if char < " ":
+                return False
+            if self._key_node is not None:
+                # Follow the key in the trie of the property names, leaving it for an unknown key.
+                node = self._key_node.get(char) if char != "\\" else None
+                if node is None and self._restricted_keys():
+                    return False
+                self._key_node = node
+            if char == "\\":
+                self.state = STRING_ESCAPE
+            return True
+        if state == STRING_ESCAPE:
+            if char not in ESCAPES:
+                return False
+            self.state = UNICODE + 4 if char == "u" else STRING
+            return True
+        if UNICODE <= state < NUMBER_SIGN:
+            if char not in HEX_DIGITS:
+                return False
+            self.state = state - 1 if state > UNICODE + 1 else STRING
+            return True
+        if state == LITERAL:
+            if char != self._literal[self._literal_index]:
+                return False
+            self._literal_index += 1
+            if self._literal_index == len(self._literal):
+                self._end_value()
+            return True
+
+        if state >= NUMBER_SIGN:
+            if self._step_number(char):
+                return True
+            if state not in NUMBER_ENDS:
+                return False
+            # The number ends, the character is read as the one following a value.
+            self._end_value()
+            state = self.state
+
+        if char in WHITESPACE:
+            return True
+
+        if state == VALUE or state == ARRAY_FIRST:
+            if state == ARRAY_FIRST and char == "]":
+                return self._close(char)
+            return self._start_value(char)
+        if state == OBJECT_FIRST or state == OBJECT_KEY:
+            if state == OBJECT_FIRST and char == "}":
+                return self._close(char)
+            if char != '"':
+                return False
+            schema = self._frame[0]
+            self.state = STRING
+            self._in_key = True
+            self._key_node = schema["key_trie"] if schema is not None else None
+            return True
+        if state == COLON:
+            if char != ":":
+                return False
+            self.state = VALUE
             return True
+        if state == AFTER_VALUE:
+            if char == ",":
+                if self._containers & 1:
+                    self.state = OBJECT_KEY
+                else:
+                    self.state = VALUE
+                    self._value_schema = self._item_schema()
+                return True
+            return self._close(char)
         return False
+
+    def _start_value(self, char):
+        """
+        Start a value, if its first character is allowed by the schema.
+        """
+        value_type = VALUE_TYPES.get(char)
+        if value_type is None:
+            return False
+        schema = self._value_schema
+        if schema is not None and schema["types"] is not None and value_type not in schema["types"]:
+            return False
+
+        if char == "{" or char == "[":
+            is_object = char == "{"
+            self._containers = self._containers << 1 | is_object
+            self._depth += 1
+            self._frame = (schema, 0, self._frame)
+            self.state = OBJECT_FIRST if is_object else ARRAY_FIRST
+            if not is_object:
+                self._value_schema = self._item_schema()
+        elif char == '"':
+            self.state = STRING
+            self._in_key = False
+            self._key_node = None
+        elif char in LITERALS:
+            self.state = LITERAL
+            self._literal = LITERALS[char]
+            self._literal_index = 1
+        elif char == "-":
+            self.state = NUMBER_SIGN
+        else:
+            self.state = NUMBER_ZERO if char == "0" else NUMBER_INTEGER
+        return True
+
+    def _step_number(self, char):
+        """
+        Advance a number by one character.
+
+        Returns:
+            accepted (bool): False if the character is not part of the number.
+        """
+        state = self.state
+        if char in DIGITS:
+            if state == NUMBER_ZERO:
+                return False
+            if state == NUMBER_SIGN:
+                self.state = NUMBER_ZERO if char == "0" else NUMBER_INTEGER
+            elif state == NUMBER_POINT:
+                self.state = NUMBER_FRACTION
+            elif state == NUMBER_EXPONENT_START or state == NUMBER_EXPONENT_SIGN:
+                self.state = NUMBER_EXPONENT
+            return True
+        if char == "." and (state == NUMBER_ZERO or state == NUMBER_INTEGER):
+            if self._integer_only():
+                return False
+            self.state = NUMBER_POINT
+            return True
+        if char in "eE" and state in (NUMBER_ZERO, NUMBER_INTEGER, NUMBER_FRACTION):
+            if self._integer_only():
+                return False
+            self.state = NUMBER_EXPONENT_START
+            return True
+        if char in "+-" and state == NUMBER_EXPONENT_START:
+            self.state = NUMBER_EXPONENT_SIGN
+            return True
+        return False
+
+    def _end_string(self):
+        """
+        Move to the state following a string, which is either a key or a value.
+        """
+        if not self._in_key:
+            self._end_value()
+            return True
+
+        schema, required_read, parent = self._frame
+        leaf = self._key_node.get("") if self._key_node is not None else None
+        if leaf is not None:
+            self._value_schema, required_bit = leaf
+            self._frame = (schema, required_read | required_bit, parent)
+        elif schema is not None and schema["restricted_keys"]:
+            return False
+        else:
+            self._value_schema = schema["additional"] if schema is not None else None
+        self._in_key = False
+        self._key_node = None
+        self.state = COLON
+        return True
+
+    def _end_value(self):
+        """
+        Move to the state following a value, the final one once the top-level value is complete.
+        """
+        self.state = AFTER_VALUE if self._depth else DONE
+
+    def _close(self, char):
+        """
+        Close the innermost object or array, if all its required properties were read.
+        """
+        if not self._depth or char != ("}" if self._containers & 1 else "]"):
+            return False
+        if char == "}" and not self._required_satisfied():
+            return False
+        self._containers >>= 1
+        self._depth -= 1
+        self._frame = self._frame[2]
+        self._end_value()
+        return True
+
+    def _after_value_characters(self):
+        """
+        Get the characters allowed after a value, as a new set.
+        """
+        characters = set(WHITESPACE)
+        if not self._depth:
+            return characters
+        characters.add(",")
+        if not self._containers & 1:
+            characters.add("]")
+        elif self._required_satisfied():
+            characters.add("}")
+        return characters
+
+    def _item_schema(self):
+        # The schema of the items of the innermost array.
+        schema = self._frame[0] if self._frame else None
+        return schema["items"] if schema is not None else None
+
+    def _required_satisfied(self):
+        # Whether all the required properties of the innermost object were read.
+        schema, required_read, _ = self._frame
+        return schema is None or required_read == schema["required_mask"]
+
+    def _restricted_keys(self):
+        # Whether the innermost object only accepts the properties of its schema.
+        schema = self._frame[0] if self._frame else None
+        return schema is not None and schema["restricted_keys"]
+
+    def _integer_only(self):
+        # Whether the number being read must be an integer.
+        return self._value_schema is not None and self._value_schema["integer"]
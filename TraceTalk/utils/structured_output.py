@@ -0,0 +1,121 @@
+import json
+
+from src import get_tokens_number
+from utils.json_tokenizer import JSONTokenizer
+
+SYSTEM_PROMPT = "You are a JSON generator. Generate valid JSON only."
+CONTINUE_PROMPT = (
+    "Your answer above stops being valid JSON at its end. "
+    "Continue it from its last character, without repeating it, and generate valid JSON only."
+)
+
+
+def build_messages(prompt, prefix=""):
+    """
+    Build the messages of a generation, asking to continue the prefix if there is one.
+
+    Args:
+        prompt (str): The task, with the schema of the answer.
+        prefix (str): The valid beginning of the answer generated so far.
+
+    Returns:
+        messages (list): The messages sent to the model.
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+    if prefix:
+        messages.append({"role": "assistant", "content": prefix})
+        messages.append({"role": "user", "content": CONTINUE_PROMPT})
+    return messages
+
+
+def stream_valid_prefix(chunks, json_tokenizer, skip_preamble=False):
+    """
+    Feed the streamed chunks of an answer to the tokenizer, until the JSON value is complete or invalid.
+
+    Args:
+        chunks (iterable): The text of the streamed chunks.
+        json_tokenizer (JSONTokenizer): The tokenizer, fed with the answer generated so far.
+        skip_preamble (bool): If True, skip the text before the first "{" or "[", such as a code fence.
+
+    Returns:
+        text (str): The accepted text.
+        valid (bool): False if the answer stopped being valid JSON.
+    """
+    text = ""
+    for chunk in chunks:
+        if skip_preamble:
+            starts = [i for i in (chunk.find("{"), chunk.find("[")) if i >= 0]
+            if not starts:
+                continue
+            chunk = chunk[min(starts) :]
+            skip_preamble = False
+        accepted_number = json_tokenizer.feed(chunk)
+        text += chunk[:accepted_number]
+        if json_tokenizer.is_complete():
+            return text, True
+        if accepted_number < len(chunk):
+            return text, False
+    return text, True
+
+
+def generate_json(
+    client,
+    prompt,
+    schema=None,
+    model="gpt-4o-mini",
+    max_attempts=3,
+    max_tokens=500,
+    temperature=0.7,
+):
+    """
+    Generate a JSON value with a streamed call, validating it while it is generated.
+
+    The whole answer is generated by one call. If it stops being valid JSON, or is cut
+    before its end, the stream is closed and the model is asked to continue from the
+    last valid prefix, so the valid part is never generated twice.
+
+    Args:
+        client (OpenAI): The OpenAI client.
+        prompt (str): The task, with the schema of the answer.
+        schema: The schema the answer is validated against, as accepted by JSONTokenizer, or None for any JSON.
+        model (str): The chat model.
+        max_attempts (int): The maximum number of calls.
+        max_tokens (int): The maximum number of tokens generated by a call.
+        temperature (float): The sampling temperature.
+
+    Returns:
+        value: The parsed JSON value.
+        stats (dict): The number of calls and of prompt tokens.
+    """
+    json_tokenizer = JSONTokenizer(schema)
+    result = ""
+    stats = {"calls_number": 0, "prompt_tokens": 0}
+
+    for _ in range(max_attempts):
+        messages = build_messages(prompt, result)
+        stats["calls_number"] += 1
+        stats["prompt_tokens"] += sum(get_tokens_number(m["content"]) for m in messages)
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+        )
+        chunks = (
+            chunk.choices[0].delta.content
+            for chunk in response
+            if chunk.choices and chunk.choices[0].delta.content
+        )
+        text, _ = stream_valid_prefix(chunks, json_tokenizer, skip_preamble=not result)
+        result += text
+        if hasattr(response, "close"):
+            # Stop the generation as soon as the answer is complete or invalid.
+            response.close()
+        if json_tokenizer.is_complete():
+            return json.loads(result), stats
+
+    raise ValueError(f"No valid JSON generated in {max_attempts} calls: {result}")